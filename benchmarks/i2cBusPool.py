@@ -0,0 +1,49 @@
+"""
+Compares register reads per second on one I2C device when the bus is opened and closed for every access (what
+the drivers used to do) against a handle kept open by the bus pool.
+
+Run it on the board, from the root of the repository:
+    python -m benchmarks.i2cBusPool 11 80 --reg 0 --regs 2 --count 2000
+"""
+import time
+import argparse
+import smbus
+from devices.busPool import I2CBusPool
+
+
+def open_per_call(channel, address, reg, regs, count):
+    start = time.perf_counter()
+    for i in range(count):
+        bus = smbus.SMBus(channel)
+        bus.read_i2c_block_data(address, reg, regs)
+        bus.close()
+    return count / (time.perf_counter() - start)
+
+
+def pooled(channel, address, reg, regs, count):
+    pool = I2CBusPool()
+    start = time.perf_counter()
+    for i in range(count):
+        with pool.acquire(channel) as bus:
+            bus.read_i2c_block_data(address, reg, regs)
+    opsPerSec = count / (time.perf_counter() - start)
+    pool.close()
+    return opsPerSec
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='I2C bus pool benchmark.')
+    parser.add_argument('channel', type=int, help='I2C channel')
+    parser.add_argument('address', type=int, help='I2C address')
+    parser.add_argument('--reg', type=int, default=0, help='Register address to read')
+    parser.add_argument('--regs', type=int, default=1, help='Number of bytes per read')
+    parser.add_argument('--count', type=int, default=1000, help='Number of reads per run')
+
+    args = parser.parse_args()
+
+    before = open_per_call(args.channel, args.address, args.reg, args.regs, args.count)
+    after = pooled(args.channel, args.address, args.reg, args.regs, args.count)
+
+    print('{Name: <14} {Ops: >12.1f} ops/s'.format(Name="open-per-call", Ops=before))
+    print('{Name: <14} {Ops: >12.1f} ops/s'.format(Name="pooled", Ops=after))
+    print('{Name: <14} {Ratio: >12.2f} x'.format(Name="speedup", Ratio=after / before))
@@ -0,0 +1,215 @@
+"""
+Measures the register access times of every driver against the simulated buses of devices.simulation, and the
+startup time of the platforms. Results are printed (or written) as JSON, times in microseconds, with percentiles,
+to compare runs as the drivers change.
+
+Run it from the root of the repository, no board needed:
+    python -m benchmarks.registerAccess --count 500 --output results.json
+    python -m benchmarks.registerAccess --devices LMK03318,TCA9539 --latency 0.0002 --pacing tuned
+
+Measured for each driver:
+- read:    single-field read_param() (not for the write-only LMK01020 and AD5668)
+- write:   single-field write_param()
+- readout: readout_all_registers()
+- apply:   board.configure() of all the writable fields of one device, alternating between two configurations so
+           that every run changes the registers
+Plus the time to create CHARTIER() and BLIET(). The CHARTIER startup includes the sleeps of the reset sequences of the
+LMK03318 and LMK04610 (setup()), which don't depend on the buses.
+
+With --pacing off (default), the settle times of the drivers are set to 0 to measure the driver code itself.
+"""
+import sys
+import json
+import math
+import time
+import logging
+import argparse
+import platform
+from devices.simulation import use_simulation
+from devices.pacing import PACER, TimingPolicy
+from devices.registerDescriptor import READ_WRITE
+from platforms.CHARTIER.CHARTIER import CHARTIER
+from platforms.BLIET.BLIET import BLIET
+from pkg_resources import resource_filename
+
+''' Fields used for the single-field measurements, and the device number used for all of them '''
+BENCH_FIELDS = {
+    "LMK03318": {"read": "VNDRID",   "write": ("PLL_P", 7)},
+    "LMK61E2":  {"read": "VNDRID",   "write": ("NDIV", 40)},
+    "LMK04610": {"read": "VENDORID", "write": ("PLL1EN", 1)},
+    "LMK01020": {"read": None,       "write": ("CLKOUT0_DIV", 4)},
+    "TCA9539":  {"read": "INPUTPORT0", "write": ("OUTPUTPORT0", 0x5A)},
+    "TMP1075":  {"read": "T",        "write": ("F", 2)},
+    "AD5668":   {"read": None,       "write": ("WRITE_TO_AND_UPDATE_DAC", (2, 0x8000))},
+    "ICYSHSR1": {"read": "ASIC_ID",  "write": ("TRIGGER_TYPE", 1)},
+}
+
+''' Arguments of a write through board.configure(), for devices that take more than a value:
+    DAC number first for the AD5668, register offset after the value for the ICYSHSR1 '''
+WRITE_ARGS = {
+    "AD5668":   lambda value: (0, value),
+    "ICYSHSR1": lambda value: (value, 0),
+}
+
+PERCENTILES = (50, 90, 99)
+
+
+def percentile(sortedValues, p):
+    ''' Nearest-rank percentile '''
+    rank = max(1, math.ceil(p / 100.0 * len(sortedValues)))
+    return sortedValues[rank - 1]
+
+
+def summarize(samples, transactions=None):
+    """
+    :param samples: Durations in seconds
+    :param transactions: Number of bus transactions done by all the samples
+    :return: Dictionary of statistics, in microseconds
+    """
+    values = sorted(round(s * 1e6, 3) for s in samples)
+    stats = {"count": len(values),
+             "min": values[0],
+             "mean": round(sum(values) / len(values), 3),
+             "max": values[-1]}
+    for p in PERCENTILES:
+        stats["p" + str(p)] = percentile(values, p)
+    if transactions is not None:
+        stats["transactions"] = transactions / len(values)
+    return stats
+
+
+def measure(sim, count, fn, *args):
+    """
+    Call fn count times and time each call.
+    :return: Statistics, see summarize(), and the number of calls that returned a negative value
+    """
+    samples = []
+    failures = 0
+    before = sum(sim.counts.values())
+    for i in range(count):
+        start = time.perf_counter()
+        ret = fn(*args)
+        samples.append(time.perf_counter() - start)
+        if isinstance(ret, int) and ret < 0:
+            failures += 1
+    stats = summarize(samples, sum(sim.counts.values()) - before)
+    stats["failures"] = failures
+    return stats
+
+
+def full_configs(devName, dev):
+    """
+    Two configurations setting all the writable fields of a device, one at their minimum and one at their maximum.
+    """
+    low = {}
+    high = {}
+    for name, info in dev.REGISTERS.items():
+        if info.access != READ_WRITE:
+            continue
+        if devName in WRITE_ARGS:
+            low[name] = WRITE_ARGS[devName](info.min)
+            high[name] = WRITE_ARGS[devName](info.max)
+        else:
+            low[name] = info.min
+            high[name] = info.max
+    return low, high
+
+
+def bench_device(board, sim, devName, count, fullCount):
+    dev = board[devName]
+    fields = BENCH_FIELDS[devName]
+    results = {}
+
+    if fields["read"]:
+        results["read"] = measure(sim, count, dev.read_param, 0, fields["read"])
+
+    name, value = fields["write"]
+    args = value if isinstance(value, tuple) else (value,)
+    results["write"] = measure(sim, count, dev.write_param, 0, name, *args)
+
+    results["readout"] = measure(sim, fullCount, dev.readout_all_registers, 0)
+
+    configs = full_configs(devName, dev)
+    runs = iter(range(fullCount))
+    results["apply"] = measure(sim, fullCount,
+                               lambda: board.configure({devName: {0: configs[next(runs) % 2]}}))
+    results["apply"]["fields"] = len(configs[0])
+    return results
+
+
+def bench_startup(sim, boardClass, layoutFile, count):
+    boards = []
+
+    def start():
+        boards.append(boardClass(layoutFile=layoutFile))
+
+    stats = measure(sim, count, start)
+    for board in boards:
+        board.close()
+    return stats
+
+
+def run(args):
+    sim = use_simulation(latency=args.latency, byteLatency=args.byte_latency)
+    chartierLayout = resource_filename("platforms.CHARTIER", "device_layout.json")
+    blietLayout = resource_filename("platforms.BLIET", "device_layout.json")
+    sim.populate(chartierLayout)
+    sim.populate(blietLayout)
+
+    if args.pacing != "off":
+        PACER.set_profile(args.pacing)
+
+    board = CHARTIER(layoutFile=chartierLayout)
+    devices = args.devices.split(",") if args.devices else list(BENCH_FIELDS)
+
+    results = {"meta": {"python": platform.python_version(),
+                        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                        "unit": "us",
+                        "count": args.count,
+                        "fullCount": args.full_count,
+                        "startupCount": args.startup_count,
+                        "latency": args.latency,
+                        "byteLatency": args.byte_latency,
+                        "pacing": args.pacing},
+               "devices": {},
+               "platforms": {}}
+
+    for devName in devices:
+        if devName not in BENCH_FIELDS:
+            print("Unknown device " + str(devName) + ", must be one of " + ",".join(BENCH_FIELDS), file=sys.stderr)
+            return None
+        if args.pacing == "off":
+            board[devName].TIMING = TimingPolicy()
+        results["devices"][devName] = bench_device(board, sim, devName, args.count, args.full_count)
+    board.close()
+
+    results["platforms"]["CHARTIER"] = bench_startup(sim, CHARTIER, chartierLayout, args.startup_count)
+    results["platforms"]["BLIET"] = bench_startup(sim, BLIET, blietLayout, args.startup_count)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Register access benchmark of the device drivers, on simulated buses.')
+    parser.add_argument('--count', type=int, default=200, help='Number of runs of the single-field measurements')
+    parser.add_argument('--full-count', type=int, default=20,
+                        help='Number of runs of the readout and apply measurements')
+    parser.add_argument('--startup-count', type=int, default=3,
+                        help='Number of platform creations. CHARTIER() includes the reset pulses of the clocks')
+    parser.add_argument('--devices', default=None, help='Comma separated list of drivers, all of them by default')
+    parser.add_argument('--latency', type=float, default=0.0, help='Simulated time per bus transaction, in seconds')
+    parser.add_argument('--byte-latency', type=float, default=0.0, help='Simulated time per byte, in seconds')
+    parser.add_argument('--pacing', choices=("off",) + PACER.PROFILES, default="off",
+                        help='Settle times of the drivers: off, or a devices.pacing profile')
+    parser.add_argument('--output', default=None, help='Write the JSON results to this file instead of stdout')
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.CRITICAL)
+
+    results = run(args)
+    if results is None:
+        sys.exit(1)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
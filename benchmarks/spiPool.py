@@ -0,0 +1,116 @@
+"""
+Measures what the SPI handle pool saves on a full LMK04610 configuration load, once with the handles of
+devices.busPool.SPIBusPool kept open, once with a handle opened and closed around every access like the drivers used
+to do. Results are printed (or written) as JSON, times in microseconds.
+
+Measured for each pool:
+- fields:    every writable field written with write_param(), one after the other, like the setup scripts do
+- configure: the same fields with board.configure(), which already opened the bus once for the whole batch
+
+Run it from the root of the repository, no board needed:
+    python -m benchmarks.spiPool --count 20 --open-latency 0.00005 --latency 0.00002
+
+The cost of opening a handle (open() and the ioctl() calls setting the mode, speed and bit order) is given by
+--open-latency, measure it on the board with:
+    python -c "import timeit; from periphery import SPI; print(timeit.timeit(lambda: SPI('/dev/spidev3.0', 0, 2000000).close(), number=1000))"
+"""
+import json
+import time
+import logging
+import argparse
+import contextlib
+import platform
+from devices.simulation import use_simulation
+from devices.busPool import SPIBusPool
+from devices.pacing import TimingPolicy
+from platforms.CHARTIER.CHARTIER import CHARTIER
+from benchmarks.registerAccess import measure, full_configs
+from pkg_resources import resource_filename
+
+
+class ReopeningSPIPool(SPIBusPool):
+    """
+        Pool that keeps nothing: a handle is opened and closed around every access, like the drivers did before
+        the pool.
+    """
+
+    @contextlib.contextmanager
+    def acquire(self, key):
+        with self._lock_for(key):
+            handle = self._open(key)
+            try:
+                yield handle
+            finally:
+                handle.close()
+
+
+def write_fields(dev, config):
+    ret = 0
+    for name, value in config.items():
+        if dev.write_param(0, name, value) != 0:
+            ret = -1
+    return ret
+
+
+def timed_loads(sim, count, fn):
+    before = sum(sim.opens.values())
+    stats = measure(sim, count, fn)
+    stats["opens"] = (sum(sim.opens.values()) - before) / count
+    return stats
+
+
+def bench_pool(board, sim, pool, count):
+    dev = board["LMK04610"]
+    dev.SPI_POOL = pool
+    configs = full_configs("LMK04610", dev)
+    results = {}
+
+    runs = iter(range(count))
+    results["fields"] = timed_loads(sim, count, lambda: write_fields(dev, configs[next(runs) % 2]))
+    runs = iter(range(count))
+    results["configure"] = timed_loads(sim, count,
+                                       lambda: board.configure({"LMK04610": {0: configs[next(runs) % 2]}}))
+    results["fields"]["fields"] = results["configure"]["fields"] = len(configs[0])
+    pool.close()
+    return results
+
+
+def run(args):
+    sim = use_simulation(latency=args.latency, openLatency=args.open_latency)
+    layout = resource_filename("platforms.CHARTIER", "device_layout.json")
+    sim.populate(layout)
+
+    board = CHARTIER(layoutFile=layout)
+    board["LMK04610"].TIMING = TimingPolicy()
+
+    results = {"meta": {"python": platform.python_version(),
+                        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                        "unit": "us",
+                        "count": args.count,
+                        "latency": args.latency,
+                        "openLatency": args.open_latency}}
+    results["reopen"] = bench_pool(board, sim, ReopeningSPIPool(), args.count)
+    results["pooled"] = bench_pool(board, sim, SPIBusPool(), args.count)
+    results["speedup"] = dict((load, round(results["reopen"][load]["mean"] / results["pooled"][load]["mean"], 2))
+                              for load in results["pooled"])
+    board.close()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='LMK04610 configuration load with pooled and per-access SPI handles.')
+    parser.add_argument('--count', type=int, default=20, help='Number of configuration loads of each kind')
+    parser.add_argument('--latency', type=float, default=0.0, help='Simulated time per bus transaction, in seconds')
+    parser.add_argument('--open-latency', type=float, default=0.00005,
+                        help='Simulated time to open an SPI handle, in seconds')
+    parser.add_argument('--output', default=None, help='Write the JSON results to this file instead of stdout')
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.CRITICAL)
+
+    results = run(args)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
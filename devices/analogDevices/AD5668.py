@@ -1,6 +1,12 @@
 import time
 import logging
-from periphery import SPI, GPIO
+import numpy as np
+from devices.transport import open_gpio
+from devices.busPool import SPI_POOL
+from devices.pacing import PACER, TimingPolicy
+from devices.busExecutor import EXECUTOR, call_async, run_command
+from devices.instrumentation import INSTRUMENTS, instrumented
+from devices.registerDescriptor import compile_registers, SELF_CLEARING
 
 _logger = logging.getLogger(__name__)
 
@@ -14,6 +20,10 @@ class AD5668:
         - The AD5668 reads data on the FALLING edge of the clocks (SPI MODE 1)
         - All transactions MUST have 32 clock cycles (4 bytes) or else it will be ignored.
         - For quick setup: 'INTERNAL_REF_SETUP = 1' followed by 'WRITE_TO_AND_UPDATE_DAC = Value' you want
+        - set_voltages() sets several outputs at once: the input registers are loaded, then all the outputs change
+          together on the last word (software LDAC). FULL_SCALE must match the reference and the part (-1, -2, -3)
+        - sweep() builds the words of a whole waveform once and plays them at a fixed step period, see
+          devices.dacSweep
 
     """
 
@@ -36,6 +46,21 @@ class AD5668:
     ADDRESS_INFO = []
     GPIO_PINS = {}
 
+    ''' Register table compiled once, used by the read and write paths '''
+    REGISTERS = compile_registers(REGISTERS_INFO)
+
+    SPI_POOL = SPI_POOL
+
+    TIMING = TimingPolicy.from_registers(REGISTERS_INFO, slowParams=["RESET", "INTERNAL_REF_SETUP"])
+    PACER = PACER
+    EXECUTOR = EXECUTOR
+    INSTRUMENTS = INSTRUMENTS
+
+    ''' Outputs of one device, and output voltage of code 0x10000 (reference times the output gain) used by
+        set_voltages(). 5.0 V for the AD5668-2/-3 on their internal 2.5 V reference, 2.5 V for the AD5668-1 '''
+    DAC_COUNT = 8
+    FULL_SCALE = 5.0
+
 
     def __init__(self, path=None, mode=None, name="AD5668", cmdClass=None):
         self.__dict__ = {}
@@ -63,17 +88,13 @@ class AD5668:
             report += ('{DeviceName: <10} :: Path:{Path: >3}, Mode:{Mode: >4}(0x{Mode:02X})\n'.format(DeviceName=self._name, Path=addr['path'], Mode=addr['mode']))
         return report
 
+    @instrumented("write")
     def write_param(self, devNum, paramName, dacNum, value):
-        if not (paramName in self.REGISTERS_INFO):
+        paramInfo = self.REGISTERS.get(paramName)
+        if paramInfo is None:
             _logger.error(str(paramName) + " is an invalid parameter name")
             return -1
 
-        if paramName in self.REGISTERS_INFO:
-            paramInfo = self.REGISTERS_INFO[paramName]
-        else:
-            _logger.error("{paramName} is an unknown parameter.".format(paramName=paramName))
-            return -1
-
         if not self.ADDRESS_INFO:
             _logger.error("No Devices registered. Aborting...")
             return -1
@@ -88,41 +109,176 @@ class AD5668:
                                                                                                                 max=0xF))
             return -1
 
-        if (1 == paramInfo["min"]) and (1 == paramInfo["max"]):
+        if paramInfo.access == SELF_CLEARING:
             _logger.error(str(paramName) + " is a read-only parameter")
             return -1
 
-        if (value < paramInfo["min"]) or (value > paramInfo["max"]):
+        if (value < paramInfo.min) or (value > paramInfo.max):
             _logger.error("{value} is an invalid value for {paramName}. " +
                           "Must be between {min} and {max}".format(value=value,
                                                                    paramName=paramName,
-                                                                   min=paramInfo["min"],
-                                                                   max=paramInfo["max"]))
+                                                                   min=paramInfo.min,
+                                                                   max=paramInfo.max))
             return -1
 
         """Data formating to put into the register"""
-        value <<= paramInfo["loc"]
-        value &= paramInfo["mask"]
+        value <<= paramInfo.loc
+        value &= paramInfo.mask
 
         value = self.register_exceptions(paramInfo, value)
 
         value |= (dacNum << 20)
-        value |= (paramInfo['addr'] << 24)
+        value |= (paramInfo.addr << 24)
 
         try:
-            bus = SPI(spi_path, spi_mode, 1000000)
-            writeBuf = self.int_to_short_list(value, 4, invert=False)
-            _logger.debug("About to write raw data: " + str(writeBuf))
-            bus.transfer(writeBuf)
-            bus.close()
+            with self.SPI_POOL.acquire((spi_path, spi_mode, 1000000, 'msb')) as bus:
+                self.PACER.wait(spi_path)
+                writeBuf = self.int_to_short_list(value, 4, invert=False)
+                if _logger.isEnabledFor(logging.DEBUG):
+                    _logger.debug("About to write raw data: " + str(writeBuf))
+                bus.transfer(writeBuf)
         except Exception as e:
             _logger.error("Could not set message to device. Check connection...")
             _logger.error(e)
             return -1
 
-        time.sleep(0.01)
+        self.PACER.after_write(spi_path, self.TIMING, paramInfo.addrs)
+        return 0
+
+    def to_codes(self, volts):
+        """
+        Convert output voltages to DAC codes, for the FULL_SCALE of the device. The output is code / 65536 of
+        FULL_SCALE, so the top code 0xFFFF is one step under it: voltages from there up to FULL_SCALE give 0xFFFF.
+        :param volts: Voltage or array of voltages, between 0 and FULL_SCALE
+        :return: Array of codes (uint16), None if a voltage is out of range
+        """
+        volts = np.asarray(volts, dtype=np.float64)
+        if np.any(np.isnan(volts)) or np.any(volts < 0) or np.any(volts > self.FULL_SCALE):
+            return None
+        codes = np.minimum(np.rint(volts * (0x10000 / self.FULL_SCALE)), 0xFFFF)
+        return codes.astype(np.uint16)
+
+    @instrumented("apply", "*")
+    def set_voltages(self, devNum, values, codes=False, dacs=None):
+        """
+        Set several outputs of a device at once. Every value is written to its input register, the last one with
+        WRITE_TO_INPUT_REGISTER_UPDATE_ALL, so that all the outputs change together. All the words go in a single
+        SPI session and the device settles once.
+            board.AD5668.set_voltages(0, np.linspace(0.5, 4.0, 8))
+            board.AD5668.set_voltages(1, [0x8000, 0xFFFF], codes=True, dacs=[2, 5])
+        The outputs that are not in dacs are updated too, from what their input register holds.
+        :param devNum: Device number
+        :param values: Voltages (or codes if codes=True), one per DAC of dacs
+        :param codes: True if values are 16-bit codes instead of voltages
+        :param dacs: DAC numbers of the values, all of them (0 to DAC_COUNT-1) if None
+        :return: <0 on failure, 0 on success
+        """
+        if not self.ADDRESS_INFO:
+            _logger.error("No Devices registered. Aborting...")
+            return -1
+
+        dacs = np.arange(self.DAC_COUNT) if dacs is None else np.asarray(dacs, dtype=np.int64).ravel()
+        values = np.asarray(values).ravel()
+        if len(values) != len(dacs) or len(dacs) == 0:
+            _logger.error("Got " + str(len(values)) + " values for " + str(len(dacs)) + " DACs")
+            return -1
+        if np.any(dacs < 0) or np.any(dacs >= self.DAC_COUNT):
+            _logger.error("DAC numbers must be between 0 and " + str(self.DAC_COUNT - 1))
+            return -1
+
+        dacCodes = self._dac_codes(values, codes)
+        if dacCodes is None:
+            return -1
+        frames = self.frames(dacs, dacCodes)[0].tolist()
+
+        spi_path = self.ADDRESS_INFO[devNum]["path"]
+        spi_mode = self.ADDRESS_INFO[devNum]["mode"]
+
+        try:
+            with self.SPI_POOL.acquire((spi_path, spi_mode, 1000000, 'msb')) as bus:
+                self.PACER.wait(spi_path)
+                for writeBuf in frames:
+                    if _logger.isEnabledFor(logging.DEBUG):
+                        _logger.debug("About to write raw data: " + str(writeBuf))
+                    bus.transfer(writeBuf)
+        except Exception as e:
+            _logger.error("Could not set message to device. Check connection...")
+            _logger.error(e)
+            return -1
+
+        self.PACER.after_write(spi_path, self.TIMING, [self.REGISTERS["WRITE_TO_INPUT_REGISTER_UPDATE_ALL"].addr])
         return 0
 
+    def sweep(self, devNum, waveform, period, dacs=None, codes=False, repeat=1):
+        """
+        Prepare a sweep (or any waveform) of some outputs of a device, see devices.dacSweep.DacSweep. The SPI words
+        of every step are built here, once:
+            sweep = board.AD5668.sweep(0, np.linspace(0.0, 2.0, 201), period=0.001, dacs=[3])
+            result = sweep.run()
+        :param devNum: Device number
+        :param waveform: Voltages (or codes if codes=True), one row per step and one column per DAC of dacs. A 1-D
+                         array is one value per step, for a single DAC
+        :param period: Time between two steps, in seconds
+        :param dacs: DAC numbers of the columns, all of them (0 to DAC_COUNT-1) if None
+        :param codes: True if the waveform is made of 16-bit codes instead of voltages
+        :param repeat: Number of times the waveform is played, 0 to play it until stop()
+        :return: DacSweep, not started. None if the waveform is invalid
+        """
+        from devices.dacSweep import DacSweep
+        if not self.ADDRESS_INFO:
+            _logger.error("No Devices registered. Aborting...")
+            return None
+
+        waveform = np.asarray(waveform)
+        if waveform.ndim == 1:
+            waveform = waveform.reshape(-1, 1)
+        dacs = np.arange(self.DAC_COUNT) if dacs is None else np.asarray(dacs, dtype=np.int64).ravel()
+        if waveform.ndim != 2 or waveform.shape[1] != len(dacs) or len(waveform) == 0:
+            _logger.error("Waveform of shape " + str(waveform.shape) + " doesn't match " + str(len(dacs)) + " DACs")
+            return None
+        if np.any(dacs < 0) or np.any(dacs >= self.DAC_COUNT):
+            _logger.error("DAC numbers must be between 0 and " + str(self.DAC_COUNT - 1))
+            return None
+        if period <= 0:
+            _logger.error("The step period must be positive")
+            return None
+
+        dacCodes = self._dac_codes(waveform, codes)
+        if dacCodes is None:
+            return None
+        return DacSweep(self, devNum, self.frames(dacs, dacCodes), period, repeat)
+
+    def _dac_codes(self, values, codes):
+        """
+        :param values: Array of voltages, or of codes if codes is True
+        :return: Array of codes (uint16) of the same shape, None (logged) if a value is out of range
+        """
+        values = np.asarray(values)
+        if codes:
+            if np.any(values < 0) or np.any(values > 0xFFFF) or np.any(values != np.rint(values)):
+                _logger.error("Codes must be integers between 0 and 0xFFFF")
+                return None
+            return values.astype(np.uint16)
+        dacCodes = self.to_codes(values)
+        if dacCodes is None:
+            _logger.error("Voltages must be between 0 and " + str(self.FULL_SCALE) + " V (FULL_SCALE)")
+        return dacCodes
+
+    def frames(self, dacs, dacCodes):
+        """
+        Build the SPI words setting DACs to codes, all the outputs changing together on the last word of each step
+        (WRITE_TO_INPUT_REGISTER for the others, WRITE_TO_INPUT_REGISTER_UPDATE_ALL for the last one).
+        :param dacs: DAC numbers, one per column of dacCodes
+        :param dacCodes: Codes, one row per step (or a single row)
+        :return: Array of uint8 of shape (steps, len(dacs), 4), big endian words
+        """
+        dacCodes = np.asarray(dacCodes, dtype=np.uint32).reshape(-1, len(dacs))
+        commands = np.full(len(dacs), self.REGISTERS["WRITE_TO_INPUT_REGISTER"].addr, dtype=np.uint32)
+        commands[-1] = self.REGISTERS["WRITE_TO_INPUT_REGISTER_UPDATE_ALL"].addr
+        ''' One 32-bit word per DAC: command, DAC number, then the code '''
+        words = (commands << 24) | (np.asarray(dacs, dtype=np.uint32) << 20) | (dacCodes << 4)
+        return words.astype(">u4").view(np.uint8).reshape(len(dacCodes), len(dacs), 4)
+
     """
     Converts an integer to a list of byte-size shorts.
     Ex:    idx          0     1     2
@@ -148,6 +304,20 @@ class AD5668:
     def register_exceptions(self, paramInfo, value):
         return value
 
+    def awrite(self, devNum, paramName, dacNum, value):
+        """
+        Awaitable write, see aread().
+        :return: asyncio Future of the result, <0 on failure, 0 on success
+        """
+        return call_async(self, devNum, run_command, self, paramName, devNum, dacNum, value)
+
+    def aselftest(self, devNum):
+        """
+        Awaitable selftest, see aread().
+        :return: asyncio Future of the result of selftest()
+        """
+        return call_async(self, devNum, self.selftest, devNum)
+
     def selftest(self, devNum):
         # ad5668 is write-only, skip self-test
         return 1
@@ -0,0 +1,157 @@
+import asyncio
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+_logger = logging.getLogger(__name__)
+
+
+def bus_key(dev, devNum):
+    """
+    Find the physical bus a device is on, from its ADDRESS_INFO. Devices can give their own with a bus_key(devNum)
+    method.
+    Ex: {'ch': 10, 'addr': 88}              --> ('i2c', 10)
+        {'path': '/dev/spidev1.1', 'mode': 0} --> ('spi', '/dev/spidev1')  (chip selects of one controller share it)
+        {'devNum': 0}                       --> ('axi', 'ICYSHSR1')
+    :param dev: Device instance
+    :param devNum: Device number
+    :return: Hashable bus identifier
+    """
+    if hasattr(dev, "bus_key"):
+        return dev.bus_key(devNum)
+
+    addressInfo = dev.ADDRESS_INFO
+    if isinstance(addressInfo, dict):
+        info = addressInfo
+    elif addressInfo and devNum < len(addressInfo):
+        info = addressInfo[devNum]
+    else:
+        info = {}
+
+    if "ch" in info:
+        return ("i2c", info["ch"])
+    elif "path" in info:
+        return ("spi", str(info["path"]).split(".")[0])
+    elif "devNum" in info:
+        return ("axi", dev.DEVICE_NAME)
+    return ("gpio",)
+
+
+class BusExecutor:
+    """
+        Runs work on one worker thread per physical bus, so that operations on devices that are on different buses
+        run in parallel, while everything on the same bus stays serialized, in submission order.
+
+        User Notes:
+        - Workers are started on first use and stopped by shutdown() (platforms do it in their close())
+        - run() waits for all the jobs. An exception in a job is logged and gives -1 as result, like the drivers do
+        - Nothing is ordered between buses. If a device must be configured before another one on a different bus,
+          run them in two separate calls
+        - submit_async() and run_async() give the same from a coroutine. The drivers' aread(), awrite() and
+          aselftest() use them, so one event loop can drive many devices and boards without blocking
+    """
+
+    def __init__(self):
+        self._workers = {}
+        self._lock = threading.Lock()
+
+    def _worker(self, key):
+        with self._lock:
+            worker = self._workers.get(key)
+            if worker is None:
+                worker = ThreadPoolExecutor(max_workers=1, thread_name_prefix="bus-" + "-".join(str(k) for k in key))
+                self._workers[key] = worker
+            return worker
+
+    def submit(self, key, fn, *args, **kwargs):
+        """
+        Queue a call on the worker of a bus.
+        :param key: Bus identifier, see bus_key()
+        :param fn: Function to call
+        :return: concurrent.futures.Future
+        """
+        return self._worker(key).submit(fn, *args, **kwargs)
+
+    def submit_async(self, key, fn, *args, **kwargs):
+        """
+        Same as submit(), for a coroutine: the call runs on the worker of the bus and the event loop is free while
+        it runs.
+            value = await executor.submit_async(("i2c", 11), dev.read_param, 0, "LOL")
+        :return: asyncio Future
+        """
+        return asyncio.wrap_future(self.submit(key, fn, *args, **kwargs))
+
+    def run(self, jobs):
+        """
+        Run a list of jobs, each on the worker of its bus, and wait for all of them.
+        :param jobs: List of (key, fn, args)
+        :return: List of results, in the order of the jobs
+        """
+        futures = [self.submit(key, fn, *args) for key, fn, args in jobs]
+        results = []
+        for (key, fn, args), future in zip(jobs, futures):
+            try:
+                results.append(future.result())
+            except Exception as e:
+                _logger.error("Job " + str(getattr(fn, "__name__", fn)) + str(args) + " on bus " + str(key) + " failed")
+                _logger.error(e)
+                results.append(-1)
+        return results
+
+    async def run_async(self, jobs):
+        """
+        Awaitable version of run().
+        :param jobs: List of (key, fn, args)
+        :return: List of results, in the order of the jobs
+        """
+        results = await asyncio.gather(*[self.submit_async(key, fn, *args) for key, fn, args in jobs],
+                                       return_exceptions=True)
+        for i, ((key, fn, args), ret) in enumerate(zip(jobs, results)):
+            if isinstance(ret, Exception):
+                _logger.error("Job " + str(getattr(fn, "__name__", fn)) + str(args) + " on bus " + str(key) + " failed")
+                _logger.error(ret)
+                results[i] = -1
+        return results
+
+    def shutdown(self):
+        """
+        Stop all the workers, after they finish their queued jobs.
+        :return: None
+        """
+        with self._lock:
+            workers = list(self._workers.values())
+            self._workers = {}
+        for worker in workers:
+            worker.shutdown(wait=True)
+
+    def __len__(self):
+        return len(self._workers)
+
+
+def run_command(dev, paramName, *args):
+    """
+    Call the accessor of a register of a device, as board.DEVICE.PARAM(*args) does. Goes to the device or to the
+    remote server, depending on the command class the device was created with.
+    :return: Result of the accessor, -1 if the parameter doesn't exist
+    """
+    command = dev.__dict__.get(paramName)
+    if command is None:
+        _logger.error(str(paramName) + " is an invalid parameter name")
+        return -1
+    return command(*args)
+
+
+def call_async(dev, devNum, fn, *args):
+    """
+    Run a blocking call about a device on the worker of its bus, see BusExecutor.submit_async().
+    :param dev: Device instance. Its EXECUTOR is used
+    :param devNum: Device number
+    :param fn: Function to call
+    :return: asyncio Future
+    """
+    return dev.EXECUTOR.submit_async(bus_key(dev, devNum), fn, *args)
+
+
+''' Executor used by drivers that were not given one by a platform. Drivers keep it in their EXECUTOR class attribute,
+    it runs their awaitable accesses (aread, awrite, aselftest) '''
+EXECUTOR = BusExecutor()
@@ -0,0 +1,129 @@
+import threading
+import logging
+import contextlib
+from devices.transport import open_i2c, open_spi
+
+_logger = logging.getLogger(__name__)
+
+
+class BusPool:
+    """
+        Keeps one open handle per bus, shared by every device on that bus, instead of opening and closing the bus
+        device file on every register access.
+
+        User Notes:
+        - Handles are opened on first use and stay open until close() is called (platforms close their pools
+          in their own close())
+        - Each bus has its own lock, held for the whole 'with' block of acquire(). A read-modify-write done inside
+          one block can't be interleaved with another thread's access to the same bus
+        - If anything inside the block raises an OSError, the handle is considered stale: it is closed and a new
+          one is opened on the next access
+    """
+
+    def __init__(self, opener):
+        self._opener = opener
+        self._handles = {}
+        self._locks = {}
+        self._poolLock = threading.Lock()
+
+    def _lock_for(self, key):
+        with self._poolLock:
+            lock = self._locks.get(key)
+            if lock is None:
+                lock = threading.RLock()
+                self._locks[key] = lock
+            return lock
+
+    def _open(self, key):
+        return self._opener(key)
+
+    @contextlib.contextmanager
+    def acquire(self, key):
+        """
+        Lock the bus and give back its handle, opening it if needed.
+        :param key: Bus identifier (I2C channel number for I2C)
+        :return: Context manager giving the open handle
+        """
+        with self._lock_for(key):
+            handle = self._handles.get(key)
+            if handle is None:
+                handle = self._open(key)
+                self._handles[key] = handle
+                _logger.debug("Opened bus handle for " + str(key))
+            try:
+                yield handle
+            except OSError:
+                self.discard(key)
+                raise
+
+    def discard(self, key):
+        """
+        Close the handle of a bus, a new one will be opened on the next access.
+        :param key: Bus identifier
+        :return: None
+        """
+        with self._lock_for(key):
+            handle = self._handles.pop(key, None)
+            if handle is not None:
+                try:
+                    handle.close()
+                except Exception as e:
+                    _logger.debug("Error while closing stale bus handle " + str(key) + ": " + str(e))
+
+    def close(self):
+        """
+        Close all the handles of the pool.
+        :return: None
+        """
+        for key in list(self._handles):
+            self.discard(key)
+
+    def __contains__(self, key):
+        return key in self._handles
+
+    def __len__(self):
+        return len(self._handles)
+
+
+class I2CBusPool(BusPool):
+    """
+        Pool of smbus handles, keyed by I2C channel number. By default, handles come from the installed transport,
+        see devices.transport.
+    """
+
+    def __init__(self, opener=None):
+        if opener is None:
+            opener = open_i2c
+        super().__init__(opener)
+
+
+class SPIBusPool(BusPool):
+    """
+        Pool of SPI handles, keyed by (path, mode, maxSpeed, bitOrder), since the settings are given when the handle
+        is opened. By default, handles come from the installed transport, see devices.transport.
+            with SPI_POOL.acquire(("/dev/spidev3.0", 0, 2000000, "msb")) as spi:
+                spi.transfer([0x80, 0x00, 0x00])
+
+        User Notes:
+        - Handles with different settings on the same path share one lock, so the transfers of two devices (or two
+          drivers) on one chip select can't be interleaved
+    """
+
+    def __init__(self, opener=None):
+        if opener is None:
+            opener = self._open_spi
+        super().__init__(opener)
+
+    @staticmethod
+    def _open_spi(key):
+        path, mode, maxSpeed, bitOrder = key
+        return open_spi(path, mode, maxSpeed, bit_order=bitOrder)
+
+    def _lock_for(self, key):
+        return super()._lock_for(key[0])
+
+
+''' Pools used by drivers that were not given one by a platform. Drivers keep theirs in the I2C_POOL / SPI_POOL class
+    attributes, so the open handles of a bus are shared by all the devices on it (see CHARTIER.attach_bus_pools()) '''
+I2C_POOL = I2CBusPool()
+SPI_POOL = SPIBusPool()
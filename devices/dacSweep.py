@@ -0,0 +1,173 @@
+import time
+import threading
+import logging
+from collections import namedtuple
+import numpy as np
+
+_logger = logging.getLogger(__name__)
+
+''' Below this much time before a deadline, the sweep spins instead of sleeping (sleep() overshoots by ~0.1 ms) '''
+SPIN_TIME = 0.0005
+
+
+class SweepResult(namedtuple("SweepResult", ["steps", "period", "duration", "lateMean", "lateMax", "jitter",
+                                             "overruns", "ok"])):
+    """
+        Timing of a sweep, in seconds.
+
+        - steps: Number of steps sent
+        - lateMean, lateMax: Delay between the deadline of a step and the start of its first transfer
+        - jitter: Standard deviation of the time between the starts of two consecutive steps
+        - overruns: Steps that started more than one period late (the step before took too long)
+        - ok: False if the sweep stopped on a bus error
+    """
+    __slots__ = ()
+
+    def to_dict(self):
+        return self._asdict()
+
+
+class DacSweep:
+    """
+        Plays a waveform on the outputs of one AD5668, one step every period. Created by AD5668.sweep():
+            sweep = board.AD5668.sweep(0, np.linspace(0.0, 2.0, 201), period=0.001, dacs=[3])
+            result = sweep.run()
+            print(result.jitter, result.lateMax)
+
+        User Notes:
+        - All the SPI words are built when the sweep is created, in one buffer (frames). Playing a step only sends
+          its words, there is no validation or conversion left
+        - Steps are paced against absolute deadlines (start + n * period): a late step doesn't delay the next ones.
+          The wait sleeps, then spins for the last SPIN_TIME
+        - The SPI handle (and the lock of its bus) is held for the whole sweep, other devices on the same SPI path
+          wait until it is over
+        - start() plays the sweep in a background thread, stop() ends it after the current step
+    """
+
+    def __init__(self, device, devNum, frames, period, repeat=1):
+        """
+        :param device: AD5668 driver
+        :param devNum: Device number
+        :param frames: Array of uint8 of shape (steps, words per step, 4), the SPI words of every step
+        :param period: Time between two steps, in seconds
+        :param repeat: Number of times the waveform is played, 0 to play it until stop()
+        """
+        self.device = device
+        self.devNum = devNum
+        self.frames = np.ascontiguousarray(frames, dtype=np.uint8)
+        self.period = period
+        self.repeat = repeat
+        self.starts = None
+        self.result = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def steps(self):
+        return len(self.frames)
+
+    def run(self):
+        """
+        Play the sweep and wait until it is over.
+        :return: SweepResult
+        """
+        self._stop.clear()
+        return self._play()
+
+    def _play(self):
+        dev = self.device
+        spi_path = dev.ADDRESS_INFO[self.devNum]["path"]
+        spi_mode = dev.ADDRESS_INFO[self.devNum]["mode"]
+
+        buf = self.frames.tobytes()
+        stepBytes = self.frames.shape[1] * 4
+        total = self.steps * self.repeat if self.repeat else None
+        starts = []
+        deadlines = []
+        ok = True
+
+        try:
+            with dev.SPI_POOL.acquire((spi_path, spi_mode, 1000000, 'msb')) as bus:
+                dev.PACER.wait(spi_path)
+                t0 = time.perf_counter()
+                n = 0
+                while (total is None or n < total) and not self._stop.is_set():
+                    deadline = t0 + n * self.period
+                    remaining = deadline - time.perf_counter()
+                    if remaining > SPIN_TIME:
+                        time.sleep(remaining - SPIN_TIME)
+                    while time.perf_counter() < deadline:
+                        pass
+                    starts.append(time.perf_counter())
+                    deadlines.append(deadline)
+                    offset = (n % self.steps) * stepBytes
+                    for i in range(offset, offset + stepBytes, 4):
+                        bus.transfer(buf[i:i + 4])
+                    n += 1
+        except Exception as e:
+            _logger.error("Sweep of device " + str(self.devNum) + " stopped after " + str(len(starts)) + " steps. Check connection...")
+            _logger.error(e)
+            ok = False
+
+        dev.PACER.after_write(spi_path, dev.TIMING, [dev.REGISTERS["WRITE_TO_INPUT_REGISTER_UPDATE_ALL"].addr])
+        self.starts = np.array(starts)
+        self.result = self._report(self.starts, np.array(deadlines), ok)
+        return self.result
+
+    def _report(self, starts, deadlines, ok):
+        if len(starts) == 0:
+            return SweepResult(0, self.period, 0.0, 0.0, 0.0, 0.0, 0, ok)
+        late = starts - deadlines
+        intervals = np.diff(starts)
+        return SweepResult(steps=len(starts),
+                           period=self.period,
+                           duration=float(starts[-1] - starts[0]),
+                           lateMean=float(late.mean()),
+                           lateMax=float(late.max()),
+                           jitter=float(intervals.std()) if len(intervals) else 0.0,
+                           overruns=int(np.count_nonzero(late > self.period)),
+                           ok=ok)
+
+    def start(self):
+        """
+        Play the sweep in a background thread, see wait() and stop().
+        :return: None
+        """
+        if self._thread is not None:
+            return
+        ''' Cleared here and not in the thread, a stop() right after start() would be lost otherwise '''
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._play, name="AD5668-sweep", daemon=True)
+        self._thread.start()
+
+    def wait(self, timeout=None):
+        """
+        Wait for a sweep started with start() to be over.
+        :param timeout: Longest wait in seconds, None to wait for ever
+        :return: SweepResult, None if the sweep is still running
+        """
+        if self._thread is not None:
+            self._thread.join(timeout)
+            if self._thread.is_alive():
+                return None
+            self._thread = None
+        return self.result
+
+    def stop(self):
+        """
+        End the sweep after the current step.
+        :return: SweepResult
+        """
+        self._stop.set()
+        return self.wait()
+
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+        return False
@@ -1,7 +1,6 @@
 import time
-import smbus
 import logging
-from periphery import GPIO
+from devices.transport import open_gpio
 
 _logger = logging.getLogger(__name__)
 
@@ -57,7 +56,7 @@ class DIP:
             pinNum = self.GPIO_PINS[0][pinName]
 
             try:
-                g = GPIO(pinNum, "out")
+                g = open_gpio(pinNum, "out")
                 value = g.read()
                 g.close()
             except Exception as e:
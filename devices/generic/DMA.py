@@ -5,14 +5,19 @@ import struct
 import sys
 import ctypes, ctypes.util
 from ctypes import *
+from devices.transport import load_library
+from devices.busExecutor import EXECUTOR
 
 _logger = logging.getLogger(__name__)
 
 class DMA:
 
+    ''' Workers running the awaitable acquisitions, see devices.busExecutor '''
+    EXECUTOR = EXECUTOR
+
     def __init__(self, cmdClass=None):
         try:
-            self.clib = ctypes.CDLL("/usr/lib/dma-consumer.so")
+            self.clib = load_library("/usr/lib/dma-consumer.so")
         except Exception as e:
             _logger.error("Could not load DMA shared library with error :")
             _logger.error(e)
@@ -49,6 +54,24 @@ class DMA:
             _logger.error("Acquisition ended with an error...")
 
 
+    def astart_data_acquisition(self, headNum, acqId, maxSamples=-1, maxTime=-1, maxEmptyTimeout=-1):
+        """
+        Awaitable start_data_acquisition(), on a worker of its own per head so the event loop keeps running during
+        the acquisition. Stop it with stop_data_acquisition(), called directly.
+        :return: asyncio Future
+        """
+        return self.EXECUTOR.submit_async(("dma", headNum), self.start_data_acquisition,
+                                          headNum, acqId, maxSamples, maxTime, maxEmptyTimeout)
+
+    def astart_data_acquisition_HDF(self, headNum, filename, groupName, datasetName, maxSamples, maxEmptyTimeout=-1, type=1, compression=0):
+        """
+        Awaitable start_data_acquisition_HDF(), see astart_data_acquisition().
+        :return: asyncio Future
+        """
+        return self.EXECUTOR.submit_async(("dma", headNum), self.start_data_acquisition_HDF,
+                                          headNum, filename, groupName, datasetName, maxSamples, maxEmptyTimeout,
+                                          type, compression)
+
     def stop_data_acquisition(self):
         self.clib.stop_acquisition()
         _logger.info("Stopped acquisition")
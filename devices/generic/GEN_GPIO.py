@@ -1,7 +1,6 @@
 import time
-import smbus
 import logging
-from periphery import GPIO
+from devices.transport import open_gpio
 
 _logger = logging.getLogger(__name__)
 
@@ -50,7 +49,7 @@ class GEN_GPIO:
 
         if name in self.GPIO_PINS[0]:
             pin = self.GPIO_PINS[0][name]
-            g = GPIO(pin, "out")
+            g = open_gpio(pin, "out")
             g.write(value)
             g.close()
         else:
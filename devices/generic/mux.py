@@ -1,5 +1,5 @@
 import logging
-from periphery import GPIO
+from devices.transport import open_gpio
 
 _logger = logging.getLogger(__name__)
 
@@ -55,7 +55,7 @@ class MUX:
 
         if name in self.GPIO_PINS:
             pin = self.GPIO_PINS[name]
-            g = GPIO(pin, "out")
+            g = open_gpio(pin, "out")
             g.write(value)
             g.close()
         else:
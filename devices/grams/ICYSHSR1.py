@@ -1,8 +1,11 @@
 import time
-import smbus
 import logging
-from periphery import GPIO
+from devices.transport import open_gpio, load_library
+from devices.pacing import PACER, TimingPolicy
+from devices.busExecutor import EXECUTOR, call_async, run_command
+from devices.instrumentation import INSTRUMENTS, instrumented
 from ctypes import *
+from devices.registerDescriptor import compile_registers, READ_ONLY
 
 _logger = logging.getLogger(__name__)
 
@@ -123,13 +126,23 @@ class ICYSHSR1:
     ADDRESS_INFO = []
     GPIO_PINS = {}
 
+    ''' Register table compiled once, used by the read and write paths '''
+    REGISTERS = compile_registers(REGISTERS_INFO, wordBits=32)
+
+    ''' Settle times on the AXI path, see devices.pacing. Both ASICs share it, so it is paced as a single bus.
+        Reads are still spaced by 10 ms, fetchTwiceAndCheck relies on it '''
+    TIMING = TimingPolicy(readDelay=0.01, writeDelay=0.01)
+    PACER = PACER
+    EXECUTOR = EXECUTOR
+    INSTRUMENTS = INSTRUMENTS
+
     def __init__(self, DLLName="icyshsr1-lib.so", name="ICYSHSR1", cmdClass=None):
         self.__dict__ = {}
         self._name = name
         self.previousOutputMuxValue = 0
         self.currentPP = 0
         try:
-            self.libc = CDLL(DLLName)
+            self.libc = load_library(DLLName)
         except Exception as e:
             self.libc = None
             if cmdClass:
@@ -168,26 +181,23 @@ class ICYSHSR1:
         return self.__dict__[key]
 
 
+    def _ic_read(self, ic_dev_num, addr, prevMux, currPP):
+        self.PACER.wait(self.DEVICE_NAME)
+        retval = self.libc.ic_read(c_ushort(ic_dev_num),
+                                   c_ulonglong(addr),
+                                   c_ushort(prevMux),
+                                   c_ushort(currPP))
+        self.PACER.after_read(self.DEVICE_NAME, self.TIMING)
+        return retval
+
     def fetchTwiceAndCheck(self, ic_dev_num, addr, prevMux, currPP):
-        retval1 = self.libc.ic_read(c_ushort(ic_dev_num),
-                                    c_ulonglong(addr),
-                                    c_ushort(prevMux),
-                                    c_ushort(currPP))
-        time.sleep(0.01)
-        retval2 = self.libc.ic_read(c_ushort(ic_dev_num),
-                                    c_ulonglong(addr),
-                                    c_ushort(prevMux),
-                                    c_ushort(currPP))
-        time.sleep(0.01)
+        retval1 = self._ic_read(ic_dev_num, addr, prevMux, currPP)
+        retval2 = self._ic_read(ic_dev_num, addr, prevMux, currPP)
         if (retval1 == retval2):
             return retval1
         else:
             _logger.warning("Error in command comms, fetching again")
-            retval3 = self.libc.ic_read(c_ushort(ic_dev_num),
-                                        c_ulonglong(addr),
-                                        c_ushort(prevMux),
-                                        c_ushort(currPP))
-            time.sleep(0.01)
+            retval3 = self._ic_read(ic_dev_num, addr, prevMux, currPP)
             if (retval1 == retval3):
                 return retval1
             else:
@@ -196,14 +206,14 @@ class ICYSHSR1:
 
 
 
+    @instrumented("read")
     def read_param(self, devNum, paramName, register_offset=0):
-        if not (paramName in self.REGISTERS_INFO):
+        paramInfo = self.REGISTERS.get(paramName)
+        if paramInfo is None:
             _logger.error(str(paramName) + " is an invalid parameter name")
             return -1
 
-        paramInfo = self.REGISTERS_INFO[paramName]
-
-        if register_offset > paramInfo['regs'] - 1:
+        if register_offset > paramInfo.regs - 1:
             _logger.error("Offset too high, aborting...")
             return -1
 
@@ -211,90 +221,103 @@ class ICYSHSR1:
 
         retval = c_ulonglong(0)
         try:
-            #retval = self.libc.ic_read(c_ushort(ic_dev_num), c_ulonglong(paramInfo['addr'] + register_offset), c_ushort(self.previousOutputMuxValue), c_ushort(self.currentPP))
-            retval = self.fetchTwiceAndCheck(ic_dev_num, (paramInfo['addr'] + register_offset), self.previousOutputMuxValue, self.currentPP)
+            #retval = self.libc.ic_read(c_ushort(ic_dev_num), c_ulonglong(paramInfo.addr + register_offset), c_ushort(self.previousOutputMuxValue), c_ushort(self.currentPP))
+            retval = self.fetchTwiceAndCheck(ic_dev_num, (paramInfo.addr + register_offset), self.previousOutputMuxValue, self.currentPP)
             _logger.info("Read data and reset output mux to " + str(self.previousOutputMuxValue))
         except Exception as e:
             _logger.error("could not read from IC:")
             _logger.error(e)
             return -1
 
-        retval &= paramInfo['mask']
-        retval >>= paramInfo['loc']
+        retval &= paramInfo.mask
+        retval >>= paramInfo.loc
 
-        time.sleep(0.01)
+        self.PACER.after_read(self.DEVICE_NAME, self.TIMING)
         return (retval & 0xFFFFFFFF)
 
+    @instrumented("write")
     def write_param(self, devNum, paramName, value, register_offset=0):
-        if not (paramName in self.REGISTERS_INFO):
+        paramInfo = self.REGISTERS.get(paramName)
+        if paramInfo is None:
             _logger.error(str(paramName) + " is an invalid parameter name")
             return -1
 
-        if paramName in self.REGISTERS_INFO:
-            paramInfo = self.REGISTERS_INFO[paramName]
-        elif paramName in self.GPIO_PINS[devNum]:
-            self.gpio_set(devNum=devNum, name=paramName, value=value)
-            return 0
-        else:
-            _logger.error("{paramName} is an unknown parameter or pin name.".format(paramName=paramName))
-            return -1
-
         if not self.ADDRESS_INFO:
             _logger.error("No Devices registered. Aborting...")
             return -1
 
-        if (0 == paramInfo["min"]) and (0 == paramInfo["max"]):
+        if paramInfo.access == READ_ONLY:
             _logger.error(str(paramName) + " is a read-only parameter")
             return -1
 
-        if (value < paramInfo["min"]) or (value > paramInfo["max"]):
+        if (value < paramInfo.min) or (value > paramInfo.max):
             _logger.error(
                 "{value} is an invalid value for {paramName}. Must be between {min} and {max}".format(value=value,
                                                                                                       paramName=paramName,
-                                                                                                      min=paramInfo[
-                                                                                                          "min"],
-                                                                                                      max=paramInfo[
-                                                                                                          "max"]))
+                                                                                                      min=paramInfo.min,
+                                                                                                      max=paramInfo.max))
             return -1
 
-        paramInfo = self.REGISTERS_INFO[paramName]
-
-        if register_offset > paramInfo['regs'] - 1:
+        if register_offset > paramInfo.regs - 1:
             _logger.error("Offset too high, aborting...")
             return -1
 
 
         # Positions to appropriate bits
-        value <<= paramInfo["loc"]
+        value <<= paramInfo.loc
         # Restrain to concerned bits
-        value &= paramInfo["mask"]
+        value &= paramInfo.mask
 
         value = self.register_exceptions(paramInfo, value)
         ic_dev_num = self.ADDRESS_INFO[devNum]['devNum']
 
         #curr_value = self.read_param(devNum=devNum, paramName=paramName, register_offset=register_offset)
-        curr_value = self.fetchTwiceAndCheck(ic_dev_num, (paramInfo['addr'] + register_offset),
+        curr_value = self.fetchTwiceAndCheck(ic_dev_num, (paramInfo.addr + register_offset),
                                    self.previousOutputMuxValue, self.currentPP)
 
-        curr_value_filtered = curr_value & ((~paramInfo["mask"]) & 0xFFFFFFFF)
+        curr_value_filtered = curr_value & paramInfo.invMask
 
-        value = ((paramInfo['addr'] + register_offset) << 32) | (value | curr_value_filtered)
+        value = ((paramInfo.addr + register_offset) << 32) | (value | curr_value_filtered)
 
+        self.PACER.wait(self.DEVICE_NAME)
         self.libc.ic_write(c_ushort(ic_dev_num), c_ulonglong(value))
 
-        time.sleep(0.01)
+        self.PACER.after_write(self.DEVICE_NAME, self.TIMING)
         return 0
 
     # Here are all the formatting exceptions for registers.
     def register_exceptions(self, paramInfo, value):
         
-        if ((paramInfo['addr'] == 1) and (paramInfo['loc'] == 0)):
+        if ((paramInfo.addr == 1) and (paramInfo.loc == 0)):
             if value != 2:
                 self.previousOutputMuxValue = value
-        elif((paramInfo['addr'] == 1) and (paramInfo['loc'] == 16)):
+        elif((paramInfo.addr == 1) and (paramInfo.loc == 16)):
             self.currentPP = (value >> 16)
         return value
 
+    def aread(self, devNum, paramName, register_offset=0):
+        """
+        Awaitable read, run on the worker of the bus of the device (see devices.busExecutor), so that one event loop
+        can drive many devices at once:
+            value = await board.ICYSHSR1.aread(0, "ASIC_ID")
+        :return: asyncio Future of the value, -1 on failure
+        """
+        return call_async(self, devNum, run_command, self, paramName, devNum, register_offset)
+
+    def awrite(self, devNum, paramName, value, register_offset=0):
+        """
+        Awaitable write, see aread().
+        :return: asyncio Future of the result, <0 on failure, 0 on success
+        """
+        return call_async(self, devNum, run_command, self, paramName, devNum, value, register_offset)
+
+    def aselftest(self, devNum):
+        """
+        Awaitable selftest, see aread().
+        :return: asyncio Future of the result of selftest()
+        """
+        return call_async(self, devNum, self.selftest, devNum)
+
     def selftest(self, devNum):
 
         if self.libc == None:
@@ -345,7 +368,7 @@ class ICYSHSR1:
 
         if name in self.GPIO_PINS[devNum]:
             pin = self.GPIO_PINS[devNum][name]
-            g = GPIO(pin, "out")
+            g = open_gpio(pin, "out")
             g.write(value)
             g.close()
         else:
@@ -0,0 +1,242 @@
+import json
+import time
+import bisect
+import logging
+import functools
+import threading
+from collections import namedtuple
+from devices.busExecutor import bus_key
+
+_logger = logging.getLogger(__name__)
+
+''' Upper bounds of the latency histogram buckets, in microseconds (1 us to ~1 s, doubling), plus one for the rest '''
+HISTOGRAM_BOUNDS = [2 ** i for i in range(21)]
+
+
+class AccessEvent(namedtuple("AccessEvent", ["device", "devNum", "register", "op", "bytes", "bus", "start",
+                                             "duration", "ok"])):
+    """
+        One instrumented register access, given to the tracer.
+
+        - register: Field name, or "*" for accesses to many registers (snapshot, apply)
+        - op: "read", "write", "snapshot", "apply"
+        - bus: Bus of the device, see devices.busExecutor.bus_key()
+        - start, duration: time.perf_counter() at the call, and duration of the call, in seconds
+        - ok: False if the access failed (returned <0)
+    """
+    __slots__ = ()
+
+
+class AccessStats:
+    """
+        Counters and latency histogram of one kind of access (device, op, register).
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.failures = 0
+        self.bytes = 0
+        self.total = 0.0
+        self.min = None
+        self.max = 0.0
+        self.histogram = [0] * (len(HISTOGRAM_BOUNDS) + 1)
+
+    def add(self, nbytes, duration, ok):
+        self.count += 1
+        self.bytes += nbytes
+        self.total += duration
+        self.min = duration if self.min is None else min(self.min, duration)
+        self.max = max(self.max, duration)
+        if not ok:
+            self.failures += 1
+        self.histogram[bisect.bisect_left(HISTOGRAM_BOUNDS, duration * 1e6)] += 1
+
+    def percentile(self, p):
+        """
+        :param p: Percentile (0-100)
+        :return: Upper bound of the histogram bucket holding the percentile, in microseconds (None above 1 s)
+        """
+        rank = p / 100.0 * self.count
+        seen = 0
+        for i, n in enumerate(self.histogram):
+            seen += n
+            if n and seen >= rank:
+                return HISTOGRAM_BOUNDS[i] if i < len(HISTOGRAM_BOUNDS) else None
+        return None
+
+    def to_dict(self):
+        return {"count": self.count,
+                "failures": self.failures,
+                "bytes": self.bytes,
+                "total_us": round(self.total * 1e6, 3),
+                "mean_us": round(self.total * 1e6 / self.count, 3) if self.count else None,
+                "min_us": round(self.min * 1e6, 3) if self.min is not None else None,
+                "max_us": round(self.max * 1e6, 3),
+                "p50_us": self.percentile(50),
+                "p99_us": self.percentile(99)}
+
+
+class Instruments:
+    """
+        Timings of the register accesses of the drivers, per (device, op, register), and an optional tracer
+        receiving every access:
+            INSTRUMENTS.enable(tracer=ChromeTracer())
+            board = CHARTIER()
+            INSTRUMENTS.disable()
+            print(INSTRUMENTS.text())
+            INSTRUMENTS.tracer.save("bringup.json")      # open in chrome://tracing or ui.perfetto.dev
+
+        User Notes:
+        - Disabled by default. While disabled, an access only pays for one attribute test (see instrumented())
+        - Times are those of the whole driver call (bus lock, pacing waits, read-modify-write), in seconds
+        - A tracer is any callable taking an AccessEvent. It is called from the thread doing the access
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.tracer = None
+        self.stats = {}
+        self._lock = threading.Lock()
+
+    def enable(self, tracer=None):
+        """
+        :param tracer: Callable taking an AccessEvent, None to only keep the counters
+        :return: None
+        """
+        self.tracer = tracer
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        with self._lock:
+            self.stats = {}
+
+    def record(self, device, devNum, register, op, nbytes, bus, start, duration, ok=True):
+        key = (device, op, register)
+        with self._lock:
+            stats = self.stats.get(key)
+            if stats is None:
+                stats = AccessStats()
+                self.stats[key] = stats
+            stats.add(nbytes, duration, ok)
+        tracer = self.tracer
+        if tracer is not None:
+            try:
+                tracer(AccessEvent(device, devNum, register, op, nbytes, bus, start, duration, ok))
+            except Exception as e:
+                _logger.error("Access tracer failed, removing it")
+                _logger.error(e)
+                self.tracer = None
+
+    def summary(self):
+        """
+        :return: List of dictionaries (device, op, register and the statistics of AccessStats.to_dict()), the
+                 accesses that took the most time in total first
+        """
+        with self._lock:
+            items = list(self.stats.items())
+        items.sort(key=lambda item: item[1].total, reverse=True)
+        summary = []
+        for (device, op, register), stats in items:
+            entry = {"device": device, "op": op, "register": register}
+            entry.update(stats.to_dict())
+            summary.append(entry)
+        return summary
+
+    def to_json(self, **kwargs):
+        return json.dumps(self.summary(), **kwargs)
+
+    def text(self, limit=None):
+        summary = self.summary()
+        report = "\n========== REGISTER ACCESS TIMES ==========\n"
+        report += '{Device: <12}{Op: <10}{Register: <28}{Count: >8}{Total: >14}{Mean: >12}{Max: >12}\n'.format(
+            Device="Device", Op="Op", Register="Register", Count="Count", Total="Total (ms)", Mean="Mean (us)",
+            Max="Max (us)")
+        for entry in summary[:limit]:
+            report += '{Device: <12}{Op: <10}{Register: <28}{Count: >8}{Total: >14.3f}{Mean: >12.1f}{Max: >12.1f}\n'.format(
+                Device=entry["device"], Op=entry["op"], Register=entry["register"], Count=entry["count"],
+                Total=entry["total_us"] / 1000, Mean=entry["mean_us"], Max=entry["max_us"])
+        report += 'TOTAL: {Total:.3f} ms in {Count} accesses\n'.format(Total=sum(e["total_us"] for e in summary) / 1000,
+                                                                      Count=sum(e["count"] for e in summary))
+        return report
+
+
+class ChromeTracer:
+    """
+        Tracer keeping the accesses as Chrome trace events, one row per bus:
+            tracer = ChromeTracer()
+            INSTRUMENTS.enable(tracer)
+            ...
+            tracer.save("trace.json")
+    """
+
+    def __init__(self):
+        self.events = []
+        self._origin = time.perf_counter()
+        self._threads = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, event):
+        with self._lock:
+            tid = self._threads.setdefault(event.bus, len(self._threads) + 1)
+            self.events.append({"name": str(event.device) + "." + str(event.register),
+                                "cat": event.op,
+                                "ph": "X",
+                                "ts": round((event.start - self._origin) * 1e6, 3),
+                                "dur": round(event.duration * 1e6, 3),
+                                "pid": 1,
+                                "tid": tid,
+                                "args": {"devNum": event.devNum, "bytes": event.bytes, "ok": event.ok}})
+
+    def clear(self):
+        with self._lock:
+            self.events = []
+            self._origin = time.perf_counter()
+
+    def to_dict(self):
+        with self._lock:
+            names = [{"name": "thread_name", "ph": "M", "pid": 1, "tid": tid, "args": {"name": "/".join(str(k) for k in bus)}}
+                     for bus, tid in self._threads.items()]
+            return {"traceEvents": names + list(self.events), "displayTimeUnit": "ms"}
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f)
+
+
+def instrumented(op, register=None):
+    """
+    Decorator timing a driver method taking (devNum, paramName, ...), or (devNum, ...) if register is given, into
+    the INSTRUMENTS of the driver. Writes made inside a RegisterBatch are not recorded, the batch is ("apply").
+    :param op: Name of the operation ("read", "write", ...)
+    :param register: Register label for methods that don't take a field name
+    """
+    def decorate(method):
+        @functools.wraps(method)
+        def wrapper(self, devNum, *args, **kwargs):
+            instruments = self.INSTRUMENTS
+            if not instruments.enabled:
+                return method(self, devNum, *args, **kwargs)
+            ''' Inside a batch, writes only queue their registers, the bus access is recorded when the batch is sent '''
+            if op == "write" and getattr(self, "_batches", {}).get(devNum) is not None:
+                return method(self, devNum, *args, **kwargs)
+
+            start = time.perf_counter()
+            ret = method(self, devNum, *args, **kwargs)
+            duration = time.perf_counter() - start
+
+            name = register if register is not None else args[0]
+            info = self.REGISTERS.get(name) if register is None else None
+            nbytes = info.regs if info is not None else 0
+            ok = not (isinstance(ret, int) and ret < 0)
+            instruments.record(self._name, devNum, name, op, nbytes, bus_key(self, devNum), start, duration, ok)
+            return ret
+        return wrapper
+    return decorate
+
+
+''' Instruments used by drivers that were not given their own. Drivers keep them in their INSTRUMENTS class attribute,
+    access timings and tracing are off until enable() '''
+INSTRUMENTS = Instruments()
@@ -0,0 +1,123 @@
+import time
+import threading
+import logging
+
+_logger = logging.getLogger(__name__)
+
+
+class TimingPolicy:
+    """
+        Settle times a device needs after its transactions, in seconds.
+
+        User Notes:
+        - readDelay and writeDelay apply after every read and write
+        - addrDelays gives a longer write delay for some registers (self-clearing triggers, NVM commands, resets).
+          The longest delay of the registers written is used
+        - The delay is not slept right away, see Pacer
+    """
+
+    def __init__(self, readDelay=0.0, writeDelay=0.0, addrDelays=None):
+        self.readDelay = readDelay
+        self.writeDelay = writeDelay
+        self.addrDelays = addrDelays if addrDelays else {}
+
+    @classmethod
+    def from_registers(cls, registersInfo, slowParams=(), slowDelay=0.01, readDelay=0.0, writeDelay=0.0):
+        """
+        Build the policy of a device from its register table. Writes to self-clearing fields (min=max=1), which
+        start an action in the device, and to the fields of slowParams are followed by slowDelay.
+        :param registersInfo: REGISTERS_INFO of the device
+        :param slowParams: Names of other fields that need time to take effect
+        :param slowDelay: Delay after a write to a slow field
+        :param readDelay: Delay after any read
+        :param writeDelay: Delay after any other write
+        :return: TimingPolicy
+        """
+        addrDelays = {}
+        for name, info in registersInfo.items():
+            if ((1 == info['min']) and (1 == info['max'])) or (name in slowParams):
+                for a in range(info['addr'], info['addr'] + info.get('regs', 1)):
+                    addrDelays[a] = max(addrDelays.get(a, 0.0), slowDelay)
+        return cls(readDelay, writeDelay, addrDelays)
+
+    def read_delay(self):
+        return self.readDelay
+
+    def write_delay(self, addrs=()):
+        """
+        :param addrs: Addresses of the registers written
+        :return: Delay in seconds
+        """
+        delay = self.writeDelay
+        for a in addrs:
+            delay = max(delay, self.addrDelays.get(a, 0.0))
+        return delay
+
+
+''' The 10 ms after every access the drivers always had '''
+CONSERVATIVE = TimingPolicy(readDelay=0.01, writeDelay=0.01)
+
+
+class Pacer:
+    """
+        Keeps track, per bus, of when the bus is ready for the next transaction.
+
+        User Notes:
+        - With the "tuned" profile (default), each device uses its own TimingPolicy. After a transaction the bus is
+          marked busy until the settle time has elapsed, and only a transaction coming on the same bus before that
+          waits, for what is left of it. Most accesses don't wait at all
+        - The "conservative" profile sleeps 10 ms right after every access, whatever the device, like the drivers
+          used to do. Use it if some hardware misbehaves with the tuned timings:
+              PACER.set_profile("conservative")
+        - Bus keys are the same as for the bus pools: I2C channel number, SPI device path, ...
+    """
+
+    PROFILES = ("tuned", "conservative")
+
+    def __init__(self, profile="tuned"):
+        self.profile = profile
+        self._readyAt = {}
+        self._lock = threading.Lock()
+
+    def set_profile(self, profile):
+        """
+        :param profile: "tuned" or "conservative"
+        :return: <0 on failure, 0 on success
+        """
+        if profile not in self.PROFILES:
+            _logger.error(str(profile) + " is an unknown pacing profile. Must be one of " + str(self.PROFILES))
+            return -1
+        self.profile = profile
+        return 0
+
+    def wait(self, key):
+        """
+        Block until the bus is ready for a new transaction.
+        :param key: Bus identifier
+        :return: None
+        """
+        with self._lock:
+            readyAt = self._readyAt.get(key, 0.0)
+        remaining = readyAt - time.monotonic()
+        if remaining > 0:
+            time.sleep(remaining)
+
+    def after_read(self, key, policy):
+        self._settle(key, CONSERVATIVE.read_delay() if self.profile == "conservative" else policy.read_delay())
+
+    def after_write(self, key, policy, addrs=()):
+        self._settle(key, CONSERVATIVE.write_delay() if self.profile == "conservative" else policy.write_delay(addrs))
+
+    def _settle(self, key, delay):
+        if delay <= 0:
+            return
+        if self.profile == "conservative":
+            time.sleep(delay)
+            return
+        with self._lock:
+            self._readyAt[key] = max(self._readyAt.get(key, 0.0), time.monotonic() + delay)
+
+
+''' Pacer used by drivers that were not given one by a platform. Drivers keep it in their PACER class attribute, with
+    the settle times of the device after its register accesses in TIMING (a TimingPolicy) '''
+PACER = Pacer()
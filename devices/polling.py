@@ -0,0 +1,128 @@
+import time
+import logging
+from devices.transport import open_gpio
+
+_logger = logging.getLogger(__name__)
+
+''' Backoff of poll(), in seconds: first wait, growth factor and longest wait '''
+POLL_INITIAL = 0.001
+POLL_FACTOR = 2.0
+POLL_MAX = 0.05
+
+
+def poll(read, done, timeout, what="status", initial=POLL_INITIAL, factor=POLL_FACTOR, maximum=POLL_MAX):
+    """
+    Read a status until it reaches a condition, waiting a little longer between each read. Short operations are seen
+    as soon as they finish, long ones don't flood the bus:
+        poll(lambda: dev.read_param(0, "NVMBUSY"), lambda busy: busy == 0, timeout=1.0, what="NVMBUSY")
+    :param read: Function returning the status, <0 on failure
+    :param done: Function of the status, True when the wait is over
+    :param timeout: Longest wait in seconds
+    :param what: Name of the status, for the logs
+    :param initial: First wait between two reads
+    :param factor: Growth of the wait after each read
+    :param maximum: Longest wait between two reads
+    :return: Last status read, -1 on failure or timeout
+    """
+    deadline = time.monotonic() + timeout
+    delay = initial
+    while True:
+        value = read()
+        if isinstance(value, int) and value < 0:
+            _logger.error("Could not read " + str(what) + " while polling")
+            return -1
+        if done(value):
+            return value
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            _logger.error("Timed out after " + str(timeout) + " s waiting for " + str(what) + " (last value: " + str(value) + ")")
+            return -1
+        time.sleep(min(delay, remaining))
+        delay = min(delay * factor, maximum)
+
+
+def wait_for_pin(pin, level, timeout, what="pin", initial=POLL_INITIAL, factor=POLL_FACTOR, maximum=POLL_MAX):
+    """
+    Wait for a GPIO input to reach a level. The pin is set to report edges and the wait sleeps in the kernel until
+    one comes (periphery GPIO.poll()). If the GPIO can't report edges, its level is polled like poll() does.
+    :param pin: GPIO line number
+    :param level: Level to wait for (True/False)
+    :param timeout: Longest wait in seconds
+    :param what: Name of the pin, for the logs
+    :return: Time waited in seconds, -1 on failure or timeout
+    """
+    start = time.monotonic()
+    deadline = start + timeout
+    delay = initial
+    try:
+        g = open_gpio(pin, "in")
+    except Exception as e:
+        _logger.error("Could not open " + str(what) + " (gpio " + str(pin) + ")")
+        _logger.error(e)
+        return -1
+
+    try:
+        try:
+            g.edge = "rising" if level else "falling"
+            events = callable(getattr(g, "poll", None))
+        except Exception:
+            events = False
+
+        while True:
+            if bool(g.read()) == bool(level):
+                return time.monotonic() - start
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                _logger.error("Timed out after " + str(timeout) + " s waiting for " + str(what) + " to go " + ("high" if level else "low"))
+                return -1
+            if events:
+                if g.poll(remaining):
+                    try:
+                        g.read_event()
+                    except NotImplementedError:
+                        ''' sysfs GPIOs have no event queue, reading the level clears the edge '''
+                        pass
+            else:
+                time.sleep(min(delay, remaining))
+                delay = min(delay * factor, maximum)
+    except Exception as e:
+        _logger.error("Could not read " + str(what) + " (gpio " + str(pin) + ")")
+        _logger.error(e)
+        return -1
+    finally:
+        g.close()
+
+
+def wait_for_lock(dev, devNum, timeout, pin, params):
+    """
+    Wait until a device reports a lock and measure how long it took. If pin is wired to a GPIO of the device
+    (dev.GPIO_PINS), the wait sleeps on its edge (wait_for_pin(), level dev.LOCK_PIN_LEVEL). Otherwise the fields in
+    params are read with poll() until they all have their value.
+    :param dev: Driver of the device
+    :param devNum: Device number
+    :param timeout: Longest wait in seconds
+    :param pin: Name of the GPIO_PINS pin showing the lock, None to read the fields
+    :param params: Dictionary of field name to value when locked
+    :return: Lock time in seconds, -1 on failure or timeout
+    """
+    start = time.monotonic()
+
+    if pin and dev.GPIO_PINS and (pin in dev.GPIO_PINS[devNum]):
+        if wait_for_pin(dev.GPIO_PINS[devNum][pin], dev.LOCK_PIN_LEVEL, timeout, what=dev._name + " " + pin) < 0:
+            return -1
+    else:
+        def locked():
+            for paramName, value in params.items():
+                val = dev.read_param(devNum, paramName)
+                if val < 0:
+                    return -1
+                if val != value:
+                    return 0
+            return 1
+
+        if poll(locked, lambda state: state == 1, timeout, what=dev._name + " lock (" + ", ".join(params) + ")") < 0:
+            return -1
+
+    lockTime = time.monotonic() - start
+    _logger.debug(dev._name + " " + str(devNum) + " locked in " + str(round(lockTime * 1000, 3)) + " ms")
+    return lockTime
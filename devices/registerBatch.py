@@ -0,0 +1,232 @@
+import logging
+from devices.registerImage import contiguous_blocks, SMBUS_BLOCK_MAX
+from devices.registerDescriptor import SELF_CLEARING
+
+_logger = logging.getLogger(__name__)
+
+
+class RegisterBatch:
+    """
+        Collects the field writes to one device and sends them together when the 'with' block exits:
+            with board.LMK03318.batch(0) as b:
+                board.LMK03318.PLL_P(0, 7)
+                b.write("PLL_NDIV", 40)
+
+        User Notes:
+        - While the block is open, every write_param() to that device number goes to the batch instead of the bus.
+          Reads still go to the device and don't see the pending writes
+        - Fields sharing a register are merged: each register is written once, with the masks of all the fields
+          combined. Only the bits outside of the combined mask are read back from the device
+        - Registers are sent in address order and only the last value written to a field is kept. Sequences that
+          depend on ordering (power down toggles, self-clearing bits) must stay outside of the block
+        - If the block raises, nothing is sent
+        - The result of the flush (0 or -1) is kept in result
+        - With send=False nothing is sent on exit, the driver uses the collected writes itself (see apply_config)
+    """
+
+    def __init__(self, device, devNum, send=True):
+        self._device = device
+        self.devNum = devNum
+        self.send = send
+        self.values = {}
+        self.masks = {}
+        self.result = None
+        self._previous = None
+
+    def write(self, paramName, value):
+        """
+        Add a field write to the batch.
+        :param paramName: Name of the field
+        :param value: New value of the field
+        :return: <0 if the value was rejected, 0 otherwise
+        """
+        return self._device.write_param(self.devNum, paramName, value)
+
+    def add(self, addr, value, mask, regs=1):
+        """
+        Merge an already formatted value in the pending registers.
+        :param addr: Address of the first register of the field
+        :param value: Value, shifted and masked in place
+        :param mask: Mask of the field, big endian over all its registers
+        :param regs: Number of registers of the field. If >1, the value is split in bytes
+        :return: None
+        """
+        if regs == 1:
+            self._merge(addr, value, mask)
+            return
+        for i in range(regs):
+            shift = 8 * (regs - 1 - i)
+            byteMask = (mask >> shift) & 0xFF
+            if byteMask:
+                self._merge(addr + i, (value >> shift) & 0xFF, byteMask)
+
+    def _merge(self, addr, value, mask):
+        self.masks[addr] = self.masks.get(addr, 0) | mask
+        self.values[addr] = (self.values.get(addr, 0) & ~mask) | (value & mask)
+
+    def addresses(self):
+        return sorted(self.masks)
+
+    def covers(self, addr, length=1, full=0xFF):
+        """
+        True if the batch sets every bit of the registers, so they don't have to be read back before the write.
+        """
+        return all(self.masks.get(a, 0) == full for a in range(addr, addr + length))
+
+    def blocks(self, maxLen=SMBUS_BLOCK_MAX, align=None):
+        """
+        Pending registers, as contiguous (start, length) runs of at most maxLen bytes.
+        """
+        return contiguous_blocks(self.addresses(), maxLen, align)
+
+    def merge_value(self, addr, current):
+        """
+        Apply the pending bits of a register on its current value.
+        """
+        mask = self.masks.get(addr, 0)
+        return (current & ~mask) | self.values.get(addr, 0)
+
+    def changed(self, current):
+        """
+        Pending registers whose content changes when the pending bits are applied.
+        :param current: Current values, indexable by address (dictionary or image)
+        :return: Sorted list of addresses
+        """
+        return [a for a in self.addresses() if self.merge_value(a, current[a]) != current[a]]
+
+    def merge(self, start, current):
+        """
+        Apply the pending bits of a run of registers on their current values.
+        :param start: Address of the first register
+        :param current: Current values of the registers, as a list of bytes
+        :return: List of bytes to write
+        """
+        return [self.merge_value(start + i, current[i]) & 0xFF for i in range(len(current))]
+
+    def __len__(self):
+        return len(self.masks)
+
+    def __enter__(self):
+        self._previous = self._device._batches.get(self.devNum)
+        self._device._batches[self.devNum] = self
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self._previous is None:
+            self._device._batches.pop(self.devNum, None)
+        else:
+            self._device._batches[self.devNum] = self._previous
+        if exc_type is not None:
+            _logger.warning("Batch for device " + str(self.devNum) + " aborted, nothing was written")
+            return False
+        if not self.send:
+            return False
+        if self.masks:
+            self.result = self._device.write_batch(self)
+        else:
+            self.result = 0
+        return False
+
+
+def apply_config(device, devNum, config, key, open_bus, read, write, maxLen=SMBUS_BLOCK_MAX, align=None):
+    """
+    Bring a device to a target configuration, writing only the registers whose content has to change. Each of them
+    is written once, in contiguous block writes, after a block read of the registers concerned. The fields are
+    validated and formatted by the write_param() of the driver, in a RegisterBatch that sends nothing.
+    The driver gives the bus access, ex: for an I2C device
+        apply_config(self, devNum, config, i2c_ch, lambda: self.I2C_POOL.acquire(i2c_ch),
+                     lambda bus, start, length: bus.read_i2c_block_data(i2c_addr, start, length),
+                     lambda bus, start, data: bus.write_i2c_block_data(i2c_addr, start, data))
+    :param device: Driver of the device
+    :param devNum: Device number
+    :param config: Dictionary of field name to value
+    :param key: Bus of the device, for the PACER of the driver
+    :param open_bus: Function returning the bus handle as a context manager
+    :param read: Function (bus, start, length) returning the content of a run of registers, as a list of bytes
+    :param write: Function (bus, start, data) writing a run of registers
+    :param maxLen: Longest block transfer
+    :param align: If given, block transfers don't cross a multiple of align
+    :return: Number of registers written, <0 on failure
+    """
+    ''' Validate and format the fields like write_param(), without sending anything '''
+    with RegisterBatch(device, devNum, send=False) as target:
+        for paramName, value in config.items():
+            paramInfo = device.REGISTERS.get(paramName)
+            if (paramInfo is not None) and (paramInfo.access == SELF_CLEARING):
+                _logger.error(str(paramName) + " is self-clearing and can't be part of a configuration")
+                return -1
+            if device.write_param(devNum, paramName, value) != 0:
+                return -1
+
+    if not target:
+        return 0
+
+    try:
+        with open_bus() as bus:
+            device.PACER.wait(key)
+            current = {}
+            for start, length in target.blocks(maxLen, align):
+                data = read(bus, start, length)
+                for i in range(length):
+                    current[start + i] = data[i]
+
+            changed = target.changed(current)
+            for start, length in contiguous_blocks(changed, maxLen, align):
+                writeBuf = target.merge(start, [current[a] for a in range(start, start + length)])
+                if _logger.isEnabledFor(logging.DEBUG):
+                    _logger.debug("To registers " + str(start) + ".." + str(start + length - 1) + " = " + str([hex(no) for no in writeBuf]))
+                write(bus, start, writeBuf)
+    except FileNotFoundError as e:
+        _logger.error(e)
+        _logger.error("Could not find bus " + str(key) + " of device " + str(devNum) + ". Check your connection....")
+        return -1
+    except Exception as e:
+        _logger.error("Could not set message to device. Check connection...")
+        _logger.error(e)
+        return -1
+
+    if _logger.isEnabledFor(logging.DEBUG):
+        _logger.debug("Configuration of device " + str(devNum) + ": " + str(len(changed)) + " of " + str(len(target)) + " registers changed")
+    if changed:
+        device.PACER.after_write(key, device.TIMING, changed)
+    return len(changed)
+
+
+def write_batch(device, batch, key, open_bus, read, write, maxLen=SMBUS_BLOCK_MAX, align=None):
+    """
+    Send the writes collected by a batch, one block write per contiguous run of registers. Only the registers
+    whose bits are not all set by the batch are read back first. The bus access is given by the driver like for
+    apply_config().
+    :param device: Driver of the device
+    :param batch: RegisterBatch
+    :param key: Bus of the device, for the PACER of the driver
+    :param open_bus: Function returning the bus handle as a context manager
+    :param read: Function (bus, start, length) returning the content of a run of registers, as a list of bytes
+    :param write: Function (bus, start, data) writing a run of registers
+    :param maxLen: Longest block transfer
+    :param align: If given, block transfers don't cross a multiple of align
+    :return: <0 on failure, 0 on success
+    """
+    try:
+        with open_bus() as bus:
+            device.PACER.wait(key)
+            for start, length in batch.blocks(maxLen, align):
+                if batch.covers(start, length):
+                    currVal = [0] * length
+                else:
+                    currVal = read(bus, start, length)
+                writeBuf = batch.merge(start, currVal)
+                if _logger.isEnabledFor(logging.DEBUG):
+                    _logger.debug("To registers " + str(start) + ".." + str(start + length - 1) + " = " + str([hex(no) for no in writeBuf]))
+                write(bus, start, writeBuf)
+    except FileNotFoundError as e:
+        _logger.error(e)
+        _logger.error("Could not find bus " + str(key) + " of device " + str(batch.devNum) + ". Check your connection....")
+        return -1
+    except Exception as e:
+        _logger.error("Could not set message to device. Check connection...")
+        _logger.error(e)
+        return -1
+
+    device.PACER.after_write(key, device.TIMING, batch.addresses())
+    return 0
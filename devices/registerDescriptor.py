@@ -0,0 +1,57 @@
+import logging
+from collections import namedtuple
+
+_logger = logging.getLogger(__name__)
+
+''' Access kinds, from the min/max convention of the register tables '''
+READ_ONLY = "R"         # min=max=0
+SELF_CLEARING = "SC"    # min=max=1
+READ_WRITE = "RW"
+
+
+class RegisterDescriptor(namedtuple("RegisterDescriptor",
+                                    ["name", "addr", "loc", "mask", "regs", "min", "max", "access", "invMask", "addrs"])):
+    """
+        Compiled entry of a register table. Immutable and without a per-instance dict, so the drivers' hot paths
+        only do attribute reads instead of dictionary lookups.
+
+        - invMask: bits of the register(s) outside of the field, to keep in a read-modify-write
+        - addrs: addresses of all the registers holding the field
+    """
+    __slots__ = ()
+
+
+def compile_registers(registersInfo, wordBits=None):
+    """
+    Compile a REGISTERS_INFO table once, when the driver class is created.
+    :param registersInfo: REGISTERS_INFO of the device
+    :param wordBits: Width of one access in bits, if it is not given by 'regs' bytes (ex: 32 for the ICYSHSR1,
+                     where 'regs' counts the entries of a lookup table)
+    :return: Dictionary of field name to RegisterDescriptor
+    """
+    registers = {}
+    for name, info in registersInfo.items():
+        regs = info.get('regs', 1)
+        if wordBits:
+            width = wordBits
+        else:
+            width = max(8 * regs, (info['mask'].bit_length() + 7) // 8 * 8)
+
+        if (0 == info['min']) and (0 == info['max']):
+            access = READ_ONLY
+        elif (1 == info['min']) and (1 == info['max']):
+            access = SELF_CLEARING
+        else:
+            access = READ_WRITE
+
+        registers[name] = RegisterDescriptor(name=name,
+                                             addr=info['addr'],
+                                             loc=info['loc'],
+                                             mask=info['mask'],
+                                             regs=regs,
+                                             min=info['min'],
+                                             max=info['max'],
+                                             access=access,
+                                             invMask=~info['mask'] & ((1 << width) - 1),
+                                             addrs=tuple(range(info['addr'], info['addr'] + regs)))
+    return registers
@@ -0,0 +1,100 @@
+import logging
+
+_logger = logging.getLogger(__name__)
+
+'''
+Helpers to work on a whole register map at once, as a bytearray indexed by register address (an "image"),
+instead of one field at a time.
+'''
+
+''' Maximum length of a SMBus block transfer '''
+SMBUS_BLOCK_MAX = 32
+
+
+def image_size(registersInfo):
+    """
+    Number of bytes needed to hold all the registers of a device.
+    :param registersInfo: REGISTERS_INFO of the device
+    :return: Size in bytes
+    """
+    return max(info['addr'] + info.get('regs', 1) for info in registersInfo.values())
+
+
+def address_ranges(registersInfo, maxLen=SMBUS_BLOCK_MAX):
+    """
+    Find the contiguous address ranges covered by a register table, split so that none is longer than maxLen.
+    Ex: fields at 0 (2 regs), 2, 3 and 8 --> [(0, 4), (8, 1)]
+    :param registersInfo: REGISTERS_INFO of the device
+    :param maxLen: Maximum number of bytes in one transfer
+    :return: List of (start address, length)
+    """
+    covered = set()
+    for info in registersInfo.values():
+        covered.update(range(info['addr'], info['addr'] + info.get('regs', 1)))
+    return contiguous_blocks(sorted(covered), maxLen)
+
+
+def contiguous_blocks(addresses, maxLen=SMBUS_BLOCK_MAX, align=None):
+    """
+    Group addresses in contiguous runs of at most maxLen bytes.
+    Ex: [1, 2, 3, 7, 8] --> [(1, 3), (7, 2)]
+    :param addresses: Sorted register addresses
+    :param maxLen: Maximum number of bytes in one transfer
+    :param align: If given, runs never cross a multiple of align (for devices whose address auto-increment wraps
+                  inside a group of registers)
+    :return: List of (start address, length)
+    """
+    ranges = []
+    start = None
+    prev = None
+    for addr in addresses:
+        if start is None:
+            start = addr
+        elif (addr != prev + 1) or (addr - start == maxLen) or (align and addr % align == 0):
+            ranges.append((start, prev + 1 - start))
+            start = addr
+        prev = addr
+    if start is not None:
+        ranges.append((start, prev + 1 - start))
+    return ranges
+
+
+def merge_ranges(ranges, maxGap, maxLen=None):
+    """
+    Join ranges separated by at most maxGap unused addresses, to read them in one transfer when the cost of a transfer
+    is higher than the one of a few extra bytes.
+    Ex: [(0, 4), (6, 2), (40, 1)], maxGap=4 --> [(0, 8), (40, 1)]
+    :param ranges: Sorted list of (start address, length), see address_ranges()
+    :param maxGap: Largest number of unused addresses read to join two ranges
+    :param maxLen: Maximum number of bytes in one transfer, None for no limit
+    :return: List of (start address, length)
+    """
+    merged = []
+    for start, length in ranges:
+        if merged:
+            prevStart, prevLength = merged[-1]
+            gap = start - (prevStart + prevLength)
+            if gap <= maxGap and (maxLen is None or start + length - prevStart <= maxLen):
+                merged[-1] = (prevStart, start + length - prevStart)
+                continue
+        merged.append((start, length))
+    return merged
+
+
+def decode_fields(registers, image, exceptions=None):
+    """
+    Extract the value of every field from a register image.
+    :param registers: Compiled register table of the device (REGISTERS, see devices.registerDescriptor)
+    :param image: Register image, indexed by address
+    :param exceptions: Optional formatting function (paramInfo, value) -> value, like the drivers' register_exceptions
+    :return: Dictionary of field name to value
+    """
+    values = {}
+    for name, info in registers.items():
+        val = int.from_bytes(image[info.addr:info.addr + info.regs], byteorder='big', signed=False)
+        val &= info.mask
+        val >>= info.loc
+        if exceptions:
+            val = exceptions(info, val)
+        values[name] = val
+    return values
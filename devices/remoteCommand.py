@@ -1,8 +1,8 @@
-import time
 import logging
 import requests
 import functools
 import json
+from devices.pacing import PACER, TimingPolicy
 
 _logger = logging.getLogger(__name__)
 
@@ -24,6 +24,10 @@ class RemoteCommand:
        > d.register_name(0, 1) # writing 1 to the device 0
     """
 
+    ''' The server paces the hardware itself, nothing to wait for here except with the conservative profile '''
+    TIMING = TimingPolicy()
+    PACER = PACER
+
     def __init__(self, d, name="", acc=None, ip="192.168.0.200", port=5000, timeout=None):
         self.__dict__ = {}
         self._name = name
@@ -37,6 +41,7 @@ class RemoteCommand:
 
     def __call__(self, *args):
 
+        self.PACER.wait(self._url)
         dest = self._url + "/CHARTIER/" + str(self._acc._name) + "/" + str(self._name)
         params = {'args': args}
 
@@ -81,7 +86,7 @@ class RemoteCommand:
                 _logger.warning("Incorrect number of arguments. Ignoring")
                 return -1
 
-        time.sleep(0.01)
+        self.PACER.after_write(self._url, self.TIMING)
 
         if json.loads(r.content)['returnValue']:
             returnValue = json.loads(r.content)['returnValue']
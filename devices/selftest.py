@@ -0,0 +1,171 @@
+import json
+import time
+import logging
+from collections import namedtuple
+from concurrent.futures import wait, FIRST_COMPLETED
+from devices.busExecutor import bus_key
+
+_logger = logging.getLogger(__name__)
+
+''' Status of a device selftest '''
+PASSED = "PASSED"       # selftest() returned 0
+SKIPPED = "SKIPPED"     # selftest() returned 1, nothing to test on this device (write-only)
+FAILED = "FAILED"       # selftest() returned anything else
+ERROR = "ERROR"         # selftest() raised
+TIMEOUT = "TIMEOUT"     # selftest() didn't return in time
+BLOCKED = "BLOCKED"     # not run, the bus is held by a selftest that timed out
+
+''' Time between two checks of the running selftests, in seconds '''
+POLL_INTERVAL = 0.01
+
+
+class SelftestResult(namedtuple("SelftestResult", ["device", "devNum", "address", "bus", "status", "latency",
+                                                   "error"])):
+    """
+        Result of the selftest of one device.
+
+        - device: Name of the device on the board (ex: LMK61E2, or TMP1075_0 for independent devices)
+        - address: Address info of the device, from the layout
+        - bus: Bus the device is on, see devices.busExecutor.bus_key()
+        - latency: Duration of the selftest in seconds, None if it didn't finish
+        - error: Exception message, if the selftest raised
+    """
+    __slots__ = ()
+
+    @property
+    def ok(self):
+        return self.status in (PASSED, SKIPPED)
+
+    def to_dict(self):
+        d = self._asdict()
+        d["bus"] = list(self.bus)
+        return d
+
+
+class SelftestReport:
+    """
+        Results of the selftests of a board, with the text report the platforms log.
+            report = board.runSelftests(timeout=0.5)
+            if not report.ok:
+                print(report.to_json())
+    """
+
+    def __init__(self, board, results, duration):
+        self.board = board
+        self.results = results
+        self.duration = duration
+
+    @property
+    def passed(self):
+        return sum(1 for r in self.results if r.ok)
+
+    @property
+    def failed(self):
+        return len(self.results) - self.passed
+
+    @property
+    def ok(self):
+        return self.failed == 0
+
+    def to_dict(self):
+        return {"board": self.board,
+                "duration": self.duration,
+                "passed": self.passed,
+                "failed": self.failed,
+                "results": [r.to_dict() for r in self.results]}
+
+    def to_json(self, **kwargs):
+        return json.dumps(self.to_dict(), **kwargs)
+
+    def text(self):
+        report = "\n========== DEVICE SELFTEST REPORT ==========\n"
+        report += "Board Name : {BoardName: <20} \n".format(BoardName=self.board)
+        report += '-' * 30 + "\n"
+        for r in self.results:
+            report += '{DeviceName: <10} :: '.format(DeviceName=r.device)
+            report += ",".join('{keyName: <10}: {value: <20}'.format(keyName=key, value=item)
+                               for key, item in r.address.items())
+            report += " ... " + r.status
+            if r.latency is not None:
+                report += " ({Latency:.1f} ms)".format(Latency=r.latency * 1000)
+            report += " \n"
+        report += "\n============ SELFTEST SUMMARY ============\n"
+        report += 'PASSED: {Passed: <10}'.format(Passed=self.passed)
+        report += 'FAILED: {Failed: <10}'.format(Failed=self.failed)
+        report += 'TIME: {Duration:.3f} s'.format(Duration=self.duration)
+        report += "\n========== DEVICE SELFTEST DONE ==========\n"
+        return report
+
+    def __str__(self):
+        return self.text()
+
+
+def _timed(index, starts, fn, *args):
+    starts[index] = time.monotonic()
+    ret = fn(*args)
+    return ret, time.monotonic() - starts[index]
+
+
+def run_selftests(executor, targets, timeout=None, board=""):
+    """
+    Run the selftests of devices, in parallel between buses and one after the other on each bus.
+    :param executor: BusExecutor of the board
+    :param targets: List of (device name, device, devNum, address info)
+    :param timeout: Time in seconds one selftest may take, from when it starts. None to wait for ever.
+                    A selftest that times out keeps running in the background (a bus access can't be interrupted),
+                    the selftests still queued on its bus are not run
+    :param board: Name of the board, for the report
+    :return: SelftestReport
+    """
+    start = time.monotonic()
+    starts = {}
+    jobs = {}
+    for index, (name, dev, devNum, addr) in enumerate(targets):
+        key = bus_key(dev, devNum)
+        future = executor.submit(key, _timed, index, starts, dev.selftest, devNum)
+        jobs[future] = (index, key)
+
+    results = [None] * len(targets)
+    heldBuses = set()
+    pending = set(jobs)
+    while pending:
+        done, pending = wait(pending, timeout=POLL_INTERVAL if timeout is not None else None,
+                             return_when=FIRST_COMPLETED)
+        for future in done:
+            index, key = jobs[future]
+            try:
+                ret, latency = future.result()
+            except Exception as e:
+                _logger.error("Selftest of " + str(targets[index][0]) + " #" + str(targets[index][2]) + " raised")
+                _logger.error(e)
+                results[index] = (ERROR, None, str(e))
+                continue
+            if ret == 0:
+                results[index] = (PASSED, latency, None)
+            elif ret == 1:
+                results[index] = (SKIPPED, latency, None)
+            else:
+                results[index] = (FAILED, latency, None)
+
+        if timeout is None:
+            continue
+        now = time.monotonic()
+        for future in list(pending):
+            index, key = jobs[future]
+            if index in starts and now - starts[index] > timeout:
+                _logger.error("Selftest of " + str(targets[index][0]) + " #" + str(targets[index][2]) +
+                              " timed out after " + str(timeout) + " s")
+                results[index] = (TIMEOUT, None, None)
+                heldBuses.add(key)
+                pending.discard(future)
+        for future in list(pending):
+            index, key = jobs[future]
+            if key in heldBuses and future.cancel():
+                results[index] = (BLOCKED, None, None)
+                pending.discard(future)
+
+    report = []
+    for (name, dev, devNum, addr), (status, latency, error) in zip(targets, results):
+        report.append(SelftestResult(device=name, devNum=devNum, address=addr, bus=bus_key(dev, devNum),
+                                     status=status, latency=latency, error=error))
+    return SelftestReport(board, report, time.monotonic() - start)
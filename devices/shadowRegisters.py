@@ -0,0 +1,201 @@
+import logging
+from devices.registerImage import image_size, contiguous_blocks
+
+_logger = logging.getLogger(__name__)
+
+
+class ShadowRegisters:
+    """
+        RAM copy of the register space of one device, indexed by register address.
+
+        User Notes:
+        - A byte is only served from the shadow once it has been read from (or written to) the device, see valid
+        - Registers holding volatile fields (status, interrupt flags, NVM access) are never cached
+        - Self-clearing bits are dropped from the copy once written, so a later read-modify-write of the same
+          register doesn't trigger them again
+        - Bytes are marked dirty when a new value is merged in, and clean once the device has been written. Dirty
+          bytes are not trusted: if the write failed they are read again from the device on next access
+    """
+
+    def __init__(self, size, volatile=(), selfClearing=None):
+        self.image = bytearray(size)
+        self.valid = bytearray(size)
+        self.dirty = bytearray(size)
+        self.volatile = frozenset(volatile)
+        self.selfClearing = selfClearing if selfClearing else {}
+
+    @classmethod
+    def from_registers(cls, registersInfo, volatileParams=()):
+        """
+        Build the shadow registers for a device from its register table.
+        :param registersInfo: REGISTERS_INFO of the device
+        :param volatileParams: Names of the fields that change on their own
+        :return: ShadowRegisters
+        """
+        size = image_size(registersInfo)
+
+        volatile = set()
+        for name in volatileParams:
+            info = registersInfo[name]
+            volatile.update(range(info['addr'], info['addr'] + info['regs']))
+
+        ''' if min=max=1, self-clearing. Masks are big endian over all the bytes of the field '''
+        selfClearing = {}
+        for info in registersInfo.values():
+            if (1 == info['min']) and (1 == info['max']):
+                for i in range(info['regs']):
+                    byteMask = (info['mask'] >> (8 * (info['regs'] - 1 - i))) & 0xFF
+                    if byteMask:
+                        selfClearing[info['addr'] + i] = selfClearing.get(info['addr'] + i, 0) | byteMask
+
+        return cls(size, volatile, selfClearing)
+
+    def cacheable(self, addr, regs):
+        for a in range(addr, addr + regs):
+            if a in self.volatile:
+                return False
+        return True
+
+    def has(self, addr, regs):
+        return all(self.valid[addr:addr + regs]) and not any(self.dirty[addr:addr + regs])
+
+    def get(self, addr, regs):
+        return list(self.image[addr:addr + regs])
+
+    def load(self, addr, data):
+        """
+        Store bytes that were just read from the device.
+        """
+        end = addr + len(data)
+        self.image[addr:end] = bytes(data)
+        self.valid[addr:end] = b'\x01' * len(data)
+        self.dirty[addr:end] = bytes(len(data))
+
+    def merge(self, addr, data):
+        """
+        Store bytes that are about to be written to the device and mark them dirty.
+        """
+        end = addr + len(data)
+        self.image[addr:end] = bytes(data)
+        self.valid[addr:end] = b'\x01' * len(data)
+        self.dirty[addr:end] = b'\x01' * len(data)
+
+    def clean(self, addr, regs):
+        """
+        Mark bytes as written to the device.
+        """
+        for a in range(addr, addr + regs):
+            self.dirty[a] = 0
+            if a in self.selfClearing:
+                self.image[a] &= ~self.selfClearing[a] & 0xFF
+
+    def invalidate(self, addr=None, regs=1):
+        """
+        Forget the content of some registers (all of them if addr is None), they will be read again on next access.
+        """
+        if addr is None:
+            addr, regs = 0, len(self.image)
+        self.valid[addr:addr + regs] = bytes(regs)
+        self.dirty[addr:addr + regs] = bytes(regs)
+
+    def dirty_ranges(self, maxLen=32):
+        return self._ranges(self.dirty, maxLen)
+
+    def valid_ranges(self, maxLen=32):
+        return self._ranges(self.valid, maxLen)
+
+    def _ranges(self, flags, maxLen):
+        """
+        Split the flagged addresses in contiguous (start, length) runs of at most maxLen bytes.
+        """
+        return contiguous_blocks([a for a in range(len(flags)) if flags[a] and a not in self.volatile], maxLen)
+
+
+'''
+Register cache of the I2C drivers that keep one ShadowRegisters per device number in _shadows, only for the devices
+where cache_enable() was called (LMK03318, LMK61E2).
+'''
+
+
+def enable_cache(dev, devNum, enable=True):
+    """
+    Create (or drop) the register cache of a device, see the cache_enable() of the drivers.
+    :param dev: Driver of the device
+    :param devNum: Device number
+    :param enable: True to enable the cache, False to drop it
+    :return: None
+    """
+    if enable:
+        if devNum not in dev._shadows:
+            dev._shadows[devNum] = ShadowRegisters.from_registers(dev.REGISTERS_INFO, dev.VOLATILE_PARAMS)
+    else:
+        dev._shadows.pop(devNum, None)
+
+
+def invalidate_cache(dev, devNum=None):
+    """
+    Forget the cached registers of a device, they will be read from the device on next access.
+    :param dev: Driver of the device
+    :param devNum: Device number, all devices if None
+    :return: None
+    """
+    for num, shadow in dev._shadows.items():
+        if (devNum is None) or (num == devNum):
+            shadow.invalidate()
+
+
+def refresh_cache(dev, devNum):
+    """
+    Read again from an I2C device all the registers currently in its cache.
+    :param dev: Driver of the device
+    :param devNum: Device number
+    :return: <0 on failure, 0 on success
+    """
+    shadow = dev._shadows.get(devNum)
+    if shadow is None:
+        _logger.warning("Register cache is not enabled for device " + str(devNum) + ". Ignoring")
+        return -1
+
+    i2c_addr = dev.ADDRESS_INFO[devNum]['addr']
+    i2c_ch = dev.ADDRESS_INFO[devNum]['ch']
+
+    try:
+        with dev.I2C_POOL.acquire(i2c_ch) as bus:
+            dev.PACER.wait(i2c_ch)
+            for start, length in shadow.valid_ranges():
+                shadow.load(start, bus.read_i2c_block_data(i2c_addr, start, length))
+    except Exception as e:
+        _logger.error("Could not refresh register cache. Check connection...")
+        _logger.error(e)
+        shadow.invalidate()
+        return -1
+
+    return 0
+
+
+def cached_block_access(shadow, i2c_addr):
+    """
+    Block read and write of an I2C device through its register cache, for registerBatch.apply_config() and
+    registerBatch.write_batch(). Registers holding volatile fields go straight to the device.
+    :param shadow: ShadowRegisters of the device, None if it has no cache
+    :param i2c_addr: I2C address of the device
+    :return: (read, write) functions of (bus, start, length) and (bus, start, data)
+    """
+    def read(bus, start, length):
+        cached = (shadow is not None) and shadow.cacheable(start, length)
+        if cached and shadow.has(start, length):
+            return shadow.get(start, length)
+        data = bus.read_i2c_block_data(i2c_addr, start, length)
+        if cached:
+            shadow.load(start, data)
+        return data
+
+    def write(bus, start, data):
+        cached = (shadow is not None) and shadow.cacheable(start, len(data))
+        if cached:
+            shadow.merge(start, data)
+        bus.write_i2c_block_data(i2c_addr, start, data)
+        if cached:
+            shadow.clean(start, len(data))
+
+    return read, write
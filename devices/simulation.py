@@ -0,0 +1,474 @@
+import os
+import json
+import time
+import errno
+import random
+import threading
+import importlib
+import logging
+from collections import Counter
+from devices.transport import Transport, set_transport
+from devices.registerImage import image_size
+
+_logger = logging.getLogger(__name__)
+
+'''
+In-memory stand-ins for the buses of a board, to run the drivers (and benchmark them) without hardware:
+    sim = use_simulation()
+    sim.populate(resource_filename("platforms.CHARTIER", "device_layout.json"))
+    board = CHARTIER()
+Every simulated device holds its own register file. Nothing of the real behaviour of the chips is modelled (no
+PLL locking, no self-clearing bits, no status changes), a register just holds what was last written to it.
+'''
+
+
+def _value(arg):
+    ''' Arguments of the ASIC library come as ctypes values '''
+    return getattr(arg, "value", arg)
+
+
+class SimulatedI2CDevice:
+    """
+        Register file of an I2C device.
+
+        User Notes:
+        - Block accesses auto-increment the address, like the LMK and TCA chips do
+        - wordBytes is the number of bytes behind each register address, for devices with a register pointer
+          (ex: 2 for the TMP1075)
+    """
+
+    def __init__(self, size=256, wordBytes=1):
+        self.wordBytes = wordBytes
+        self.registers = bytearray(size * wordBytes)
+
+    def read(self, reg, length):
+        start = reg * self.wordBytes
+        if start + length > len(self.registers):
+            raise OSError(errno.EIO, "Read past the end of the simulated register file")
+        return list(self.registers[start:start + length])
+
+    def write(self, reg, data):
+        start = reg * self.wordBytes
+        if start + len(data) > len(self.registers):
+            raise OSError(errno.EIO, "Write past the end of the simulated register file")
+        self.registers[start:start + len(data)] = bytes(data)
+
+    def load_params(self, registersInfo, values):
+        """
+        Set fields directly in the register file, ex: the identification registers read by the selftests.
+        :param registersInfo: REGISTERS_INFO of the device
+        :param values: Dictionary of field name to value
+        :return: None
+        """
+        for name, value in values.items():
+            info = registersInfo[name]
+            regs = info.get('regs', 1)
+            current = int.from_bytes(self.read(info['addr'], regs), byteorder='big')
+            current = (current & ~info['mask']) | ((value << info['loc']) & info['mask'])
+            self.write(info['addr'], list(current.to_bytes(regs, byteorder='big')))
+
+
+class SimulatedSPIDevice:
+    """
+        SPI device that ignores what it receives and answers zeros. Transfers are kept in log.
+    """
+
+    def __init__(self):
+        self.log = []
+
+    def transfer(self, data):
+        self.log.append(list(data))
+        return [0] * len(data)
+
+
+class AddressedSPIDevice(SimulatedSPIDevice):
+    """
+        SPI device with a register file, addressed by the first bytes of each transfer (ex: LMK04610).
+        The first byte holds the R/W bit and the high bits of the address, the next addrBytes-1 bytes the rest of
+        it. The bytes that follow are data, at consecutive addresses.
+        :param ascendBit: Bit of register 0 choosing the direction of multi-byte transfers (ex: ADDR_ASCEND of the
+                          LMK04610). While it is cleared, the addresses go down from the one sent. None to always go up
+    """
+
+    def __init__(self, size, addrBytes=2, readBit=0x80, ascendBit=None):
+        super().__init__()
+        self.registers = bytearray(size)
+        self.addrBytes = addrBytes
+        self.readBit = readBit
+        self.ascendBit = ascendBit
+
+    def transfer(self, data):
+        data = list(data)
+        self.log.append(data)
+        if len(data) <= self.addrBytes:
+            return [0] * len(data)
+
+        read = bool(data[0] & self.readBit)
+        addr = data[0] & ~self.readBit & 0xFF
+        for b in data[1:self.addrBytes]:
+            addr = (addr << 8) | b
+        payload = data[self.addrBytes:]
+        if self.ascendBit is not None and not (self.registers[0] & self.ascendBit):
+            addrs = range(addr, addr - len(payload), -1)
+        else:
+            addrs = range(addr, addr + len(payload))
+        if min(addrs) < 0 or max(addrs) >= len(self.registers):
+            raise OSError(errno.EIO, "Access past the end of the simulated register file")
+
+        if read:
+            return [0] * self.addrBytes + [self.registers[a] for a in addrs]
+        for a, b in zip(addrs, payload):
+            self.registers[a] = b
+        return [0] * len(data)
+
+    def load_params(self, registersInfo, values):
+        for name, value in values.items():
+            info = registersInfo[name]
+            regs = info.get('regs', 1)
+            current = int.from_bytes(self.registers[info['addr']:info['addr'] + regs], byteorder='big')
+            current = (current & ~info['mask']) | ((value << info['loc']) & info['mask'])
+            self.registers[info['addr']:info['addr'] + regs] = current.to_bytes(regs, byteorder='big')
+
+
+class WordSPIDevice(SimulatedSPIDevice):
+    """
+        Write-only SPI device taking fixed size, big endian command words, with the register address inside the
+        word (ex: LMK01020, AD5668). The last word received for each address is kept in words.
+        :param wordBytes: Size of one word
+        :param addrShift: Position of the address in the word
+        :param addrMask: Mask of the address, once shifted down
+    """
+
+    def __init__(self, wordBytes=4, addrShift=0, addrMask=0xF):
+        super().__init__()
+        self.wordBytes = wordBytes
+        self.addrShift = addrShift
+        self.addrMask = addrMask
+        self.words = {}
+
+    def transfer(self, data):
+        data = list(data)
+        self.log.append(data)
+        for i in range(0, len(data) - self.wordBytes + 1, self.wordBytes):
+            word = int.from_bytes(bytes(data[i:i + self.wordBytes]), byteorder='big')
+            self.words[(word >> self.addrShift) & self.addrMask] = word
+        return [0] * len(data)
+
+
+class SimulatedASIC:
+    """
+        32-bit register file of an ASIC reached through the AXI library (ICYSHSR1).
+    """
+
+    def __init__(self):
+        self.registers = {}
+
+    def load_params(self, registersInfo, values):
+        for name, value in values.items():
+            info = registersInfo[name]
+            current = self.registers.get(info['addr'], 0)
+            self.registers[info['addr']] = (current & ~info['mask']) | ((value << info['loc']) & info['mask'])
+
+
+class SimulatedASICLibrary:
+    """
+        Stand-in for icyshsr1-lib.so, with the same functions.
+    """
+
+    AXI_SELFTEST_VALUE = 0xDEADBEEF
+
+    def __init__(self, simulation):
+        self._sim = simulation
+        self.asics = {}
+
+    def _asic(self, dev):
+        dev = _value(dev)
+        asic = self.asics.get(dev)
+        if asic is None:
+            if self._sim.strict:
+                raise OSError(errno.ENODEV, "No simulated ASIC #" + str(dev))
+            asic = self.asics.setdefault(dev, SimulatedASIC())
+        return asic
+
+    def ic_read(self, dev, addr, prevMux, currPP):
+        self._sim.transaction("asic", 8)
+        return self._asic(dev).registers.get(_value(addr), 0)
+
+    def ic_write(self, dev, value):
+        self._sim.transaction("asic", 8)
+        value = _value(value)
+        self._asic(dev).registers[value >> 32] = value & 0xFFFFFFFF
+        return 0
+
+    def axi_selftest(self, dev):
+        self._sim.transaction("asic", 4)
+        self._asic(dev)
+        return self.AXI_SELFTEST_VALUE
+
+
+class SimulatedSMBus:
+    """
+        Handle returned by Simulation.open_i2c(), with the smbus.SMBus methods the drivers use.
+    """
+
+    def __init__(self, simulation, ch):
+        self._sim = simulation
+        self.ch = ch
+
+    def read_i2c_block_data(self, addr, reg, length):
+        self._sim.transaction("i2c", length)
+        with self._sim.lock:
+            return self._sim.i2c_device(self.ch, addr).read(reg, length)
+
+    def write_i2c_block_data(self, addr, reg, data):
+        self._sim.transaction("i2c", len(data))
+        with self._sim.lock:
+            self._sim.i2c_device(self.ch, addr).write(reg, data)
+
+    def read_byte_data(self, addr, reg):
+        return self.read_i2c_block_data(addr, reg, 1)[0]
+
+    def write_byte_data(self, addr, reg, value):
+        self.write_i2c_block_data(addr, reg, [value])
+
+    def close(self):
+        pass
+
+
+class SimulatedSPI:
+    """
+        Handle returned by Simulation.open_spi(), with the periphery.SPI methods the drivers use.
+    """
+
+    def __init__(self, simulation, device, path, mode, maxSpeed):
+        self._sim = simulation
+        self._device = device
+        self.path = path
+        self.mode = mode
+        self.maxSpeed = maxSpeed
+
+    def transfer(self, data):
+        self._sim.transaction("spi", len(data))
+        with self._sim.lock:
+            return self._device.transfer(data)
+
+    def close(self):
+        pass
+
+
+class SimulatedGPIO:
+    """
+        Handle returned by Simulation.open_gpio(). Pin levels are kept in Simulation.pins.
+    """
+
+    def __init__(self, simulation, pin, direction):
+        self._sim = simulation
+        self.pin = pin
+        self.direction = direction
+
+    def read(self):
+        self._sim.transaction("gpio", 0)
+        return self._sim.pins.get(self.pin, False)
+
+    def write(self, value):
+        self._sim.transaction("gpio", 0)
+        self._sim.pins[self.pin] = bool(value)
+
+    def close(self):
+        pass
+
+
+''' Register file of each device model, and the identification fields its selftest expects '''
+DEVICE_MODELS = {
+    "LMK03318": {"bus": "i2c", "identity": {"VNDRID": 0x100B}},
+    "LMK61E2":  {"bus": "i2c", "identity": {"VNDRID": 0x100B}},
+    "TCA9539":  {"bus": "i2c", "identity": {}},
+    "TMP1075":  {"bus": "i2c", "wordBytes": 2, "size": 16, "identity": {"DID": 0x7500}},
+    "LMK04610": {"bus": "spi", "ascendBit": 0x20, "identity": {"VENDORID": 0x5108}},
+    "LMK01020": {"bus": "spi_word", "addrShift": 0, "addrMask": 0xF},
+    "AD5668":   {"bus": "spi_word", "addrShift": 20, "addrMask": 0xFF},
+    "ICYSHSR1": {"bus": "asic", "library": "icyshsr1-lib.so", "identity": {"ASIC_ID": 0xF0E32001}},
+}
+
+
+class Simulation(Transport):
+    """
+        Transport serving the drivers from in-memory devices instead of the hardware, see devices.transport.
+
+        User Notes:
+        - Devices are added by populate() from a platform layout, or one by one with add_i2c(), add_spi() and
+          add_asic(). With strict=False, an I2C address that was never added is created blank on first access
+          and any SPI path answers zeros. With strict=True they fail like a missing device would (OSError)
+        - latency (seconds per transaction) and byteLatency (seconds per byte) are slept on every access, to get
+          closer to the timings of the real buses. openLatency is slept when an I2C or SPI handle is opened (the
+          open() and ioctl() calls of the real ones). All are 0 by default
+        - Faults: fail_next(n) makes the next n transactions raise an OSError, faultRate makes each transaction
+          fail with that probability (seeded with seed, so runs are reproducible). kinds restricts faults to some
+          buses ("i2c", "spi", "gpio", "asic")
+        - counts gives the number of transactions per bus kind, bytes the number of data bytes, opens the number of
+          handles opened
+    """
+
+    def __init__(self, strict=False, latency=0.0, byteLatency=0.0, faultRate=0.0, seed=None, kinds=None,
+                 openLatency=0.0):
+        self.strict = strict
+        self.latency = latency
+        self.byteLatency = byteLatency
+        self.openLatency = openLatency
+        self.faultRate = faultRate
+        self.kinds = kinds
+        self.i2c = {}
+        self.spi = {}
+        self.pins = {}
+        self.libraries = {}
+        self.counts = Counter()
+        self.bytes = Counter()
+        self.opens = Counter()
+        self.lock = threading.RLock()
+        self._failNext = 0
+        self._random = random.Random(seed)
+
+    ''' Devices '''
+    def add_i2c(self, ch, addr, size=256, wordBytes=1):
+        device = SimulatedI2CDevice(size, wordBytes)
+        self.i2c[(ch, addr)] = device
+        return device
+
+    def add_spi(self, path, device):
+        self.spi[path] = device
+        return device
+
+    def add_asic(self, libraryName, dev):
+        library = self.libraries.get(libraryName)
+        if library is None:
+            library = self.libraries[libraryName] = SimulatedASICLibrary(self)
+        asic = library.asics[dev] = SimulatedASIC()
+        return asic
+
+    def i2c_device(self, ch, addr):
+        device = self.i2c.get((ch, addr))
+        if device is None:
+            if self.strict:
+                raise OSError(errno.EREMOTEIO, "No simulated device at channel " + str(ch) + ", address " + str(addr))
+            with self.lock:
+                device = self.i2c.setdefault((ch, addr), SimulatedI2CDevice())
+        return device
+
+    def populate(self, layout):
+        """
+        Create the devices of a platform layout, with their identification registers set so the selftests pass.
+        :param layout: Layout dictionary, or path of a device_layout.json
+        :return: List of the devices created
+        """
+        if isinstance(layout, (str, os.PathLike)):
+            with open(layout, 'r') as f:
+                layout = json.load(f)
+
+        created = []
+        for manu, devs in layout.items():
+            for devName, attr in devs.items():
+                model = DEVICE_MODELS.get(devName)
+                if model is None or "ADDRESS_INFO" not in attr:
+                    continue
+                registersInfo = importlib.import_module("devices." + manu + "." + devName).__dict__[devName].REGISTERS_INFO
+                for info in attr["ADDRESS_INFO"]:
+                    device = self._create(model, registersInfo, info)
+                    if "identity" in model:
+                        device.load_params(registersInfo, model["identity"])
+                    created.append(device)
+        return created
+
+    def _create(self, model, registersInfo, info):
+        if model["bus"] == "i2c":
+            size = model.get("size", image_size(registersInfo))
+            return self.add_i2c(info["ch"], info["addr"], size, model.get("wordBytes", 1))
+        elif model["bus"] == "spi":
+            return self.add_spi(info["path"], AddressedSPIDevice(image_size(registersInfo),
+                                                                      ascendBit=model.get("ascendBit")))
+        elif model["bus"] == "spi_word":
+            return self.add_spi(info["path"], WordSPIDevice(addrShift=model["addrShift"], addrMask=model["addrMask"]))
+        return self.add_asic(model["library"], info["devNum"])
+
+    ''' Faults and latency '''
+    def fail_next(self, count=1):
+        """
+        Make the next transactions fail.
+        :param count: Number of transactions to fail
+        :return: None
+        """
+        with self.lock:
+            self._failNext += count
+
+    def transaction(self, kind, nbytes):
+        """
+        Account for one bus transaction, then apply the latency and the faults. Called by the handles.
+        :param kind: "i2c", "spi", "gpio" or "asic"
+        :param nbytes: Number of data bytes
+        :return: None
+        """
+        with self.lock:
+            self.counts[kind] += 1
+            self.bytes[kind] += nbytes
+            fail = False
+            if self.kinds is None or kind in self.kinds:
+                if self._failNext > 0:
+                    self._failNext -= 1
+                    fail = True
+                elif self.faultRate and self._random.random() < self.faultRate:
+                    fail = True
+        delay = self.latency + self.byteLatency * nbytes
+        if delay > 0:
+            time.sleep(delay)
+        if fail:
+            raise OSError(errno.EIO, "Simulated " + kind + " fault")
+
+    def reset_counts(self):
+        self.counts.clear()
+        self.bytes.clear()
+        self.opens.clear()
+
+    def _opened(self, kind):
+        with self.lock:
+            self.opens[kind] += 1
+        if self.openLatency > 0:
+            time.sleep(self.openLatency)
+
+    ''' Transport '''
+    def open_i2c(self, ch):
+        self._opened("i2c")
+        return SimulatedSMBus(self, ch)
+
+    def open_spi(self, path, mode, maxSpeed, **kwargs):
+        device = self.spi.get(path)
+        if device is None:
+            if self.strict:
+                raise FileNotFoundError(errno.ENOENT, "No simulated SPI device", path)
+            with self.lock:
+                device = self.spi.setdefault(path, SimulatedSPIDevice())
+        self._opened("spi")
+        return SimulatedSPI(self, device, path, mode, maxSpeed)
+
+    def open_gpio(self, pin, direction):
+        return SimulatedGPIO(self, pin, direction)
+
+    def load_library(self, name):
+        library = self.libraries.get(name)
+        if library is None:
+            raise OSError(name + ": no simulated library")
+        return library
+
+
+def use_simulation(simulation=None, **kwargs):
+    """
+    Install a simulation as the transport of all the drivers. The handles kept by the default bus pools are
+    closed, so that they are opened again from the simulation.
+    :param simulation: Simulation to install, a new one (built with kwargs) if None
+    :return: The installed Simulation
+    """
+    from devices.busPool import I2C_POOL, SPI_POOL
+    if simulation is None:
+        simulation = Simulation(**kwargs)
+    I2C_POOL.close()
+    SPI_POOL.close()
+    set_transport(simulation)
+    return simulation
@@ -0,0 +1,89 @@
+import logging
+
+_logger = logging.getLogger(__name__)
+
+'''
+SRAM access of the TI clock devices with an address register that increments on every access of a data register
+(MEMADR/RAMDAT on the LMK03318 and LMK61E2). Used by their write_sram() and read_sram().
+'''
+
+
+def write_sram(dev, devNum, memInfo, ramInfo, image, start=0):
+    """
+    Stream bytes into the SRAM of a device: the address register is set once, then each byte is one write of the
+    data register, without reading anything back.
+    :param dev: I2C driver of the device
+    :param devNum: Device number
+    :param memInfo: Descriptor of the SRAM address register (MEMADR)
+    :param ramInfo: Descriptor of the SRAM data register (RAMDAT)
+    :param image: Bytes to write
+    :param start: SRAM address of the first byte
+    :return: <0 on failure, 0 on success
+    """
+    if (start < 0) or (start + len(image) > memInfo.max + 1):
+        _logger.error("SRAM image of " + str(len(image)) + " bytes at " + str(start) + " doesn't fit in the " + str(memInfo.max + 1) + " bytes of SRAM")
+        return -1
+    if not dev.ADDRESS_INFO:
+        _logger.error("No Devices registered. Aborting...")
+        return -1
+
+    i2c_addr = dev.ADDRESS_INFO[devNum]['addr']
+    i2c_ch = dev.ADDRESS_INFO[devNum]['ch']
+
+    try:
+        with dev.I2C_POOL.acquire(i2c_ch) as bus:
+            dev.PACER.wait(i2c_ch)
+            bus.write_i2c_block_data(i2c_addr, memInfo.addr, dev.int_to_short_list(start, memInfo.regs))
+            for value in image:
+                bus.write_byte_data(i2c_addr, ramInfo.addr, value & 0xFF)
+    except FileNotFoundError as e:
+        _logger.error(e)
+        _logger.error("Could not find i2c bus at channel: " + str(i2c_ch) + ", address: " + str(i2c_addr) + ". Check your connection....")
+        return -1
+    except Exception as e:
+        _logger.error("Could not set message to device. Check connection...")
+        _logger.error(e)
+        return -1
+
+    _logger.debug("Wrote " + str(len(image)) + " bytes of SRAM from address " + str(start))
+    dev.PACER.after_write(i2c_ch, dev.TIMING, [memInfo.addr, ramInfo.addr])
+    return 0
+
+
+def read_sram(dev, devNum, memInfo, ramInfo, length, start=0):
+    """
+    Read bytes from the SRAM of a device, see write_sram().
+    :param dev: I2C driver of the device
+    :param devNum: Device number
+    :param memInfo: Descriptor of the SRAM address register (MEMADR)
+    :param ramInfo: Descriptor of the SRAM data register (RAMDAT)
+    :param length: Number of bytes
+    :param start: SRAM address of the first byte
+    :return: List of bytes, -1 on failure
+    """
+    if (start < 0) or (start + length > memInfo.max + 1):
+        _logger.error(str(length) + " bytes at " + str(start) + " is outside of the " + str(memInfo.max + 1) + " bytes of SRAM")
+        return -1
+    if not dev.ADDRESS_INFO:
+        _logger.error("No Devices registered. Aborting...")
+        return -1
+
+    i2c_addr = dev.ADDRESS_INFO[devNum]['addr']
+    i2c_ch = dev.ADDRESS_INFO[devNum]['ch']
+
+    try:
+        with dev.I2C_POOL.acquire(i2c_ch) as bus:
+            dev.PACER.wait(i2c_ch)
+            bus.write_i2c_block_data(i2c_addr, memInfo.addr, dev.int_to_short_list(start, memInfo.regs))
+            data = [bus.read_byte_data(i2c_addr, ramInfo.addr) for i in range(length)]
+    except FileNotFoundError as e:
+        _logger.error(e)
+        _logger.error("Could not find i2c bus at channel: " + str(i2c_ch) + ", address: " + str(i2c_addr) + ". Check your connection....")
+        return -1
+    except Exception as e:
+        _logger.error("Could not set message to device. Check connection...")
+        _logger.error(e)
+        return -1
+
+    dev.PACER.after_read(i2c_ch, dev.TIMING)
+    return data
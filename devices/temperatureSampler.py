@@ -0,0 +1,227 @@
+import time
+import threading
+import logging
+import numpy as np
+
+_logger = logging.getLogger(__name__)
+
+''' One reading: when it was taken (time.time()), device number of the sensor, temperature in degrees C '''
+READING_DTYPE = np.dtype([("time", "f8"), ("sensor", "i2"), ("temp", "f4")])
+
+''' Alert kinds given to the callbacks '''
+ALERT_HIGH = "high"     # went above the high threshold
+ALERT_CLEAR = "clear"   # back below the low threshold after a high alert
+
+
+class RingBuffer:
+    """
+        Fixed size buffer of readings, allocated once. When it is full, the oldest readings are overwritten.
+        Safe to read from one thread while another one appends.
+    """
+
+    def __init__(self, capacity):
+        self._data = np.zeros(capacity, dtype=READING_DTYPE)
+        self._next = 0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def append(self, timestamp, sensor, temp):
+        with self._lock:
+            self._data[self._next] = (timestamp, sensor, temp)
+            self._next = (self._next + 1) % len(self._data)
+            self._count = min(self._count + 1, len(self._data))
+
+    def ordered(self):
+        """
+        :return: Copy of the readings, oldest first
+        """
+        with self._lock:
+            if self._count < len(self._data):
+                return self._data[:self._count].copy()
+            return np.concatenate((self._data[self._next:], self._data[:self._next]))
+
+    def clear(self):
+        with self._lock:
+            self._next = 0
+            self._count = 0
+
+    def __len__(self):
+        return self._count
+
+
+class TemperatureSampler:
+    """
+        Reads a set of TMP1075 sensors at a fixed period, in a background thread, and keeps the readings in a
+        RingBuffer. Created by TMP1075.sampler():
+            with board.TMP1075.sampler(period=0.5, high=70.0, low=65.0) as s:
+                s.on_alert(lambda sensor, kind, temp, t: print(sensor, kind, temp))
+                ...
+                print(s.latest(0), s.window(60.0))
+
+        User Notes:
+        - start() writes the configuration once (continuous conversion, conversion rate, thermostat mode and the
+          L/H thresholds if given), then only the temperature register is read
+        - latest() and window() don't touch the bus, they can be called as often as needed
+        - A failed read is logged and skipped, the sampler keeps going
+        - Alert callbacks are called from the sampler thread. A sensor goes to alert when it reads above the high
+          threshold, and leaves it once it reads below the low one, like the comparator mode of the chip
+    """
+
+    def __init__(self, device, devNums, period, capacity, rate, thermostat, low, high):
+        self.device = device
+        self.devNums = list(devNums)
+        self.period = period
+        self.rate = rate
+        self.thermostat = thermostat
+        self.low = low
+        self.high = high
+        self.buffer = RingBuffer(capacity)
+        self._latest = np.full((max(self.devNums, default=-1) + 1, 2), np.nan)
+        self._alarmed = set()
+        self._callbacks = []
+        self._stop = threading.Event()
+        self._thread = None
+
+    def configure(self):
+        """
+        Write the sampling configuration to all the sensors.
+        :return: <0 on failure, 0 on success
+        """
+        ret = 0
+        for devNum in self.devNums:
+            values = {"SD": 0, "TM": self.thermostat, "R": self.rate}
+            if self.low is not None:
+                values["L"] = self.device.from_celsius(self.low)
+            if self.high is not None:
+                values["H"] = self.device.from_celsius(self.high)
+            for name, value in values.items():
+                if self.device.write_param(devNum, name, value) != 0:
+                    ret = -1
+        return ret
+
+    def set_thresholds(self, low, high):
+        """
+        Change the alert thresholds, on the sensors and for the callbacks.
+        :param low: Temperature in degrees C
+        :param high: Temperature in degrees C
+        :return: <0 on failure, 0 on success
+        """
+        self.low = low
+        self.high = high
+        ret = 0
+        for devNum in self.devNums:
+            if self.device.write_param(devNum, "L", self.device.from_celsius(low)) != 0:
+                ret = -1
+            if self.device.write_param(devNum, "H", self.device.from_celsius(high)) != 0:
+                ret = -1
+        return ret
+
+    def on_alert(self, callback):
+        """
+        :param callback: Called as callback(sensor, kind, temp, timestamp), kind is ALERT_HIGH or ALERT_CLEAR
+        :return: None
+        """
+        self._callbacks.append(callback)
+
+    def start(self):
+        """
+        Configure the sensors and start sampling.
+        :return: <0 on failure, 0 on success
+        """
+        if self._thread is not None:
+            return 0
+        if self.configure() != 0:
+            _logger.error("Could not configure the TMP1075 sensors, sampler not started")
+            return -1
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="TMP1075-sampler", daemon=True)
+        self._thread.start()
+        return 0
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def running(self):
+        return self._thread is not None
+
+    def sample(self):
+        """
+        Read all the sensors once and store the readings.
+        :return: Number of sensors read
+        """
+        read = 0
+        for devNum in self.devNums:
+            raw = self.device.read_param(devNum, "T")
+            if raw < 0:
+                continue
+            timestamp = time.time()
+            temp = self.device.to_celsius(raw)
+            self.buffer.append(timestamp, devNum, temp)
+            self._latest[devNum] = (timestamp, temp)
+            self._check_alert(devNum, temp, timestamp)
+            read += 1
+        return read
+
+    def _check_alert(self, devNum, temp, timestamp):
+        kind = None
+        if self.high is not None and devNum not in self._alarmed and temp > self.high:
+            self._alarmed.add(devNum)
+            kind = ALERT_HIGH
+        elif devNum in self._alarmed and temp < (self.low if self.low is not None else self.high):
+            self._alarmed.discard(devNum)
+            kind = ALERT_CLEAR
+        if kind is None:
+            return
+        for callback in self._callbacks:
+            try:
+                callback(devNum, kind, temp, timestamp)
+            except Exception as e:
+                _logger.error("Temperature alert callback failed")
+                _logger.error(e)
+
+    def _run(self):
+        nextSample = time.monotonic()
+        while not self._stop.is_set():
+            self.sample()
+            nextSample += self.period
+            delay = nextSample - time.monotonic()
+            if delay < 0:
+                ''' Late (slow bus), don't try to catch up '''
+                nextSample = time.monotonic()
+                delay = 0
+            self._stop.wait(delay)
+
+    def latest(self, devNum=None):
+        """
+        :param devNum: Sensor, None for all of them
+        :return: (timestamp, temp) of the last reading of the sensor (NaNs if none yet), or an array of them
+                 indexed by device number
+        """
+        if devNum is None:
+            return self._latest.copy()
+        timestamp, temp = self._latest[devNum]
+        return float(timestamp), float(temp)
+
+    def window(self, seconds, devNum=None):
+        """
+        :param seconds: Length of the window, ending now
+        :param devNum: Sensor, None for all of them
+        :return: Structured array of readings (time, sensor, temp), oldest first
+        """
+        readings = self.buffer.ordered()
+        keep = readings["time"] >= time.time() - seconds
+        if devNum is not None:
+            keep &= readings["sensor"] == devNum
+        return readings[keep]
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+        return False
@@ -1,9 +1,56 @@
+import os
 import time
+import zlib
+import struct
 import logging
-from periphery import SPI, GPIO
+from devices.transport import open_gpio
+from devices.busPool import SPI_POOL
+from devices.pacing import PACER, TimingPolicy
+from devices.busExecutor import EXECUTOR, call_async, run_command
+from devices.instrumentation import INSTRUMENTS, instrumented
+from devices.registerBatch import RegisterBatch
+from devices.registerDescriptor import compile_registers, SELF_CLEARING
 
 _logger = logging.getLogger(__name__)
 
+''' Content of R0 to R14 after power up. R9 and R14 hold bits that must stay set '''
+POWER_ON_REGISTERS = (0, 0, 0, 0, 0, 0, 0, 0, 0, 0x22A00, 0, 0, 0, 0, 0x40000000)
+
+''' Registers of the device, in programming order (R8 and R10 to R13 don't exist) '''
+PROGRAM_ORDER = (0, 1, 2, 3, 4, 5, 6, 7, 9, 14)
+
+''' State file of a device: magic, format version, R0 to R14, then the CRC32 of all that '''
+STATE_MAGIC = b"LMKS"
+STATE_VERSION = 1
+STATE_FORMAT = struct.Struct(">4sB15I")
+STATE_CRC = struct.Struct(">I")
+
+
+def pack_state(registers):
+    """
+    :param registers: Values of R0 to R14
+    :return: Content of a state file
+    """
+    data = STATE_FORMAT.pack(STATE_MAGIC, STATE_VERSION, *registers)
+    return data + STATE_CRC.pack(zlib.crc32(data))
+
+
+def unpack_state(data):
+    """
+    :param data: Content of a state file
+    :return: List of the values of R0 to R14, None if the file is not a valid state
+    """
+    if len(data) != STATE_FORMAT.size + STATE_CRC.size:
+        return None
+    body = data[:STATE_FORMAT.size]
+    if STATE_CRC.unpack(data[STATE_FORMAT.size:])[0] != zlib.crc32(body):
+        return None
+    fields = STATE_FORMAT.unpack(body)
+    if (fields[0] != STATE_MAGIC) or (fields[1] != STATE_VERSION):
+        return None
+    return list(fields[2:])
+
+
 class LMK01020:
     """
         Class for the LMK01020, a High Performance Clock Buffer, Divider, and Distributor
@@ -19,6 +66,12 @@ class LMK01020:
 
         - Don't forget the GOE pin for output
 
+        - Nothing can be read back: the driver keeps a copy of the registers of each device, and writes whole
+          registers from it. If STATE_DIR is set, the registers last sent to each device are saved there (one small
+          file per SPI path) and loaded by the next process, see program_all(diff=True)
+
+        - After a power cycle the saved state doesn't match the chip anymore, use program_all() without diff
+
     """
 
 
@@ -76,11 +129,27 @@ class LMK01020:
     ADDRESS_INFO = []
     GPIO_PINS = []
 
+    ''' Register table compiled once, used by the read and write paths '''
+    REGISTERS = compile_registers(REGISTERS_INFO)
+
+    SPI_POOL = SPI_POOL
+
+    TIMING = TimingPolicy.from_registers(REGISTERS_INFO, slowParams=["RESET"])
+    PACER = PACER
+    EXECUTOR = EXECUTOR
+    INSTRUMENTS = INSTRUMENTS
+
+    ''' Directory of the state files of the devices, None to keep the registers in RAM only '''
+    STATE_DIR = None
+
 
 
     def __init__(self, path=None, mode=None, name="LMK01020", cmdClass=None):
         self.__dict__ = {}
         self._name = name
+        self._batches = {}
+        self._shadows = {}
+        self._programmed = {}
 
         if path and mode:
             self.ADDRESS_INFO.append({'path': path, 'mode': mode})
@@ -95,12 +164,6 @@ class LMK01020:
             self.__dict__[key] = value
 
 
-
-        ''' Since the LMK01020 is write-only, we keep a local copy of registers '''
-        self.LMK01020CurParams = [0] * 15
-        self.LMK01020CurParams[9] = 0x22A00
-        self.LMK01020CurParams[14] = 0x40000000
-
         '''Extra commands'''
         self.__dict__["GPIO"] = cmdClass(self.GPIO_PINS, "GPIO", self)
 
@@ -114,20 +177,13 @@ class LMK01020:
             report += ('{DeviceName: <10} :: Path:{Path: >3}, Mode:{Mode: >4}(0x{Mode:02X})\n'.format(DeviceName=self._name, Path=addr['path'], Mode=addr['mode']))
         return report
 
+    @instrumented("write")
     def write_param(self, devNum, paramName, value):
-        if not (paramName in self.REGISTERS_INFO):
+        paramInfo = self.REGISTERS.get(paramName)
+        if paramInfo is None:
             _logger.error(str(paramName) + " is an invalid parameter name")
             return -1
 
-        if paramName in self.REGISTERS_INFO:
-            paramInfo = self.REGISTERS_INFO[paramName]
-        elif paramName in self.GPIO_PINS[devNum]:
-            self.gpio_set(devNum=devNum, name=paramName, value=value)
-            return 0
-        else:
-            _logger.error("{paramName} is an unknown parameter or pin name.".format(paramName=paramName))
-            return -1
-
         if not self.ADDRESS_INFO:
             _logger.error("No Devices registered. Aborting...")
             return -1
@@ -135,38 +191,233 @@ class LMK01020:
         spi_path = self.ADDRESS_INFO[devNum]["path"]
         spi_mode = self.ADDRESS_INFO[devNum]["mode"]
 
-        if (1 == paramInfo["min"]) and (1 == paramInfo["max"]):
+        if paramInfo.access == SELF_CLEARING:
             _logger.error(str(paramName) + " is a read-only parameter")
             return -1
 
-        if (value < paramInfo["min"]) or (value > paramInfo["max"]):
+        if (value < paramInfo.min) or (value > paramInfo.max):
             _logger.error("{value} is an invalid value for {paramName}. " +
                           "Must be between {min} and {max}".format(value=value,
                                                                    paramName=paramName,
-                                                                   min=paramInfo["min"],
-                                                                   max=paramInfo["max"]))
+                                                                   min=paramInfo.min,
+                                                                   max=paramInfo.max))
             return -1
 
         ''' Data formating to put into the register '''
-        value <<= paramInfo["loc"]
-        value &= paramInfo["mask"]
+        value <<= paramInfo.loc
+        value &= paramInfo.mask
 
         value = self.register_exceptions(paramInfo, value)
 
-        self.LMK01020CurParams[paramInfo['addr']] = (~paramInfo['mask'] & self.LMK01020CurParams[paramInfo['addr']]) | value
+        ''' Inside a batch, the write is sent when the batch exits '''
+        batch = self._batches.get(devNum)
+        if batch is not None:
+            batch.add(paramInfo.addr, value, paramInfo.mask)
+            return 0
+
+        shadow = self._shadow(devNum)
+        shadow[paramInfo.addr] = (paramInfo.invMask & shadow[paramInfo.addr]) | value
         try:
-            bus = SPI(spi_path, spi_mode, 1000000)
-            to_send =self.LMK01020CurParams[paramInfo['addr']] + paramInfo['addr']
-            writeBuf = self.int_to_short_list(to_send, fixed_length=4)
+            with self.SPI_POOL.acquire((spi_path, spi_mode, 1000000, 'msb')) as bus:
+                self.PACER.wait(spi_path)
+                self._write_register(bus, paramInfo.addr, shadow[paramInfo.addr])
+        except Exception as e:
+            _logger.error("Could not set message to device. Check connection...")
+            _logger.error(e)
+            return -1
+
+        self._sent(devNum, [paramInfo.addr])
+        self.PACER.after_write(spi_path, self.TIMING, paramInfo.addrs)
+        return 0
+
+    def _write_register(self, bus, addr, data):
+        """
+        Send one register: 28 bits of data, then the 4-bit address.
+        :param bus: Open SPI handle
+        :param addr: Register number
+        :param data: Register value, address bits cleared
+        :return: None
+        """
+        writeBuf = self.int_to_short_list(data + addr, fixed_length=4)
+        if _logger.isEnabledFor(logging.DEBUG):
             _logger.debug("Writing raw data: " + str([hex(no) for no in writeBuf]))
-            bus.transfer(writeBuf)
-            bus.close()
+        bus.transfer(writeBuf)
+
+    def batch(self, devNum):
+        """
+        Collect the field writes to a device and send them together when the block exits, see RegisterBatch.
+            with dev.batch(0) as b:
+                dev.CLKOUT0_EN(0, 1)
+                b.write("CLKOUT0_DIV", 4)
+        :param devNum: Device number
+        :return: RegisterBatch context manager
+        """
+        return RegisterBatch(self, devNum)
+
+    def write_batch(self, batch):
+        """
+        Send the writes collected by a batch in a single SPI session, one word per register in address order.
+        Nothing is read back, the fields are merged in the local copy of the registers.
+        :param batch: RegisterBatch
+        :return: <0 on failure, 0 on success
+        """
+        if not self.ADDRESS_INFO:
+            _logger.error("No Devices registered. Aborting...")
+            return -1
+
+        spi_path = self.ADDRESS_INFO[batch.devNum]["path"]
+        spi_mode = self.ADDRESS_INFO[batch.devNum]["mode"]
+
+        shadow = self._shadow(batch.devNum)
+        for addr in batch.addresses():
+            shadow[addr] = batch.merge_value(addr, shadow[addr])
+        try:
+            with self.SPI_POOL.acquire((spi_path, spi_mode, 1000000, 'msb')) as bus:
+                self.PACER.wait(spi_path)
+                for addr in batch.addresses():
+                    self._write_register(bus, addr, shadow[addr])
         except Exception as e:
             _logger.error("Could not set message to device. Check connection...")
             _logger.error(e)
             return -1
 
-        time.sleep(0.01)
+        self._sent(batch.devNum, batch.addresses())
+        self.PACER.after_write(spi_path, self.TIMING, batch.addresses())
+        return 0
+
+    @instrumented("apply", "*")
+    def program_all(self, devNum, config=None, diff=False):
+        """
+        Write the registers of a device from the local copy, in programming order and in a single SPI session.
+            dev.program_all(0)                                              # everything, ex: after a power cycle
+            dev.program_all(0, {"CLKOUT0_DIV": 4, "CLKOUT0_EN": 1}, diff=True)
+        :param devNum: Device number
+        :param config: Dictionary of field name to value, merged in the local copy first. RESET is an action, not a
+                       state, and can't be part of it
+        :param diff: Only send the registers that differ from the ones last sent to the device (saved in the state
+                     file by a previous process, if STATE_DIR is set). Everything is sent if that is not known
+        :return: Number of registers written, <0 on failure
+        """
+        if not self.ADDRESS_INFO:
+            _logger.error("No Devices registered. Aborting...")
+            return -1
+
+        shadow = self._shadow(devNum)
+        if config:
+            if "RESET" in config:
+                _logger.error("RESET can't be part of a configuration, use write_param()")
+                return -1
+            ''' Validate and format the fields like write_param(), without sending anything '''
+            with RegisterBatch(self, devNum, send=False) as target:
+                for paramName, value in config.items():
+                    if self.write_param(devNum, paramName, value) != 0:
+                        return -1
+            for addr in target.addresses():
+                shadow[addr] = target.merge_value(addr, shadow[addr])
+
+        programmed = self._programmed.get(devNum)
+        if diff and programmed is not None:
+            addresses = [addr for addr in PROGRAM_ORDER if shadow[addr] != programmed[addr]]
+        else:
+            addresses = list(PROGRAM_ORDER)
+        if not addresses:
+            return 0
+
+        spi_path = self.ADDRESS_INFO[devNum]["path"]
+        spi_mode = self.ADDRESS_INFO[devNum]["mode"]
+        try:
+            with self.SPI_POOL.acquire((spi_path, spi_mode, 1000000, 'msb')) as bus:
+                self.PACER.wait(spi_path)
+                for addr in addresses:
+                    self._write_register(bus, addr, shadow[addr])
+        except Exception as e:
+            _logger.error("Could not set message to device. Check connection...")
+            _logger.error(e)
+            return -1
+
+        self._sent(devNum, addresses)
+        self.PACER.after_write(spi_path, self.TIMING, addresses)
+        return len(addresses)
+
+    def _shadow(self, devNum):
+        """
+        Local copy of the registers of a device, loaded from its state file (or the power up values) on first use.
+        """
+        shadow = self._shadows.get(devNum)
+        if shadow is None:
+            programmed = self.load_state(devNum)
+            self._programmed[devNum] = programmed
+            shadow = list(programmed) if programmed is not None else list(POWER_ON_REGISTERS)
+            self._shadows[devNum] = shadow
+        return shadow
+
+    def _sent(self, devNum, addresses):
+        """
+        Record registers that were just written to the device, and save the state.
+        """
+        shadow = self._shadows[devNum]
+        if shadow[0] & self.REGISTERS["RESET"].mask:
+            ''' The reset brought every register back to its power up value '''
+            shadow[:] = POWER_ON_REGISTERS
+            self._programmed[devNum] = list(POWER_ON_REGISTERS)
+        else:
+            programmed = self._programmed.get(devNum)
+            if programmed is None:
+                if len(addresses) < len(PROGRAM_ORDER):
+                    ''' What the other registers hold is still unknown '''
+                    return
+                programmed = list(shadow)
+                self._programmed[devNum] = programmed
+            for addr in addresses:
+                programmed[addr] = shadow[addr]
+        self.save_state(devNum)
+
+    def state_path(self, devNum):
+        """
+        :param devNum: Device number
+        :return: Path of the state file of the device, None if STATE_DIR is not set
+        """
+        if self.STATE_DIR is None:
+            return None
+        spi_path = str(self.ADDRESS_INFO[devNum]["path"])
+        return os.path.join(self.STATE_DIR, "LMK01020_" + os.path.basename(spi_path) + ".state")
+
+    def load_state(self, devNum):
+        """
+        :param devNum: Device number
+        :return: Registers last sent to the device, from its state file. None if there is no valid state file
+        """
+        path = self.state_path(devNum)
+        if (path is None) or not os.path.exists(path):
+            return None
+        try:
+            with open(path, 'rb') as f:
+                registers = unpack_state(f.read())
+        except OSError as e:
+            _logger.warning("Could not read state file " + str(path) + ": " + str(e))
+            return None
+        if registers is None:
+            _logger.warning("Ignoring invalid state file " + str(path))
+        return registers
+
+    def save_state(self, devNum):
+        """
+        Save the registers last sent to the device in its state file. The file is replaced atomically.
+        :param devNum: Device number
+        :return: <0 on failure, 0 on success (or if STATE_DIR is not set, or nothing is known yet)
+        """
+        path = self.state_path(devNum)
+        programmed = self._programmed.get(devNum)
+        if (path is None) or (programmed is None):
+            return 0
+        try:
+            os.makedirs(self.STATE_DIR, exist_ok=True)
+            with open(path + ".tmp", 'wb') as f:
+                f.write(pack_state(programmed))
+            os.replace(path + ".tmp", path)
+        except OSError as e:
+            _logger.warning("Could not save state file " + str(path) + ": " + str(e))
+            return -1
         return 0
 
     """
@@ -195,6 +446,20 @@ class LMK01020:
         return value
 
 
+    def awrite(self, devNum, paramName, value):
+        """
+        Awaitable write, see aread().
+        :return: asyncio Future of the result, <0 on failure, 0 on success
+        """
+        return call_async(self, devNum, run_command, self, paramName, devNum, value)
+
+    def aselftest(self, devNum):
+        """
+        Awaitable selftest, see aread().
+        :return: asyncio Future of the result of selftest()
+        """
+        return call_async(self, devNum, self.selftest, devNum)
+
     def selftest(self, devNum):
         # lmk01020 is write-only, skip self-test
         return 1
@@ -212,7 +477,7 @@ class LMK01020:
 
         if name in self.GPIO_PINS[devNum]:
             pin = self.GPIO_PINS[devNum][name]
-            g = GPIO(pin, "out")
+            g = open_gpio(pin, "out")
             g.write(value)
             g.close()
         else:
@@ -1,10 +1,161 @@
 import time
-import smbus
 import logging
-from periphery import GPIO
+import functools
+import numpy as np
+from fractions import Fraction
+from collections import namedtuple
+from devices.transport import open_gpio
+from devices.busPool import I2C_POOL
+from devices.pacing import PACER, TimingPolicy
+from devices.busExecutor import EXECUTOR, call_async, run_command
+from devices.instrumentation import INSTRUMENTS, instrumented
+from devices.registerImage import image_size, address_ranges, decode_fields
+from devices.registerBatch import RegisterBatch, apply_config, write_batch
+from devices.shadowRegisters import enable_cache, invalidate_cache, refresh_cache, cached_block_access
+from devices.polling import poll, wait_for_lock
+from devices.sramAccess import write_sram, read_sram
+from devices.registerDescriptor import compile_registers, READ_ONLY
 
 _logger = logging.getLogger(__name__)
 
+''' Limits of the PLL, in Hz '''
+VCO_MIN = 4800000000
+VCO_MAX = 5400000000
+PFD_MIN = 1000000
+PFD_MAX = 150000000
+
+''' Divider field of each output. Outputs 0-1 and 2-3 share their divider '''
+OUTPUT_DIVIDERS = {0: "OUT_0_1_DIV", 1: "OUT_0_1_DIV", 2: "OUT_2_3_DIV", 3: "OUT_2_3_DIV",
+                   4: "OUT_4_DIV", 5: "OUT_5_DIV", 6: "OUT_6_DIV", 7: "OUT_7_DIV"}
+
+''' Ranges of the dividers, as divide ratios. The fields hold ratio-1, except PLLMDIV which holds the ratio '''
+R_RANGE = (1, 8)
+M_RANGE = (1, 31)
+P_RANGE = (2, 8)
+OUTDIV_RANGE = (1, 256)
+
+''' Number of plans kept by the solver '''
+PLAN_CACHE_SIZE = 32
+
+
+class FrequencyPlan(namedtuple("FrequencyPlan", ["fRef", "fVco", "fPfd", "doubler", "r", "m", "ndiv", "num",
+                                                 "den", "p", "dividers", "outputs", "error"])):
+    """
+        PLL and output divider settings, see solve_frequencies().
+        F_VCO = (F_REF / R) x D x [(INT + NUM / DEN) / M]
+        F_OUT = F_VCO / (P x OUTDIV)
+
+        - r, m, p: Divide ratios (not the register values)
+        - dividers: Tuple of (divider field, divide ratio), one per output divider used
+        - outputs: Tuple of (output number, frequency obtained in Hz)
+        - error: Largest difference between a requested and an obtained frequency, in Hz
+    """
+    __slots__ = ()
+
+    @property
+    def integer(self):
+        return self.num == 0
+
+    def config(self):
+        """
+        :return: Dictionary of field name to value programming the plan
+        """
+        config = {"PRI_D": self.doubler,
+                  "PLLRDIV": self.r - 1,
+                  "PLLMDIV": self.m,
+                  "PLL_NDIV": self.ndiv,
+                  "PLL_NUM": self.num,
+                  "PLL_DEN": self.den,
+                  "PLL_ORDER": 0 if self.integer else 3,      # integer mode: no delta-sigma modulator, no dither
+                  "PLL_DTHRMODE": 3 if self.integer else 0,   # fractional: 3rd order, weak dither
+                  "PLL_P": self.p - 1}
+        for field, ratio in self.dividers:
+            config[field] = ratio - 1
+        return config
+
+
+def _pfd_grid(fRef):
+    """
+    All the reachable PFD frequencies, with their doubler, R and M settings.
+    :return: (fPfd, doubler, r, m) arrays, highest PFD first
+    """
+    doubler, r, m = np.meshgrid(np.arange(2), np.arange(R_RANGE[0], R_RANGE[1] + 1),
+                                np.arange(M_RANGE[0], M_RANGE[1] + 1), indexing="ij")
+    doubler, r, m = doubler.ravel(), r.ravel(), m.ravel()
+    fPfd = fRef * (1 + doubler) / (r * m)
+    keep = (fPfd >= PFD_MIN) & (fPfd <= PFD_MAX)
+    order = np.argsort(-fPfd[keep], kind="stable")
+    return fPfd[keep][order], doubler[keep][order], r[keep][order], m[keep][order]
+
+
+@functools.lru_cache(maxsize=PLAN_CACHE_SIZE)
+def solve_frequencies(fRef, outputs):
+    """
+    Search the divider space for a set of output frequencies. The search is done on arrays: every (P, output
+    divider) pair of the first output gives a VCO frequency, the ones out of range or that the other outputs can't
+    divide are dropped, then every VCO frequency left is tried against every (doubler, R, M) setting.
+    Integer feedback dividers are preferred, then the highest PFD frequency, then the VCO closest to the middle of
+    its range. Plans are kept in an LRU cache.
+    :param fRef: Reference frequency in Hz
+    :param outputs: Tuple of (output number, frequency in Hz)
+    :return: FrequencyPlan, None if no setting gives all the frequencies
+    """
+    info = LMK03318.REGISTERS_INFO
+    freqs = np.array([f for num, f in outputs], dtype=float)
+
+    p = np.arange(P_RANGE[0], P_RANGE[1] + 1)[:, None]
+    div = np.arange(OUTDIV_RANGE[0], OUTDIV_RANGE[1] + 1)[None, :]
+    fVco = p * div * freqs[0]
+    keep = (fVco >= VCO_MIN) & (fVco <= VCO_MAX)
+    for f in freqs[1:]:
+        ratio = fVco / (p * f)
+        nearest = np.rint(ratio)
+        keep &= (np.abs(ratio - nearest) <= 1e-9 * ratio) & (nearest >= OUTDIV_RANGE[0]) & (nearest <= OUTDIV_RANGE[1])
+    pIdx, divIdx = np.nonzero(keep)
+    if len(pIdx) == 0:
+        return None
+    vcos = fVco[pIdx, divIdx]
+
+    fPfd, doubler, r, m = _pfd_grid(fRef)
+    n = vcos[:, None] / fPfd[None, :]
+    valid = (n >= info["PLL_NDIV"]["min"] + 1) & (n < info["PLL_NDIV"]["max"] + 1)
+    fractional = np.abs(n - np.rint(n)) > 1e-9 * n
+    vcoIdx, pfdIdx = np.nonzero(valid)
+    if len(vcoIdx) == 0:
+        return None
+    centered = np.abs(vcos[vcoIdx] - (VCO_MIN + VCO_MAX) / 2)
+    best = np.lexsort((centered, -fPfd[pfdIdx], fractional[vcoIdx, pfdIdx]))[0]
+    v, g = vcoIdx[best], pfdIdx[best]
+
+    ''' Exact dividers of the chosen setting '''
+    pfd = Fraction(fRef) * (1 + int(doubler[g])) / (int(r[g]) * int(m[g]))
+    target = Fraction(float(vcos[v])).limit_denominator(1000000)
+    nExact = target / pfd
+    ndiv = int(nExact)
+    frac = (nExact - ndiv).limit_denominator(info["PLL_DEN"]["max"])
+    if frac == 1:
+        ndiv, frac = ndiv + 1, Fraction(0)
+    vco = pfd * (ndiv + frac)
+    postDiv = int(p[pIdx[v], 0])
+
+    dividers = {}
+    obtained = []
+    error = Fraction(0)
+    for num, f in outputs:
+        field = OUTPUT_DIVIDERS[num]
+        ratio = int(round(float(target) / (postDiv * f)))
+        if dividers.setdefault(field, ratio) != ratio:
+            return None
+        fOut = vco / (postDiv * ratio)
+        obtained.append((num, float(fOut)))
+        error = max(error, abs(fOut - Fraction(f).limit_denominator(1000000)))
+
+    return FrequencyPlan(fRef=fRef, fVco=float(vco), fPfd=float(pfd), doubler=int(doubler[g]), r=int(r[g]),
+                         m=int(m[g]), ndiv=ndiv, num=frac.numerator if frac else 0,
+                         den=frac.denominator if frac else 1, p=postDiv, dividers=tuple(sorted(dividers.items())),
+                         outputs=tuple(obtained), error=float(error))
+
+
 class LMK03318:
     """
         Class for the LMK03318, a Ultra-Low-Noise Jitter Clock Generator
@@ -16,6 +167,7 @@ class LMK03318:
         - Toggle the SYNC pin after programming. leave a sleep() in between
         - Make sure the Fvco is within its range (4.8-5.4 GHz), if it's not locked, it won't output anything
         - Toggling the register PLL_PDN 1->0 is important to lock the VCO do it right before the sync
+        - set_frequency() does all of the above from a list of output frequencies
     """
 
     DEVICE_NAME = "LMK03318"
@@ -210,10 +362,45 @@ class LMK03318:
     ADDRESS_INFO = []
     GPIO_PINS = []
 
+    ''' Time between the end of the programming and the SYNC pulse, and length of the pulse, in seconds '''
+    SYNC_DELAY = 0.01
+
+    ''' Key opening NVMUNLK, and longest EEPROM programming time in seconds '''
+    NVM_UNLOCK_KEY = 0xEA
+    NVM_TIMEOUT = 1.0
+
+    I2C_POOL = I2C_POOL
+
+    ''' Lock detection, see wait_for_lock(). Fields and their value when locked, longest wait in seconds, and the
+        GPIO_PINS pin (and level) showing the lock, if a status pin of the device is programmed for it '''
+    LOCK_PARAMS = {"LOL": 0}
+    LOCK_TIMEOUT = 1.0
+    LOCK_PIN = None
+    LOCK_PIN_LEVEL = True
+
+    ''' Register table compiled once, used by the read and write paths '''
+    REGISTERS = compile_registers(REGISTERS_INFO)
+
+    TIMING = TimingPolicy.from_registers(REGISTERS_INFO, slowParams=["RESETN_SW"])
+    PACER = PACER
+    EXECUTOR = EXECUTOR
+    INSTRUMENTS = INSTRUMENTS
+
+    ''' Contiguous register ranges, for burst reads of the whole map '''
+    BURST_RANGES = address_ranges(REGISTERS_INFO)
+    IMAGE_SIZE = image_size(REGISTERS_INFO)
+
+    ''' Fields that change on their own. Their registers are never served from the register cache '''
+    VOLATILE_PARAMS = ["LOL", "LOS", "CAL", "SECTOPRI", "LOL_INTR", "LOS_INTR", "CAL_INTR", "SECTOPRI_INTR",
+                       "RISE_VALID_SEC", "FALL_VALID_SEC", "RISE_VALID_PRI", "FALL_VALID_PRI",
+                       "NVMCNT", "NVMBUSY", "NVMCRCERR", "NVMLCRC", "MEMADR", "NVMDAT", "RAMDAT", "ROMDAT"]
+
     def __init__(self, i2c_ch=None, i2c_addr=None, name="LMK03318", cmdClass=None):
 
         self.__dict__ = {}
         self._name = name
+        self._shadows = {}
+        self._batches = {}
         if i2c_ch and i2c_addr:
             self.ADDRESS_INFO.append({'ch': i2c_ch, 'addr': i2c_addr})
             _logger.debug("Instantiated LMK03318 device with ch: " + str(i2c_ch) + " and addr: " + str(i2c_addr))
@@ -266,17 +453,13 @@ class LMK03318:
             report += ('{DeviceName: <10} :: Channel:{Channel: >3}, Address:{Address: >4}(0x{Address:02X})\n'.format(DeviceName=self._name, Channel=addr['ch'], Address=addr['addr']))
         return report
 
+    @instrumented("read")
     def read_param(self, devNum, paramName):
-        if not (paramName in self.REGISTERS_INFO):
+        paramInfo = self.REGISTERS.get(paramName)
+        if paramInfo is None:
             _logger.error(str(paramName) + " is an invalid parameter name")
             return -1
 
-        if paramName in self.REGISTERS_INFO:
-            paramInfo = self.REGISTERS_INFO[paramName]
-        else:
-            _logger.error("{paramName} is an unknown parameter.".format(paramName=paramName))
-            return -1
-
         if not self.ADDRESS_INFO:
             _logger.error("No Devices registered. Aborting...")
             return -1
@@ -284,10 +467,18 @@ class LMK03318:
         i2c_addr = self.ADDRESS_INFO[devNum]['addr']
         i2c_ch = self.ADDRESS_INFO[devNum]['ch']
 
+        shadow = self._shadows.get(devNum)
+        cached = (shadow is not None) and shadow.cacheable(paramInfo.addr, paramInfo.regs)
+
         try:
-            bus = smbus.SMBus(i2c_ch)
-            retVal = bus.read_i2c_block_data(i2c_addr, paramInfo["addr"], paramInfo["regs"])
-            bus.close()
+            if cached and shadow.has(paramInfo.addr, paramInfo.regs):
+                retVal = shadow.get(paramInfo.addr, paramInfo.regs)
+            else:
+                with self.I2C_POOL.acquire(i2c_ch) as bus:
+                    self.PACER.wait(i2c_ch)
+                    retVal = bus.read_i2c_block_data(i2c_addr, paramInfo.addr, paramInfo.regs)
+                if cached:
+                    shadow.load(paramInfo.addr, retVal)
         except FileNotFoundError as e:
             _logger.error(e)
             _logger.error("Could not find i2c bus at channel: " + str(i2c_ch) + ", address: " + str(i2c_addr) + ". Check your connection....")
@@ -300,24 +491,20 @@ class LMK03318:
         val = int.from_bytes(retVal, byteorder='big', signed=False)
 
         ''' Data formating from the register '''
-        val &= paramInfo['mask']
-        val >>= paramInfo['loc']
+        val &= paramInfo.mask
+        val >>= paramInfo.loc
         val = self._register_exceptions(paramInfo, val)
 
-        time.sleep(0.01)
+        self.PACER.after_read(i2c_ch, self.TIMING)
         return val
 
+    @instrumented("write")
     def write_param(self, devNum, paramName, value):
-        if not (paramName in self.REGISTERS_INFO):
+        paramInfo = self.REGISTERS.get(paramName)
+        if paramInfo is None:
             _logger.error(str(paramName) + " is an invalid parameter name")
             return -1
 
-        if paramName in self.REGISTERS_INFO:
-            paramInfo = self.REGISTERS_INFO[paramName]
-        else:
-            _logger.error("{paramName} is an unknown parameter or pin name.".format(paramName=paramName))
-            return -1
-
         if not self.ADDRESS_INFO:
             _logger.error("No Devices registered. Aborting...")
             return -1
@@ -325,41 +512,60 @@ class LMK03318:
         i2c_addr = self.ADDRESS_INFO[devNum]['addr']
         i2c_ch = self.ADDRESS_INFO[devNum]['ch']
 
-        if (0 == paramInfo["min"]) and (0 == paramInfo["max"]):
+        if paramInfo.access == READ_ONLY:
             _logger.error(str(paramName) + " is a read-only parameter")
             return -1
 
-        if (value < paramInfo["min"]) or (value > paramInfo["max"]):
+        if (value < paramInfo.min) or (value > paramInfo.max):
             _logger.error("{value} is an invalid value for {paramName}. " +
                           "Must be between {min} and {max}".format(value=value,
                                                                    paramName=paramName,
-                                                                   min=paramInfo["min"],
-                                                                   max=paramInfo["max"]))
+                                                                   min=paramInfo.min,
+                                                                   max=paramInfo.max))
             return -1
 
         ''' Data formating to put into the register '''
-        value <<= paramInfo["loc"]
-        value &= paramInfo["mask"]
+        value <<= paramInfo.loc
+        value &= paramInfo.mask
         value = self._register_exceptions(paramInfo, value)
 
+        ''' Inside a batch, the write is sent when the batch exits '''
+        batch = self._batches.get(devNum)
+        if batch is not None:
+            batch.add(paramInfo.addr, value, paramInfo.mask, paramInfo.regs)
+            return 0
+
+        shadow = self._shadows.get(devNum)
+        cached = (shadow is not None) and shadow.cacheable(paramInfo.addr, paramInfo.regs)
+
         try:
-            bus = smbus.SMBus(i2c_ch)
-
-            ''' Retrieve value in register '''
-            currVal = bus.read_i2c_block_data(i2c_addr, paramInfo["addr"], paramInfo["regs"])
-            _logger.debug("In register " + str(paramName) + " = " + str([hex(no) for no in currVal]))
-            currVal = int.from_bytes(currVal, byteorder='big')
-            ''' Clear all bits concerned with our parameter and keep the others we dont want to affect
-                Note this might cause problems if your python is not 64-bits and registers are >32bits '''
-            currVal_cleared = currVal & (~paramInfo["mask"])
-            ''' Write new value for the parameter '''
-            newVal = value + currVal_cleared
-            ''' Package as a byte-list '''
-            writeBuf = self.int_to_short_list(newVal, fixed_length=paramInfo["regs"])
-
-            _logger.debug("To register " + str(paramName) + " = " + str([hex(no) for no in writeBuf]))
-            bus.write_i2c_block_data(i2c_addr, paramInfo["addr"], writeBuf)
-            bus.close()
+            with self.I2C_POOL.acquire(i2c_ch) as bus:
+                self.PACER.wait(i2c_ch)
+                ''' Retrieve value in register, from the register cache if we have it '''
+                if cached and shadow.has(paramInfo.addr, paramInfo.regs):
+                    currVal = shadow.get(paramInfo.addr, paramInfo.regs)
+                else:
+                    currVal = bus.read_i2c_block_data(i2c_addr, paramInfo.addr, paramInfo.regs)
+                if _logger.isEnabledFor(logging.DEBUG):
+                    _logger.debug("In register " + str(paramName) + " = " + str([hex(no) for no in currVal]))
+                currVal = int.from_bytes(currVal, byteorder='big')
+                ''' Clear all bits concerned with our parameter and keep the others we dont want to affect
+                    Note this might cause problems if your python is not 64-bits and registers are >32bits '''
+                currVal_cleared = currVal & paramInfo.invMask
+                ''' Write new value for the parameter '''
+                newVal = value + currVal_cleared
+                ''' Package as a byte-list '''
+                writeBuf = self.int_to_short_list(newVal, fixed_length=paramInfo.regs)
+
+                ''' Stays dirty in the cache until the write went through '''
+                if cached:
+                    shadow.merge(paramInfo.addr, writeBuf)
+
+                if _logger.isEnabledFor(logging.DEBUG):
+                    _logger.debug("To register " + str(paramName) + " = " + str([hex(no) for no in writeBuf]))
+                bus.write_i2c_block_data(i2c_addr, paramInfo.addr, writeBuf)
+                if cached:
+                    shadow.clean(paramInfo.addr, paramInfo.regs)
         except FileNotFoundError as e:
             _logger.error(e)
             _logger.error("Could not find i2c bus at channel: " + str(i2c_ch) + ", address: " + str(i2c_addr) + ". Check your connection....")
@@ -369,10 +575,57 @@ class LMK03318:
             _logger.error(e)
             return -1
 
-        time.sleep(0.01)
+        self.PACER.after_write(i2c_ch, self.TIMING, paramInfo.addrs)
         return 0
 
 
+    def batch(self, devNum):
+        """
+        Collect the field writes to a device and send them together when the block exits, see RegisterBatch.
+            with dev.batch(0) as b:
+                dev.PLL_P(0, 1)
+                b.write("PLL_NDIV", 0)
+        :param devNum: Device number
+        :return: RegisterBatch context manager
+        """
+        return RegisterBatch(self, devNum)
+
+    def write_batch(self, batch):
+        """
+        Send the writes collected by a batch, one block write per contiguous run of registers.
+        :param batch: RegisterBatch
+        :return: <0 on failure, 0 on success
+        """
+        devNum = batch.devNum
+        if not self.ADDRESS_INFO:
+            _logger.error("No Devices registered. Aborting...")
+            return -1
+
+        i2c_addr = self.ADDRESS_INFO[devNum]['addr']
+        i2c_ch = self.ADDRESS_INFO[devNum]['ch']
+        read, write = cached_block_access(self._shadows.get(devNum), i2c_addr)
+        return write_batch(self, batch, i2c_ch, lambda: self.I2C_POOL.acquire(i2c_ch), read, write)
+
+    @instrumented("apply", "*")
+    def apply_config(self, devNum, config):
+        """
+        Bring a device to a target configuration, writing only the registers whose content has to change. Each of
+        them is written once, in contiguous block writes. The current content comes from the register cache when
+        it has it, otherwise from block reads of the registers concerned.
+        Self-clearing fields start an action, they are not a state and can't be part of a configuration.
+        :param devNum: Device number
+        :param config: Dictionary of field name to value
+        :return: Number of registers written, <0 on failure
+        """
+        if not self.ADDRESS_INFO:
+            _logger.error("No Devices registered. Aborting...")
+            return -1
+
+        i2c_addr = self.ADDRESS_INFO[devNum]['addr']
+        i2c_ch = self.ADDRESS_INFO[devNum]['ch']
+        read, write = cached_block_access(self._shadows.get(devNum), i2c_addr)
+        return apply_config(self, devNum, config, i2c_ch, lambda: self.I2C_POOL.acquire(i2c_ch), read, write)
+
     def int_to_short_list(self, data, fixed_length=None, invert=False):
         """
         Converts an integer to a list of byte-size shorts.
@@ -409,6 +662,213 @@ class LMK03318:
         return value
 
 
+    def cache_enable(self, devNum, enable=True):
+        """
+        Keep a copy of the registers of a device in RAM. After the first access, reads are served from the copy
+        and writes don't need to read the register back first. Registers holding a field of VOLATILE_PARAMS always
+        go to the device.
+        :param devNum: Device number
+        :param enable: True to enable the cache, False to drop it
+        :return: None
+        """
+        enable_cache(self, devNum, enable)
+
+    def invalidate(self, devNum=None):
+        """
+        Forget the cached registers, they will be read from the device on next access.
+        :param devNum: Device number, all devices if None
+        :return: None
+        """
+        invalidate_cache(self, devNum)
+
+    def refresh(self, devNum):
+        """
+        Read again from the device all the registers currently in the cache.
+        :param devNum: Device number
+        :return: <0 on failure, 0 on success
+        """
+        return refresh_cache(self, devNum)
+
+    def plan_frequency(self, outputs, fRef):
+        """
+        :param outputs: Dictionary of output number (0-7) to frequency in Hz
+        :param fRef: Reference frequency in Hz
+        :return: FrequencyPlan, None if the frequencies can't be reached together. See solve_frequencies()
+        """
+        for num in outputs:
+            if num not in OUTPUT_DIVIDERS:
+                _logger.error(str(num) + " is an invalid output number. Must be between 0 and 7")
+                return None
+        if not outputs:
+            _logger.error("No output frequency given")
+            return None
+        return solve_frequencies(fRef, tuple(sorted(outputs.items())))
+
+    def set_frequency(self, devNum, outputs, fRef, tolerance=1.0):
+        """
+        Program the PLL and the output dividers for a set of output frequencies:
+            board.LMK03318.set_frequency(0, {0: 156.25e6, 4: 25e6}, fRef=50e6)
+        The PLL is powered down first, then the registers that change are written in a few block writes (see
+        apply_config()). Then PLL_PDN is released so the VCO calibrates and locks, and the outputs are synchronized with a pulse on
+        the SYNC pin (SYNCN_SW if the device has no SYNC pin). Input selection, output formats and mutes are left as
+        they are.
+        :param devNum: Device number
+        :param outputs: Dictionary of output number (0-7) to frequency in Hz
+        :param fRef: Reference frequency in Hz, after the input selected by INSEL_PLL
+        :param tolerance: Largest accepted frequency error on an output in Hz, for fractional solutions
+        :return: FrequencyPlan programmed, -1 on failure
+        """
+        plan = self.plan_frequency(outputs, fRef)
+        if plan is None:
+            _logger.error("No PLL setting gives the frequencies " + str(outputs) + " from " + str(fRef) + " Hz (VCO between " + str(VCO_MIN) + " and " + str(VCO_MAX) + " Hz)")
+            return -1
+        if plan.error > tolerance:
+            _logger.error("Closest frequencies to " + str(outputs) + " are " + str(dict(plan.outputs)) + ", off by more than " + str(tolerance) + " Hz")
+            return -1
+
+        _logger.debug("Frequency plan: " + str(plan))
+        if self.write_param(devNum, "PLL_PDN", 1) != 0:
+            return -1
+        if self.apply_config(devNum, plan.config()) < 0:
+            return -1
+        if self.write_param(devNum, "PLL_PDN", 0) != 0:
+            return -1
+
+        time.sleep(self.SYNC_DELAY)
+        return plan if self.sync(devNum) == 0 else -1
+
+    def sync(self, devNum):
+        """
+        Pulse SYNC to align the output dividers.
+        :param devNum: Device number
+        :return: <0 on failure, 0 on success
+        """
+        if self.GPIO_PINS and ("SYNC" in self.GPIO_PINS[devNum]):
+            if self.gpio_set(devNum, "SYNC", 0) != 0:
+                return -1
+            time.sleep(self.SYNC_DELAY)
+            return self.gpio_set(devNum, "SYNC", 1)
+
+        if self.write_param(devNum, "SYNCN_SW", 0) != 0:
+            return -1
+        time.sleep(self.SYNC_DELAY)
+        return self.write_param(devNum, "SYNCN_SW", 1)
+
+    def write_sram(self, devNum, image, start=0):
+        """
+        Stream bytes into the SRAM of the device. MEMADR is set once and increments on every RAMDAT access, so each
+        byte is one register write, without reading anything back. RAMDAT is a single register (the I2C register
+        pointer would move past it), so a block write can't carry more than one byte of SRAM.
+        :param devNum: Device number
+        :param image: Bytes to write
+        :param start: SRAM address of the first byte
+        :return: <0 on failure, 0 on success
+        """
+        return write_sram(self, devNum, self.REGISTERS["MEMADR"], self.REGISTERS["RAMDAT"], image, start)
+
+    def read_sram(self, devNum, length, start=0):
+        """
+        Read bytes from the SRAM of the device, see write_sram().
+        :param devNum: Device number
+        :param length: Number of bytes
+        :param start: SRAM address of the first byte
+        :return: List of bytes, -1 on failure
+        """
+        return read_sram(self, devNum, self.REGISTERS["MEMADR"], self.REGISTERS["RAMDAT"], length, start)
+
+    def program_nvm(self, devNum, image=None, page=0, timeout=NVM_TIMEOUT, expectedCrc=None):
+        """
+        Program the EEPROM of the device from its SRAM:
+            board.LMK03318.program_nvm(0)                 # the current register settings
+            board.LMK03318.program_nvm(0, image)          # an SRAM image (ex: from the TI configuration tool)
+        The EEPROM is unlocked only for the programming. NVMBUSY is polled with a growing interval (see
+        devices.polling) instead of sleeping for the worst case.
+        :param devNum: Device number
+        :param image: SRAM image (bytes) to program, None to commit the current registers to SRAM first (REGCOMMIT)
+        :param page: Configuration page committed by REGCOMMIT (REGCOMMIT_PG)
+        :param timeout: Longest programming time in seconds
+        :param expectedCrc: If given, NVMLCRC must match it once programmed
+        :return: <0 on failure, 0 on success
+        """
+        count = self.read_param(devNum, "NVMCNT")
+        if count < 0:
+            return -1
+
+        if image is None:
+            if self.write_param(devNum, "REGCOMMIT_PG", page) != 0:
+                return -1
+            if self.write_param(devNum, "REGCOMMIT", 1) != 0:
+                return -1
+        elif self.write_sram(devNum, image) != 0:
+            return -1
+
+        if self.write_param(devNum, "NVMUNLK", self.NVM_UNLOCK_KEY) != 0:
+            return -1
+        try:
+            if self.write_param(devNum, "NVMPROG", 1) != 0:
+                return -1
+            if poll(lambda: self.read_param(devNum, "NVMBUSY"), lambda busy: busy == 0, timeout, what="NVMBUSY") < 0:
+                return -1
+        finally:
+            self.write_param(devNum, "NVMUNLK", 0)
+
+        if self.read_param(devNum, "NVMCRCERR") != 0:
+            _logger.error("EEPROM CRC error after programming device " + str(devNum))
+            return -1
+        newCount = self.read_param(devNum, "NVMCNT")
+        if newCount != min(count + 1, 255):
+            _logger.error("EEPROM program count went from " + str(count) + " to " + str(newCount) + ", programming didn't happen")
+            return -1
+        crc = self.read_param(devNum, "NVMLCRC")
+        if (expectedCrc is not None) and (crc != expectedCrc):
+            _logger.error("EEPROM CRC is " + hex(crc) + ", expecting " + hex(expectedCrc))
+            return -1
+
+        _logger.info("Programmed EEPROM of device " + str(devNum) + " (CRC: " + hex(crc) + ", count: " + str(newCount) + ")")
+        return 0
+
+    def wait_for_lock(self, devNum, timeout=None, pin=None, params=None):
+        """
+        Wait until the PLL is locked and measure how long it took:
+            board.LMK03318.set_frequency(...)
+            lockTime = board.LMK03318.wait_for_lock(0, timeout=0.5)
+        If the device has a status pin wired to a GPIO and programmed to show the lock (LOCK_PIN, or pin), the wait
+        sleeps on the GPIO edge. Otherwise the lock fields (LOCK_PARAMS) are read with a growing interval, see
+        devices.polling.
+        :param devNum: Device number
+        :param timeout: Longest wait in seconds, LOCK_TIMEOUT if None
+        :param pin: Name of the GPIO_PINS pin showing the lock, LOCK_PIN if None
+        :param params: Dictionary of field name to value when locked, LOCK_PARAMS if None
+        :return: Lock time in seconds, -1 on failure or timeout
+        """
+        timeout = timeout if timeout is not None else self.LOCK_TIMEOUT
+        pin = pin if pin is not None else self.LOCK_PIN
+        params = params if params is not None else self.LOCK_PARAMS
+        return wait_for_lock(self, devNum, timeout, pin, params)
+
+    def aread(self, devNum, paramName):
+        """
+        Awaitable read, run on the worker of the bus of the device (see devices.busExecutor), so that one event loop
+        can drive many devices at once:
+            value = await board.LMK03318.aread(0, "LOS")
+        :return: asyncio Future of the value, -1 on failure
+        """
+        return call_async(self, devNum, run_command, self, paramName, devNum)
+
+    def awrite(self, devNum, paramName, value):
+        """
+        Awaitable write, see aread().
+        :return: asyncio Future of the result, <0 on failure, 0 on success
+        """
+        return call_async(self, devNum, run_command, self, paramName, devNum, value)
+
+    def aselftest(self, devNum):
+        """
+        Awaitable selftest, see aread().
+        :return: asyncio Future of the result of selftest()
+        """
+        return call_async(self, devNum, self.selftest, devNum)
+
     def selftest(self, devNum):
         """
         Run a simple selftest to see if the device responds.
@@ -417,6 +877,11 @@ class LMK03318:
         """
         i2c_addr = self.ADDRESS_INFO[devNum]['addr']
         i2c_ch = self.ADDRESS_INFO[devNum]['ch']
+        ''' The ID has to come from the device, not from the register cache '''
+        idInfo = self.REGISTERS["VNDRID"]
+        shadow = self._shadows.get(devNum)
+        if shadow is not None:
+            shadow.invalidate(idInfo.addr, idInfo.regs)
         val = self.read_param(devNum, "VNDRID")
 
         if (val != 0x100B):
@@ -425,20 +890,59 @@ class LMK03318:
             return -1
         return 0
 
+    @instrumented("snapshot", "*")
+    def snapshot(self, devNum):
+        """
+        Read the whole register map of the device in as few I2C block reads as possible (see BURST_RANGES) and
+        decode every field from the image in memory.
+        :param devNum: Device number
+        :return: Dictionary of field name to value, -1 on failure
+        """
+        if not self.ADDRESS_INFO:
+            _logger.error("No Devices registered. Aborting...")
+            return -1
+
+        i2c_addr = self.ADDRESS_INFO[devNum]['addr']
+        i2c_ch = self.ADDRESS_INFO[devNum]['ch']
+        shadow = self._shadows.get(devNum)
+
+        image = bytearray(self.IMAGE_SIZE)
+        try:
+            with self.I2C_POOL.acquire(i2c_ch) as bus:
+                self.PACER.wait(i2c_ch)
+                for start, length in self.BURST_RANGES:
+                    data = bus.read_i2c_block_data(i2c_addr, start, length)
+                    image[start:start + length] = bytes(data)
+                    if shadow is not None:
+                        shadow.load(start, data)
+        except FileNotFoundError as e:
+            _logger.error(e)
+            _logger.error("Could not find i2c bus at channel: " + str(i2c_ch) + ", address: " + str(i2c_addr) + ". Check your connection....")
+            return -1
+        except Exception as e:
+            _logger.error("Could not set message to device. Check connection...")
+            _logger.error(e)
+            return -1
+
+        return decode_fields(self.REGISTERS, image, self._register_exceptions)
+
     def readout_all_registers(self, devNum):
         """
         Display on the logger the contents of the all the registers of the device.
         :param devNum: Device number
-        :return: None
+        :return: Dictionary of field name to value, -1 on failure
         """
         i2c_addr = self.ADDRESS_INFO[devNum]['addr']
         i2c_ch = self.ADDRESS_INFO[devNum]['ch']
         _logger.info("==== Device report ====")
         _logger.info("Device Name: " + str(self.DEVICE_NAME))
         _logger.info("I2C channel: " + str(i2c_ch) + " I2C address: " + str(i2c_addr))
-        for key in self.REGISTERS_INFO:
-            val = self.read_param(i2c_ch, i2c_addr, key)
+        values = self.snapshot(devNum)
+        if values == -1:
+            return -1
+        for key, val in values.items():
             _logger.info('Param Name: {ParamName: <20}, Param Value: {Value: <16}'.format(ParamName=key, Value=val))
+        return values
 
     def gpio_set(self, devNum, name, value):
         """
@@ -454,7 +958,7 @@ class LMK03318:
 
         if name in self.GPIO_PINS[devNum]:
             pin = self.GPIO_PINS[devNum][name]
-            g = GPIO(pin, "out")
+            g = open_gpio(pin, "out")
             g.write(value)
             g.close()
         else:
@@ -541,44 +1045,3 @@ if __name__ == "__main__":
     args = parser.parse_args()
     print((args))
 '''
-
-'''
-    def set_frequency(self, devNum, freq):
-
-        """
-                F_VCO = (F_REF / R) × D × [(INT + NUM / DEN) / M]
-                F_OUT = F_VCO / (P × OUTDIV)
-         """
-        FVCO = 5000000000
-        self.PLL_P(devNum, 7)
-        self.CH_0_MUTE(devNum, 0)
-        self.CH_3_MUTE(devNum, 0)
-        self.INSEL_PLL(devNum, 2)
-        self.OUT_3_MODE1(devNum, 0)
-        self.OUT_3_SEL(devNum, 1)
-
-        ## Config de base pour le output
-        self.PRIBUFSEL(devNum, 1)
-        self.AC_MODE_PRI(devNum, 0)
-        self.DIFFTERM_PRI(devNum, 1)
-        self.TERM2GND_PRI(devNum, 0)
-        self.SECBUFSEL(devNum, 3)
-
-        self.OUT_0_SEL(devNum, 1)
-        self.OUT_0_MODE1(devNum, 0)
-        self.OUT_3_SEL(devNum, 1)
-        self.OUT_3_MODE1(devNum, 0)
-        self.PLL_NDIV(devNum, 40)
-        self.PLLRDIV(devNum, 0)
-        self.PLLMDIV(devNum, 1)
-        self.OUT_0_1_DIV(devNum, 100)
-        self.OUT_2_3_DIV(devNum, 100)
-        self.PRI_D(devNum, 0)
-        self.PLL_P(devNum, 7)
-
-        self.PLL_PDN(devNum, 1)
-        self.PLL_PDN(devNum, 0)
-
-        self.gpio_set(devNum, "SYNC", 0)
-        self.gpio_set(devNum, "SYNC", 1)
-'''
@@ -1,9 +1,39 @@
 import time
 import logging
-from periphery import SPI, GPIO
+from devices.transport import open_gpio
+from devices.busPool import SPI_POOL
+from devices.pacing import PACER, TimingPolicy
+from devices.busExecutor import EXECUTOR, call_async, run_command
+from devices.instrumentation import INSTRUMENTS, instrumented
+from devices.registerBatch import RegisterBatch
+from devices.polling import wait_for_lock
+from devices.registerDescriptor import compile_registers, SELF_CLEARING
+from devices.registerImage import image_size, address_ranges, merge_ranges, decode_fields, contiguous_blocks
+from devices.shadowRegisters import ShadowRegisters
 
 _logger = logging.getLogger(__name__)
 
+
+def read_tics_registers(path):
+    """
+    Read a register export of TICS Pro (File > Export Register Values), one register per line:
+        R0\t0x000010
+        R3\t0x000306
+    Each value is the 24-bit SPI frame: 15-bit address, then the data byte. Lines without a hex value are skipped.
+    :param path: Path of the export
+    :return: Dictionary of register address to value, in the order of the file
+    """
+    registers = {}
+    with open(path, 'r') as f:
+        for line in f:
+            words = [w for w in line.replace(",", " ").split() if w.lower().startswith("0x")]
+            if not words:
+                continue
+            frame = int(words[-1], 16)
+            registers[(frame >> 8) & 0x7FFF] = frame & 0xFF
+    return registers
+
+
 class LMK04610:
     """
         Class for the LMK04610, a Ultra-Low Noise and Low Power Jitter Cleaner
@@ -14,6 +44,14 @@ class LMK04610:
         - Toggle the RESET and SYNC pins
         - The STATUS1 pin acts as the SPI output when not in 3-wire (by default, you aren't)
         - When reading, send one last 0 byte so that the clock continues to operate for the response
+        - A copy of the registers is kept in RAM (see cache_enable()), so field writes don't read the register back
+          and reads of configuration fields don't touch the bus once the register is known. Fields of
+          VOLATILE_PARAMS are always read from the device. Call invalidate() if the device was reset or written
+          by something else
+        - load_image() writes a whole register image (ex: a TICS Pro export) in streaming transfers
+        - Multi-byte fields and snapshot() are read in streaming mode: one address, then as many data bytes as needed.
+          The direction of the stream (ADDR_ASCEND, cleared after a reset) is read from the device once, and again
+          after every write to register 0
     """
 
     DEVICE_NAME = "LMK04610"
@@ -459,9 +497,45 @@ class LMK04610:
     ADDRESS_INFO = []
     GPIO_PINS = []
 
+    ''' Lock detection, see wait_for_lock(). Fields and their value when locked, longest wait in seconds, and the
+        GPIO_PINS pin (and level) showing the lock, if a status pin of the device is programmed for it '''
+    LOCK_PARAMS = {"PLL2_LCK_DET": 1}
+    LOCK_TIMEOUT = 1.0
+    LOCK_PIN = None
+    LOCK_PIN_LEVEL = True
+
+    ''' Register table compiled once, used by the read and write paths '''
+    REGISTERS = compile_registers(REGISTERS_INFO)
+
+    ''' Streamed reads of the whole map (see snapshot()): longest transfer (spidev buffer, address included) and
+        largest run of unused registers read to save a transfer '''
+    STREAM_MAX = 4096
+    STREAM_GAP = 8
+    STREAM_RANGES = merge_ranges(address_ranges(REGISTERS_INFO, maxLen=STREAM_MAX - 2), STREAM_GAP, STREAM_MAX - 2)
+    IMAGE_SIZE = image_size(REGISTERS_INFO)
+
+    ''' Register cache, see cache_enable(). Enabled for every device unless CACHE_REGISTERS is False. The status fields
+        (pin levels, lock and holdover detection) change on their own and are never served from the cache '''
+    CACHE_REGISTERS = True
+    VOLATILE_PARAMS = ["OSCOUT_PINSEL_DIV", "SPI_SDIO_INPUT_M12", "SPI_SDIO_INPUT_Y12", "SPI_SCL_INPUT_M12",
+                       "SPI_SCL_INPUT_Y12", "SPI_SCS_INPUT_M12", "SPI_SCS_INPUT_Y12", "STATUS0_INPUT_M12",
+                       "STATUS0_INPUT_Y12", "STATUS1_INPUT_M12", "STATUS1_INPUT_Y12", "CLKINSEL1_INPUT_M12",
+                       "CLKINSEL1_INPUT_Y12", "PLL1_LCK_DET", "PLL2_LCK_DET", "HOLDOVER_LOS", "HOLDOVER_LOL",
+                       "HOLDOVER_DLD", "LOS", "SYNC_INPUT_M12", "SYNC_INPUT_Y12", "PLL2_FBDIV_MUXSEL"]
+
+    SPI_POOL = SPI_POOL
+
+    TIMING = TimingPolicy.from_registers(REGISTERS_INFO)
+    PACER = PACER
+    EXECUTOR = EXECUTOR
+    INSTRUMENTS = INSTRUMENTS
+
     def __init__(self, path=None, mode=None, name="LMK04610", cmdClass=None):
         self.__dict__ = {}
         self._name = name
+        self._batches = {}
+        self._ascending = {}
+        self._shadows = {}
 
         if path and mode:
             self.ADDRESS_INFO.append({'path': path, 'mode': mode})
@@ -475,8 +549,6 @@ class LMK04610:
             value = cmdClass(value, str(key), self)
             self.__dict__[key] = value
 
-        self.LMK04610CurParams = [0] * 155
-
         '''Extra commands'''
         self.__dict__["GPIO"] = cmdClass(self.GPIO_PINS, "GPIO", self)
 
@@ -493,6 +565,8 @@ class LMK04610:
             self.GPIO(i, "RESET", False)
             time.sleep(0.5)
             self.GPIO(i, "RESET", True)
+            self._ascending.pop(i, None)
+            self.invalidate(i)
 
     def register_device(self, channel, address):
         self.ADDRESS_INFO.append({'path': channel, 'mode': address})
@@ -504,11 +578,11 @@ class LMK04610:
             report += ('{DeviceName: <10} :: Path:{Path: >3}, Mode:{Mode: >4}(0x{Mode:02X})\n'.format(DeviceName=self._name, Path=addr['path'], Mode=addr['mode']))
         return report
 
+    @instrumented("read")
     def read_param(self, devNum, paramName):
 
-        if paramName in self.REGISTERS_INFO:
-            paramInfo = self.REGISTERS_INFO[paramName]
-        else:
+        paramInfo = self.REGISTERS.get(paramName)
+        if paramInfo is None:
             _logger.error("{paramName} is an unknown parameter or pin name.".format(paramName=paramName))
             return -1
 
@@ -519,47 +593,42 @@ class LMK04610:
         spi_path = self.ADDRESS_INFO[devNum]["path"]
         spi_mode = self.ADDRESS_INFO[devNum]["mode"]
 
-        totalResponse = 0
+        shadow = self._shadow(devNum)
+        cached = (shadow is not None) and shadow.cacheable(paramInfo.addr, paramInfo.regs)
 
         try:
+            if cached and shadow.has(paramInfo.addr, paramInfo.regs):
+                data = shadow.get(paramInfo.addr, paramInfo.regs)
+            else:
+                with self.SPI_POOL.acquire((spi_path, spi_mode, 2000000, 'msb')) as bus:
+                    self.PACER.wait(spi_path)
+                    if paramInfo.regs == 1:
+                        data = [self._read_register(bus, paramInfo.addr)]
+                    else:
+                        data = self._read_stream(bus, devNum, paramInfo.addr, paramInfo.regs)
+                if cached:
+                    shadow.load(paramInfo.addr, data)
 
-            bus = SPI(spi_path, spi_mode, 2000000, bit_order='msb')
             # Dont forget to convert to big endian!
-            for r in range(paramInfo['regs']):
-                writeBuf = [0, 0, 0]
-                writeBuf[1] = (paramInfo['addr'] + r)
-                writeBuf[0] = 0x80
-                _logger.debug("Sending: " + str(writeBuf))
-                response = bus.transfer(writeBuf)
-                _logger.debug("Received:" + str(response))
-                totalResponse = (totalResponse << 8) + response[-1]
-            bus.close()
-
-            totalResponse &= paramInfo['mask']
-            totalResponse >>= paramInfo['loc']
+            totalResponse = int.from_bytes(bytes(data), byteorder='big', signed=False)
+            totalResponse &= paramInfo.mask
+            totalResponse >>= paramInfo.loc
         except Exception as e:
             _logger.error("Could not set message to device. Check connection...")
             _logger.error(e)
             return -1
 
-        time.sleep(0.01)
+        self.PACER.after_read(spi_path, self.TIMING)
         return totalResponse
 
 
+    @instrumented("write")
     def write_param(self, devNum, paramName, value):
-        if not (paramName in self.REGISTERS_INFO):
+        paramInfo = self.REGISTERS.get(paramName)
+        if paramInfo is None:
             _logger.error(str(paramName) + " is an invalid parameter name")
             return -1
 
-        if paramName in self.REGISTERS_INFO:
-            paramInfo = self.REGISTERS_INFO[paramName]
-        elif paramName in self.GPIO_PINS[devNum]:
-            self.gpio_set(devNum=devNum, name=paramName, value=value)
-            return 0
-        else:
-            _logger.error("{paramName} is an unknown parameter or pin name.".format(paramName=paramName))
-            return -1
-
         if not self.ADDRESS_INFO:
             _logger.error("No Devices registered. Aborting...")
             return -1
@@ -567,47 +636,194 @@ class LMK04610:
         spi_path = self.ADDRESS_INFO[devNum]["path"]
         spi_mode = self.ADDRESS_INFO[devNum]["mode"]
 
-        if (1 == paramInfo["min"]) and (1 == paramInfo["max"]):
+        if paramInfo.access == SELF_CLEARING:
             _logger.error(str(paramName) + " is a read-only parameter")
             return -1
 
-        if (value < paramInfo["min"]) or (value > paramInfo["max"]):
+        if (value < paramInfo.min) or (value > paramInfo.max):
             _logger.error("{value} is an invalid value for {paramName}. " +
                           "Must be between {min} and {max}".format(value=value,
                                                                    paramName=paramName,
-                                                                   min=paramInfo["min"],
-                                                                   max=paramInfo["max"]))
+                                                                   min=paramInfo.min,
+                                                                   max=paramInfo.max))
             return -1
 
         ''' Data formating to put into the register '''
-        value <<= paramInfo["loc"]
-        value &= paramInfo["mask"]
+        value <<= paramInfo.loc
+        value &= paramInfo.mask
         value = self.register_exceptions(paramInfo, value)
 
+        ''' Inside a batch, the write is sent when the batch exits '''
+        batch = self._batches.get(devNum)
+        if batch is not None:
+            ''' Some fields have a mask wider than their registers, only the bits the registers hold are written,
+                like below '''
+            regsMask = (1 << (8 * paramInfo.regs)) - 1
+            if paramInfo.mask & regsMask:
+                batch.add(paramInfo.addr, value & regsMask, paramInfo.mask & regsMask, paramInfo.regs)
+            return 0
+
+        shadow = self._shadow(devNum)
+        cached = (shadow is not None) and shadow.cacheable(paramInfo.addr, paramInfo.regs)
+
         try:
-            curr_val = self.read_param(devNum, paramName)
+            with self.SPI_POOL.acquire((spi_path, spi_mode, 2000000, 'msb')) as bus:
+                self.PACER.wait(spi_path)
+                # Big endian: the first register holds the most significant byte, like in read_param
+                for r in range(paramInfo.regs):
+                    shift = 8 * (paramInfo.regs - 1 - r)
+                    regMask = (paramInfo.mask >> shift) & 0xFF
+                    if not regMask:
+                        continue
+                    addr = paramInfo.addr + r
+                    ''' Keep the bits of the register that are not part of the field, from the register cache if we have it '''
+                    if cached and shadow.has(addr, 1):
+                        curr_val_reg = shadow.get(addr, 1)[0]
+                    else:
+                        curr_val_reg = self._read_register(bus, addr)
+                    write_value = (curr_val_reg & ~regMask) | ((value >> shift) & regMask)
+                    ''' Stays dirty in the cache until the write went through '''
+                    if cached:
+                        shadow.merge(addr, [write_value])
+                    self._write_register(bus, addr, write_value)
+                    if cached:
+                        shadow.clean(addr, 1)
 
-            bus = SPI(spi_path, spi_mode, 2000000, bit_order='msb')
-            # Dont forget to convert to big endian!
-            for r in range(paramInfo['regs']):
-                writeBuf = [0, 0, 0]
-                writeBuf[0] = (paramInfo['addr'] + r) & 0xFF00
-                writeBuf[1] = (paramInfo['addr'] + r) & 0xFF
-                curr_val_reg = ((curr_val >> (r * 8)) & 0xFF) & (~paramInfo['mask'])
-                write_value = ((value >> (r * 8)) & 0xFF)
-                writeBuf[2] += curr_val_reg | write_value
-
-                #writeBuf = (valueToSend).to_bytes(3, 'big')
-                _logger.debug("About to write raw data: " + str(writeBuf))
-                bus.transfer(writeBuf)
-            bus.close()
+        except Exception as e:
+            _logger.error("Could not set message to device. Check connection...")
+            _logger.error(e)
+            return -1
+
+        if paramInfo.addr == 0:
+            self._ascending.pop(devNum, None)
+        self.PACER.after_write(spi_path, self.TIMING, paramInfo.addrs)
+        return 0
+
+    def _read_register(self, bus, addr):
+        """
+        Read one raw register. The frame is R/W bit + 15-bit address, then the data byte.
+        :param bus: Open SPI handle
+        :param addr: Register address
+        :return: Register value
+        """
+        writeBuf = [0x80 | ((addr >> 8) & 0x7F), addr & 0xFF, 0]
+        if _logger.isEnabledFor(logging.DEBUG):
+            _logger.debug("Sending: " + str(writeBuf))
+        response = bus.transfer(writeBuf)
+        if _logger.isEnabledFor(logging.DEBUG):
+            _logger.debug("Received:" + str(response))
+        return response[-1]
 
+    def _read_stream(self, bus, devNum, addr, length):
+        """
+        Read consecutive registers in one streaming transfer. When the device streams down (ADDR_ASCEND=0), the
+        transfer starts at the last register and the bytes are put back in address order.
+        :param bus: Open SPI handle
+        :param devNum: Device number, for the stream direction
+        :param addr: First register address
+        :param length: Number of registers
+        :return: List of register values, in address order
+        """
+        ascending = self._ascending.get(devNum)
+        if ascending is None:
+            ascending = bool(self._read_register(bus, 0) & self.REGISTERS["ADDR_ASCEND"].mask)
+            self._ascending[devNum] = ascending
+
+        start = addr if ascending else addr + length - 1
+        writeBuf = [0x80 | ((start >> 8) & 0x7F), start & 0xFF] + [0] * length
+        if _logger.isEnabledFor(logging.DEBUG):
+            _logger.debug("Streaming " + str(length) + " registers from " + str(start))
+        response = list(bus.transfer(writeBuf))[2:]
+        if _logger.isEnabledFor(logging.DEBUG):
+            _logger.debug("Received:" + str(response))
+        return response if ascending else response[::-1]
+
+    def _write_stream(self, bus, devNum, addr, data):
+        """
+        Write consecutive registers in one streaming transfer, in the direction the device streams (see
+        _read_stream()).
+        :param bus: Open SPI handle
+        :param devNum: Device number, for the stream direction
+        :param addr: First register address
+        :param data: Register values, in address order
+        :return: None
+        """
+        ascending = self._ascending.get(devNum)
+        if ascending is None:
+            ascending = bool(self._read_register(bus, 0) & self.REGISTERS["ADDR_ASCEND"].mask)
+            self._ascending[devNum] = ascending
+
+        start = addr if ascending else addr + len(data) - 1
+        payload = list(data) if ascending else list(data)[::-1]
+        writeBuf = [(start >> 8) & 0x7F, start & 0xFF] + [b & 0xFF for b in payload]
+        if _logger.isEnabledFor(logging.DEBUG):
+            _logger.debug("Streaming " + str(len(data)) + " registers to " + str(start))
+        bus.transfer(writeBuf)
+
+    def _write_register(self, bus, addr, data):
+        """
+        Write one raw register.
+        :param bus: Open SPI handle
+        :param addr: Register address
+        :param data: Register value
+        :return: None
+        """
+        writeBuf = [(addr >> 8) & 0x7F, addr & 0xFF, data & 0xFF]
+        if _logger.isEnabledFor(logging.DEBUG):
+            _logger.debug("About to write raw data: " + str(writeBuf))
+        bus.transfer(writeBuf)
+
+    def batch(self, devNum):
+        """
+        Collect the field writes to a device and send them together when the block exits, see RegisterBatch.
+            with dev.batch(0) as b:
+                dev.PLL2_EN_FILTER(0, 1)
+                b.write("PLL2_CFILT", 8)
+        :param devNum: Device number
+        :return: RegisterBatch context manager
+        """
+        return RegisterBatch(self, devNum)
+
+    def write_batch(self, batch):
+        """
+        Send the writes collected by a batch in a single SPI session, each register written once in address order.
+        :param batch: RegisterBatch
+        :return: <0 on failure, 0 on success
+        """
+        if not self.ADDRESS_INFO:
+            _logger.error("No Devices registered. Aborting...")
+            return -1
+
+        spi_path = self.ADDRESS_INFO[batch.devNum]["path"]
+        spi_mode = self.ADDRESS_INFO[batch.devNum]["mode"]
+        shadow = self._shadow(batch.devNum)
+
+        try:
+            with self.SPI_POOL.acquire((spi_path, spi_mode, 2000000, 'msb')) as bus:
+                self.PACER.wait(spi_path)
+                for addr in batch.addresses():
+                    cached = (shadow is not None) and shadow.cacheable(addr, 1)
+                    ''' Only read back the registers where the batch doesn't set every bit '''
+                    if cached and shadow.has(addr, 1):
+                        curr_val = shadow.get(addr, 1)[0]
+                    elif batch.covers(addr):
+                        curr_val = 0
+                    else:
+                        curr_val = self._read_register(bus, addr)
+                    write_value = batch.merge_value(addr, curr_val)
+                    if cached:
+                        shadow.merge(addr, [write_value])
+                    self._write_register(bus, addr, write_value)
+                    if cached:
+                        shadow.clean(addr, 1)
         except Exception as e:
             _logger.error("Could not set message to device. Check connection...")
             _logger.error(e)
             return -1
 
-        time.sleep(0.01)
+        if 0 in batch.addresses():
+            self._ascending.pop(batch.devNum, None)
+        self.PACER.after_write(spi_path, self.TIMING, batch.addresses())
         return 0
 
     """
@@ -635,7 +851,54 @@ class LMK04610:
     def register_exceptions(self, paramInfo, value):
         return value
 
+    def wait_for_lock(self, devNum, timeout=None, pin=None, params=None):
+        """
+        Wait until the PLL is locked and measure how long it took:
+            board.LMK04610.load_image(0, image)
+            lockTime = board.LMK04610.wait_for_lock(0, timeout=0.5)
+        If the device has a status pin wired to a GPIO and programmed to show the lock (LOCK_PIN, or pin), the wait
+        sleeps on the GPIO edge. Otherwise the lock fields (LOCK_PARAMS) are read with a growing interval, see
+        devices.polling.
+        :param devNum: Device number
+        :param timeout: Longest wait in seconds, LOCK_TIMEOUT if None
+        :param pin: Name of the GPIO_PINS pin showing the lock, LOCK_PIN if None
+        :param params: Dictionary of field name to value when locked, LOCK_PARAMS if None
+        :return: Lock time in seconds, -1 on failure or timeout
+        """
+        timeout = timeout if timeout is not None else self.LOCK_TIMEOUT
+        pin = pin if pin is not None else self.LOCK_PIN
+        params = params if params is not None else self.LOCK_PARAMS
+        return wait_for_lock(self, devNum, timeout, pin, params)
+
+    def aread(self, devNum, paramName):
+        """
+        Awaitable read, run on the worker of the bus of the device (see devices.busExecutor), so that one event loop
+        can drive many devices at once:
+            value = await board.LMK04610.aread(0, "VENDORID")
+        :return: asyncio Future of the value, -1 on failure
+        """
+        return call_async(self, devNum, run_command, self, paramName, devNum)
+
+    def awrite(self, devNum, paramName, value):
+        """
+        Awaitable write, see aread().
+        :return: asyncio Future of the result, <0 on failure, 0 on success
+        """
+        return call_async(self, devNum, run_command, self, paramName, devNum, value)
+
+    def aselftest(self, devNum):
+        """
+        Awaitable selftest, see aread().
+        :return: asyncio Future of the result of selftest()
+        """
+        return call_async(self, devNum, self.selftest, devNum)
+
     def selftest(self, devNum):
+        ''' The ID has to come from the device, not from the register cache '''
+        idInfo = self.REGISTERS["VENDORID"]
+        shadow = self._shadows.get(devNum)
+        if shadow is not None:
+            shadow.invalidate(idInfo.addr, idInfo.regs)
         vendorid_val = self.read_param(devNum, "VENDORID")
 
         if (vendorid_val != 0x5108):
@@ -645,10 +908,183 @@ class LMK04610:
 
         return 0
 
+    def _shadow(self, devNum):
+        if devNum not in self._shadows:
+            self._shadows[devNum] = ShadowRegisters.from_registers(self.REGISTERS_INFO, self.VOLATILE_PARAMS) \
+                if self.CACHE_REGISTERS else None
+        return self._shadows[devNum]
+
+    def cache_enable(self, devNum, enable=True):
+        """
+        Keep a copy of the registers of a device in RAM (the default, see CACHE_REGISTERS). After the first access,
+        reads are served from the copy and writes don't need to read the register back first. Registers holding a
+        field of VOLATILE_PARAMS always go to the device.
+        :param devNum: Device number
+        :param enable: True to enable the cache, False to drop it
+        :return: None
+        """
+        if enable:
+            if self._shadows.get(devNum) is None:
+                self._shadows[devNum] = ShadowRegisters.from_registers(self.REGISTERS_INFO, self.VOLATILE_PARAMS)
+        else:
+            self._shadows[devNum] = None
+
+    def invalidate(self, devNum=None):
+        """
+        Forget the cached registers, they will be read from the device on next access.
+        :param devNum: Device number, all devices if None
+        :return: None
+        """
+        for num, shadow in self._shadows.items():
+            if (shadow is not None) and ((devNum is None) or (num == devNum)):
+                shadow.invalidate()
+        if devNum is None:
+            self._ascending.clear()
+        else:
+            self._ascending.pop(devNum, None)
+
+    def refresh(self, devNum):
+        """
+        Read again from the device all the registers currently in the cache.
+        :param devNum: Device number
+        :return: <0 on failure, 0 on success
+        """
+        shadow = self._shadows.get(devNum)
+        if shadow is None:
+            _logger.warning("Register cache is not enabled for device " + str(devNum) + ". Ignoring")
+            return -1
+
+        spi_path = self.ADDRESS_INFO[devNum]["path"]
+        spi_mode = self.ADDRESS_INFO[devNum]["mode"]
+
+        try:
+            with self.SPI_POOL.acquire((spi_path, spi_mode, 2000000, 'msb')) as bus:
+                self.PACER.wait(spi_path)
+                for start, length in shadow.valid_ranges(self.STREAM_MAX - 2):
+                    shadow.load(start, self._read_stream(bus, devNum, start, length))
+        except Exception as e:
+            _logger.error("Could not refresh register cache. Check connection...")
+            _logger.error(e)
+            shadow.invalidate()
+            return -1
+
+        return 0
+
+    @instrumented("apply", "*")
+    def load_image(self, devNum, image):
+        """
+        Write a complete register configuration to a device, in address order and in a single SPI session:
+        register 0 first (it sets the stream direction), then one streaming transfer per run of consecutive
+        registers. The register cache of the device is enabled and holds the image afterwards.
+            dev.load_image(0, "config.txt")                     # TICS Pro export, see read_tics_registers()
+            dev.load_image(0, {0x14: 0x03, 0x15: 0x00})
+        :param devNum: Device number
+        :param image: Path of a TICS Pro export, dictionary of register address to value, or bytes indexed by
+                      register address (only the registers of REGISTERS_INFO are written)
+        :return: Number of registers written, <0 on failure
+        """
+        if not self.ADDRESS_INFO:
+            _logger.error("No Devices registered. Aborting...")
+            return -1
+
+        if isinstance(image, str):
+            try:
+                registers = read_tics_registers(image)
+            except Exception as e:
+                _logger.error("Could not read register export " + str(image))
+                _logger.error(e)
+                return -1
+        elif isinstance(image, dict):
+            registers = dict(image)
+        else:
+            covered = [a for start, length in address_ranges(self.REGISTERS_INFO) for a in range(start, start + length)]
+            registers = dict((a, image[a]) for a in covered if a < len(image))
+
+        for addr, value in registers.items():
+            if not (0 <= addr < self.IMAGE_SIZE) or not (0 <= value <= 0xFF):
+                _logger.error("Invalid register " + str(addr) + " = " + str(value) + " in the image")
+                return -1
+
+        spi_path = self.ADDRESS_INFO[devNum]["path"]
+        spi_mode = self.ADDRESS_INFO[devNum]["mode"]
+        self.cache_enable(devNum)
+        shadow = self._shadows[devNum]
+        addresses = sorted(registers)
+
+        try:
+            with self.SPI_POOL.acquire((spi_path, spi_mode, 2000000, 'msb')) as bus:
+                self.PACER.wait(spi_path)
+                if addresses and addresses[0] == 0:
+                    shadow.merge(0, [registers[0]])
+                    self._write_register(bus, 0, registers[0])
+                    shadow.clean(0, 1)
+                    self._ascending.pop(devNum, None)
+                    addresses = addresses[1:]
+                for start, length in contiguous_blocks(addresses, self.STREAM_MAX - 2):
+                    data = [registers[a] for a in range(start, start + length)]
+                    shadow.merge(start, data)
+                    self._write_stream(bus, devNum, start, data)
+                    shadow.clean(start, length)
+        except Exception as e:
+            _logger.error("Could not set message to device. Check connection...")
+            _logger.error(e)
+            shadow.invalidate()
+            return -1
+
+        if _logger.isEnabledFor(logging.DEBUG):
+            _logger.debug("Loaded " + str(len(registers)) + " registers to device " + str(devNum))
+        self.PACER.after_write(spi_path, self.TIMING, sorted(registers))
+        return len(registers)
+
+    @instrumented("snapshot", "*")
+    def snapshot(self, devNum):
+        """
+        Read the whole register map of the device in a few streaming transfers (see STREAM_RANGES) and decode every
+        field from the image in memory.
+        :param devNum: Device number
+        :return: Dictionary of field name to value, -1 on failure
+        """
+        if not self.ADDRESS_INFO:
+            _logger.error("No Devices registered. Aborting...")
+            return -1
+
+        spi_path = self.ADDRESS_INFO[devNum]["path"]
+        spi_mode = self.ADDRESS_INFO[devNum]["mode"]
+
+        shadow = self._shadow(devNum)
+
+        image = bytearray(self.IMAGE_SIZE)
+        try:
+            with self.SPI_POOL.acquire((spi_path, spi_mode, 2000000, 'msb')) as bus:
+                self.PACER.wait(spi_path)
+                for start, length in self.STREAM_RANGES:
+                    data = self._read_stream(bus, devNum, start, length)
+                    image[start:start + length] = bytes(data)
+                    if shadow is not None:
+                        shadow.load(start, data)
+        except Exception as e:
+            _logger.error("Could not set message to device. Check connection...")
+            _logger.error(e)
+            return -1
+
+        self.PACER.after_read(spi_path, self.TIMING)
+        return decode_fields(self.REGISTERS, image, self.register_exceptions)
+
     def readout_all_registers(self, devNum):
+        """
+        Display on the logger the contents of the all the registers of the device.
+        :param devNum: Device number
+        :return: Dictionary of field name to value, -1 on failure
+        """
         _logger.info("==== Device report ====")
-        _logger.warning("lmk01020 is write-only, skipping...")
-        return 0
+        _logger.info("Device Name: " + str(self.DEVICE_NAME))
+        _logger.info("SPI path: " + str(self.ADDRESS_INFO[devNum]["path"]) + " SPI mode: " + str(self.ADDRESS_INFO[devNum]["mode"]))
+        values = self.snapshot(devNum)
+        if values == -1:
+            return -1
+        for key, val in values.items():
+            _logger.info('Param Name: {ParamName: <20}, Param Value: {Value: <16}'.format(ParamName=key, Value=val))
+        return values
 
     def gpio_set(self, devNum, name, value):
         if not self.GPIO_PINS:
@@ -657,7 +1093,7 @@ class LMK04610:
 
         if name in self.GPIO_PINS[devNum]:
             pin = self.GPIO_PINS[devNum][name]
-            g = GPIO(pin, "out")
+            g = open_gpio(pin, "out")
             g.write(value)
             g.close()
         else:
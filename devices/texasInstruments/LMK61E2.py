@@ -1,10 +1,100 @@
 import time
-import smbus
 import logging
-from periphery import GPIO
+import functools
+from fractions import Fraction
+from collections import namedtuple
+from devices.transport import open_gpio
+from devices.busPool import I2C_POOL
+from devices.pacing import PACER, TimingPolicy
+from devices.busExecutor import EXECUTOR, call_async, run_command
+from devices.instrumentation import INSTRUMENTS, instrumented
+from devices.registerImage import image_size, address_ranges, decode_fields
+from devices.registerBatch import RegisterBatch, apply_config, write_batch
+from devices.shadowRegisters import enable_cache, invalidate_cache, refresh_cache, cached_block_access
+from devices.polling import poll, wait_for_lock
+from devices.sramAccess import write_sram, read_sram
+from devices.registerDescriptor import compile_registers, READ_ONLY
 
 _logger = logging.getLogger(__name__)
 
+''' Frequency of the internal crystal, and limits of the PLL, in Hz '''
+XO_FREQ = 50000000
+VCO_MIN = 4600000000
+VCO_MAX = 5600000000
+
+''' Number of target frequencies whose solution is kept '''
+PLAN_CACHE_SIZE = 64
+
+
+class FrequencyPlan(namedtuple("FrequencyPlan", ["fOut", "fVco", "doubler", "outDiv", "ndiv", "num", "den",
+                                                 "error"])):
+    """
+        Divider settings giving an output frequency, see solve_frequency().
+
+        - fOut: Frequency obtained, in Hz (can differ from the target by error, in fractional mode)
+        - doubler: 1 if the reference doubler is used (PFD at 100 MHz), 0 otherwise (50 MHz)
+        - num, den: Fractional part of the feedback divider, num=0 in integer mode
+    """
+    __slots__ = ()
+
+    @property
+    def integer(self):
+        return self.num == 0
+
+    def config(self):
+        """
+        :return: Dictionary of field name to value programming the plan
+        """
+        return {"PLL_D": self.doubler,
+                "OUT_DIV": self.outDiv,
+                "NDIV": self.ndiv,
+                "PLL_NUM": self.num,
+                "PLL_DEN": self.den,
+                "PLL_ORDER": 0 if self.integer else 3,      # integer mode: no delta-sigma modulator, no dither
+                                                            # fractional: 3rd order, weak dither
+                "PLL_DTHRMODE": 3 if self.integer else 0}
+
+
+@functools.lru_cache(maxsize=PLAN_CACHE_SIZE)
+def solve_frequency(fOut, fRef=XO_FREQ):
+    """
+    Search the divider space for an output frequency. Integer solutions are preferred, then the smallest frequency
+    error, then the highest PFD frequency (less phase noise). Solutions are kept in an LRU cache, per target.
+    :param fOut: Target output frequency in Hz
+    :param fRef: Reference frequency in Hz
+    :return: FrequencyPlan, None if no divider setting reaches the frequency
+    """
+    info = LMK61E2.REGISTERS_INFO
+    target = Fraction(fOut).limit_denominator(1000000)
+    maxDen = info["PLL_DEN"]["max"]
+    best = None
+    bestKey = None
+    for doubler in (1, 0):
+        fPfd = fRef * (2 if doubler else 1)
+        for outDiv in range(info["OUT_DIV"]["min"], info["OUT_DIV"]["max"] + 1):
+            fVco = target * outDiv
+            if fVco < VCO_MIN:
+                continue
+            if fVco > VCO_MAX:
+                break
+            n = fVco / fPfd
+            ndiv = int(n)
+            frac = (n - ndiv).limit_denominator(maxDen)
+            if frac == 1:
+                ndiv, frac = ndiv + 1, Fraction(0)
+            if (ndiv < info["NDIV"]["min"]) or (ndiv > info["NDIV"]["max"]):
+                continue
+            achieved = (ndiv + frac) * fPfd / outDiv
+            error = abs(achieved - target)
+            key = (frac != 0, error, -fPfd)
+            if (bestKey is None) or (key < bestKey):
+                bestKey = key
+                best = FrequencyPlan(fOut=float(achieved), fVco=float(achieved * outDiv), doubler=doubler,
+                                     outDiv=outDiv, ndiv=ndiv, num=frac.numerator if frac else 0,
+                                     den=frac.denominator if frac else 1, error=float(error))
+    return best
+
+
 class LMK61E2:
     """
         Class for the LMK61E2, a Ultra-low jitter programmable Oscillator
@@ -63,9 +153,39 @@ class LMK61E2:
     ADDRESS_INFO = []
     GPIO_PINS = {}
 
+    ''' Key opening NVMUNLK, and longest EEPROM programming time in seconds '''
+    NVM_UNLOCK_KEY = 0xBE
+    NVM_TIMEOUT = 1.0
+
+    I2C_POOL = I2C_POOL
+
+    ''' Lock detection, see wait_for_lock(). Fields and their value when locked, longest wait in seconds, and the
+        GPIO_PINS pin (and level) showing the lock, if a status pin of the device is programmed for it '''
+    LOCK_PARAMS = {"LOL": 0}
+    LOCK_TIMEOUT = 1.0
+    LOCK_PIN = None
+    LOCK_PIN_LEVEL = True
+
+    ''' Register table compiled once, used by the read and write paths '''
+    REGISTERS = compile_registers(REGISTERS_INFO)
+
+    TIMING = TimingPolicy.from_registers(REGISTERS_INFO)
+    PACER = PACER
+    EXECUTOR = EXECUTOR
+    INSTRUMENTS = INSTRUMENTS
+
+    ''' Contiguous register ranges, for burst reads of the whole map '''
+    BURST_RANGES = address_ranges(REGISTERS_INFO)
+    IMAGE_SIZE = image_size(REGISTERS_INFO)
+
+    ''' Fields that change on their own. Their registers are never served from the register cache '''
+    VOLATILE_PARAMS = ["LOL", "CAL", "NVMSCRC", "NVMCNT", "NVMBUSY", "NVMCRCERR", "MEMADR", "NVMDAT", "RAMDAT"]
+
     def __init__(self, i2c_ch=None, i2c_addr=None, name="LMK61E2", cmdClass=None):
         self.__dict__ = {}
         self._name = name
+        self._shadows = {}
+        self._batches = {}
         if i2c_ch and i2c_addr:
             self.ADDRESS_INFO.append({'ch': i2c_ch, 'addr': i2c_addr})
             _logger.debug("Instantiated LMK61E2 device with ch: " + str(i2c_ch) + " and addr: " + str(i2c_addr))
@@ -91,20 +211,28 @@ class LMK61E2:
             report += ('{DeviceName: <10} :: Channel:{Channel: >3}, Address:{Address: >4}(0x{Address:02X})\n'.format(DeviceName=self._name, Channel=addr['ch'], Address=addr['addr']))
         return report
 
+    @instrumented("read")
     def read_param(self, devNum, paramName):
-        if not (paramName in self.REGISTERS_INFO):
+        paramInfo = self.REGISTERS.get(paramName)
+        if paramInfo is None:
             _logger.error(str(paramName) + " is an invalid parameter name")
             return -1
 
-        paramInfo = self.REGISTERS_INFO[paramName]
-
         i2c_addr = self.ADDRESS_INFO[devNum]['addr']
         i2c_ch = self.ADDRESS_INFO[devNum]['ch']
 
+        shadow = self._shadows.get(devNum)
+        cached = (shadow is not None) and shadow.cacheable(paramInfo.addr, paramInfo.regs)
+
         try:
-            bus = smbus.SMBus(i2c_ch)
-            retVal = bus.read_i2c_block_data(i2c_addr, paramInfo["addr"], paramInfo["regs"])
-            bus.close()
+            if cached and shadow.has(paramInfo.addr, paramInfo.regs):
+                retVal = shadow.get(paramInfo.addr, paramInfo.regs)
+            else:
+                with self.I2C_POOL.acquire(i2c_ch) as bus:
+                    self.PACER.wait(i2c_ch)
+                    retVal = bus.read_i2c_block_data(i2c_addr, paramInfo.addr, paramInfo.regs)
+                if cached:
+                    shadow.load(paramInfo.addr, retVal)
         except FileNotFoundError as e:
             _logger.error(e)
             _logger.error("Could not find i2c bus at channel: " + str(i2c_ch) + ", address: " + str(i2c_addr) + ".Check your connection....")
@@ -117,64 +245,79 @@ class LMK61E2:
         val = int.from_bytes(retVal, byteorder='big', signed=False)
 
         ''' Data formating from the register '''
-        val &= paramInfo['mask']
-        val >>= paramInfo['loc']
+        val &= paramInfo.mask
+        val >>= paramInfo.loc
         val = self.register_exceptions(paramInfo, val)
 
-        time.sleep(0.01)
+        self.PACER.after_read(i2c_ch, self.TIMING)
         return val
 
+    @instrumented("write")
     def write_param(self, devNum, paramName, value):
-        if not (paramName in self.REGISTERS_INFO):
+        paramInfo = self.REGISTERS.get(paramName)
+        if paramInfo is None:
             _logger.error(str(paramName) + " is an invalid parameter name")
             return -1
 
-        if paramName in self.REGISTERS_INFO:
-            paramInfo = self.REGISTERS_INFO[paramName]
-        else:
-            _logger.error("{paramName} is an unknown parameter or pin name.".format(paramName=paramName))
-            return -1
-
         if not self.ADDRESS_INFO:
             _logger.error("No Devices registered. Aborting...")
             return -1
         i2c_addr = self.ADDRESS_INFO[devNum]['addr']
         i2c_ch = self.ADDRESS_INFO[devNum]['ch']
 
-        if (0 == paramInfo["min"]) and (0 == paramInfo["max"]):
+        if paramInfo.access == READ_ONLY:
             _logger.error(str(paramName) + " is a read-only parameter")
             return -1
 
-        if (value < paramInfo["min"]) or (value > paramInfo["max"]):
+        if (value < paramInfo.min) or (value > paramInfo.max):
             _logger.error("{value} is an invalid value for {paramName}. Must be between {min} and {max}".format(value=value,
                                                                                                                 paramName=paramName,
-                                                                                                                min=paramInfo["min"],
-                                                                                                                max=paramInfo["max"]))
+                                                                                                                min=paramInfo.min,
+                                                                                                                max=paramInfo.max))
             return -1
 
         ''' Data formating to put into the register '''
-        value <<= paramInfo["loc"]
-        value &= paramInfo["mask"]
+        value <<= paramInfo.loc
+        value &= paramInfo.mask
         value = self.register_exceptions(paramInfo, value)
 
+        ''' Inside a batch, the write is sent when the batch exits '''
+        batch = self._batches.get(devNum)
+        if batch is not None:
+            batch.add(paramInfo.addr, value, paramInfo.mask, paramInfo.regs)
+            return 0
+
+        shadow = self._shadows.get(devNum)
+        cached = (shadow is not None) and shadow.cacheable(paramInfo.addr, paramInfo.regs)
+
         try:
-            bus = smbus.SMBus(i2c_ch)
-
-            ''' Retrieve value in register '''
-            currVal = bus.read_i2c_block_data(i2c_addr, paramInfo["addr"], paramInfo["regs"])
-            _logger.debug("In register " + str(paramName) + " = " + str([hex(no) for no in currVal]))
-            currVal = int.from_bytes(currVal, byteorder='big')
-            ''' Clear all bits concerned with our parameter and keep the others we dont want to affect
-                Note this might cause problems if your python is not 64-bits and registers are >32bits '''
-            currVal_cleared = currVal & (~paramInfo["mask"])
-            ''' Write new value for the parameter '''
-            newVal = value + currVal_cleared
-            ''' Package as a byte-list '''
-            writeBuf = self.int_to_short_list(newVal, fixed_length=paramInfo["regs"])
-
-            _logger.debug("To register " + str(paramName) + " = " + str([hex(no) for no in writeBuf]))
-            bus.write_i2c_block_data(i2c_addr, paramInfo["addr"], writeBuf)
-            bus.close()
+            with self.I2C_POOL.acquire(i2c_ch) as bus:
+                self.PACER.wait(i2c_ch)
+                ''' Retrieve value in register, from the register cache if we have it '''
+                if cached and shadow.has(paramInfo.addr, paramInfo.regs):
+                    currVal = shadow.get(paramInfo.addr, paramInfo.regs)
+                else:
+                    currVal = bus.read_i2c_block_data(i2c_addr, paramInfo.addr, paramInfo.regs)
+                if _logger.isEnabledFor(logging.DEBUG):
+                    _logger.debug("In register " + str(paramName) + " = " + str([hex(no) for no in currVal]))
+                currVal = int.from_bytes(currVal, byteorder='big')
+                ''' Clear all bits concerned with our parameter and keep the others we dont want to affect
+                    Note this might cause problems if your python is not 64-bits and registers are >32bits '''
+                currVal_cleared = currVal & paramInfo.invMask
+                ''' Write new value for the parameter '''
+                newVal = value + currVal_cleared
+                ''' Package as a byte-list '''
+                writeBuf = self.int_to_short_list(newVal, fixed_length=paramInfo.regs)
+
+                ''' Stays dirty in the cache until the write went through '''
+                if cached:
+                    shadow.merge(paramInfo.addr, writeBuf)
+
+                if _logger.isEnabledFor(logging.DEBUG):
+                    _logger.debug("To register " + str(paramName) + " = " + str([hex(no) for no in writeBuf]))
+                bus.write_i2c_block_data(i2c_addr, paramInfo.addr, writeBuf)
+                if cached:
+                    shadow.clean(paramInfo.addr, paramInfo.regs)
         except FileNotFoundError as e:
             _logger.error(e)
             _logger.error("Could not find i2c bus at channel: " + str(i2c_ch) + ", address: " + str(i2c_addr) + ".Check your connection....")
@@ -184,9 +327,56 @@ class LMK61E2:
             _logger.error(e)
             return -1
 
-        time.sleep(0.01)
+        self.PACER.after_write(i2c_ch, self.TIMING, paramInfo.addrs)
         return 0
 
+    def batch(self, devNum):
+        """
+        Collect the field writes to a device and send them together when the block exits, see RegisterBatch.
+            with dev.batch(0) as b:
+                dev.NDIV(0, 1)
+                b.write("PLL_NUM", 0)
+        :param devNum: Device number
+        :return: RegisterBatch context manager
+        """
+        return RegisterBatch(self, devNum)
+
+    def write_batch(self, batch):
+        """
+        Send the writes collected by a batch, one block write per contiguous run of registers.
+        :param batch: RegisterBatch
+        :return: <0 on failure, 0 on success
+        """
+        devNum = batch.devNum
+        if not self.ADDRESS_INFO:
+            _logger.error("No Devices registered. Aborting...")
+            return -1
+
+        i2c_addr = self.ADDRESS_INFO[devNum]['addr']
+        i2c_ch = self.ADDRESS_INFO[devNum]['ch']
+        read, write = cached_block_access(self._shadows.get(devNum), i2c_addr)
+        return write_batch(self, batch, i2c_ch, lambda: self.I2C_POOL.acquire(i2c_ch), read, write)
+
+    @instrumented("apply", "*")
+    def apply_config(self, devNum, config):
+        """
+        Bring a device to a target configuration, writing only the registers whose content has to change. Each of
+        them is written once, in contiguous block writes. The current content comes from the register cache when
+        it has it, otherwise from block reads of the registers concerned.
+        Self-clearing fields start an action, they are not a state and can't be part of a configuration.
+        :param devNum: Device number
+        :param config: Dictionary of field name to value
+        :return: Number of registers written, <0 on failure
+        """
+        if not self.ADDRESS_INFO:
+            _logger.error("No Devices registered. Aborting...")
+            return -1
+
+        i2c_addr = self.ADDRESS_INFO[devNum]['addr']
+        i2c_ch = self.ADDRESS_INFO[devNum]['ch']
+        read, write = cached_block_access(self._shadows.get(devNum), i2c_addr)
+        return apply_config(self, devNum, config, i2c_ch, lambda: self.I2C_POOL.acquire(i2c_ch), read, write)
+
     """
     Converts an integer to a list of byte-size shorts.
     Ex:    idx          0     1     2
@@ -211,18 +401,210 @@ class LMK61E2:
     """ Here are all the formatting exceptions for registers.
         Example: XO_CAPCTRL orders its bits in reverse register order compared to others """
     def register_exceptions(self, paramInfo, value):
-        if paramInfo['addr'] == 16:
+        if paramInfo.addr == 16:
             _logger.debug("Applying exception register format to register XO_CAPCTRL")
             tmp = value & 0x30
             value <<= 2
-            value &= paramInfo['mask']
+            value &= paramInfo.mask
             value += (tmp >> 8)
         return value
 
 
+    def cache_enable(self, devNum, enable=True):
+        """
+        Keep a copy of the registers of a device in RAM. After the first access, reads are served from the copy
+        and writes don't need to read the register back first. Registers holding a field of VOLATILE_PARAMS always
+        go to the device.
+        :param devNum: Device number
+        :param enable: True to enable the cache, False to drop it
+        :return: None
+        """
+        enable_cache(self, devNum, enable)
+
+    def invalidate(self, devNum=None):
+        """
+        Forget the cached registers, they will be read from the device on next access.
+        :param devNum: Device number, all devices if None
+        :return: None
+        """
+        invalidate_cache(self, devNum)
+
+    def refresh(self, devNum):
+        """
+        Read again from the device all the registers currently in the cache.
+        :param devNum: Device number
+        :return: <0 on failure, 0 on success
+        """
+        return refresh_cache(self, devNum)
+
+    def plan_frequency(self, fOut):
+        """
+        :param fOut: Target output frequency in Hz
+        :return: FrequencyPlan, None if the frequency can't be reached. See solve_frequency()
+        """
+        return solve_frequency(fOut)
+
+    def set_frequency(self, devNum, fOut, tolerance=1.0):
+        """
+        Program the output frequency of a device. The dividers come from solve_frequency() (cached per frequency),
+        all the PLL registers are written in one batch, then SWR2PLL restarts the PLL with them.
+            board.LMK61E2.set_frequency(0, 156.25e6)
+        :param devNum: Device number
+        :param fOut: Target output frequency in Hz
+        :param tolerance: Largest accepted frequency error in Hz, for fractional solutions
+        :return: FrequencyPlan programmed, -1 on failure
+        """
+        plan = solve_frequency(fOut)
+        if plan is None:
+            _logger.error("No divider setting reaches " + str(fOut) + " Hz (VCO between " + str(VCO_MIN) + " and " + str(VCO_MAX) + " Hz)")
+            return -1
+        if plan.error > tolerance:
+            _logger.error("Closest frequency to " + str(fOut) + " Hz is " + str(plan.fOut) + " Hz, off by more than " + str(tolerance) + " Hz")
+            return -1
+
+        _logger.debug("Frequency plan for " + str(fOut) + " Hz: " + str(plan))
+        if not self.ADDRESS_INFO:
+            _logger.error("No Devices registered. Aborting...")
+            return -1
+        try:
+            with self.batch(devNum) as b:
+                for paramName, value in plan.config().items():
+                    if b.write(paramName, value) != 0:
+                        raise ValueError("Could not program " + paramName + " = " + str(value))
+        except ValueError as e:
+            _logger.error(e)
+            return -1
+        if b.result != 0:
+            return -1
+
+        if self.write_param(devNum, "SWR2PLL", 1) != 0:
+            return -1
+        return plan
+
+    def write_sram(self, devNum, image, start=0):
+        """
+        Stream bytes into the SRAM of the device. MEMADR is set once and increments on every RAMDAT access, so each
+        byte is one register write, without reading anything back. RAMDAT is a single register (the I2C register
+        pointer would move past it), so a block write can't carry more than one byte of SRAM.
+        :param devNum: Device number
+        :param image: Bytes to write
+        :param start: SRAM address of the first byte
+        :return: <0 on failure, 0 on success
+        """
+        return write_sram(self, devNum, self.REGISTERS["MEMADR"], self.REGISTERS["RAMDAT"], image, start)
+
+    def read_sram(self, devNum, length, start=0):
+        """
+        Read bytes from the SRAM of the device, see write_sram().
+        :param devNum: Device number
+        :param length: Number of bytes
+        :param start: SRAM address of the first byte
+        :return: List of bytes, -1 on failure
+        """
+        return read_sram(self, devNum, self.REGISTERS["MEMADR"], self.REGISTERS["RAMDAT"], length, start)
+
+    def program_nvm(self, devNum, image=None, timeout=NVM_TIMEOUT, expectedCrc=None):
+        """
+        Program the EEPROM of the device from its SRAM:
+            board.LMK61E2.program_nvm(0)                 # the current register settings
+            board.LMK61E2.program_nvm(0, image)          # an SRAM image (ex: from the TI configuration tool)
+        The EEPROM is unlocked only for the programming. NVMBUSY is polled with a growing interval (see
+        devices.polling) instead of sleeping for the worst case.
+        :param devNum: Device number
+        :param image: SRAM image (bytes) to program, None to commit the current registers to SRAM first (REGCOMMIT)
+        :param timeout: Longest programming time in seconds
+        :param expectedCrc: If given, NVMSCRC must match it once programmed
+        :return: <0 on failure, 0 on success
+        """
+        count = self.read_param(devNum, "NVMCNT")
+        if count < 0:
+            return -1
+
+        if image is None:
+            if self.write_param(devNum, "REGCOMMIT", 1) != 0:
+                return -1
+        elif self.write_sram(devNum, image) != 0:
+            return -1
+
+        if self.write_param(devNum, "NVMUNLK", self.NVM_UNLOCK_KEY) != 0:
+            return -1
+        try:
+            ''' Erase and program in one write '''
+            with self.batch(devNum) as b:
+                b.write("NVMERASE", 1)
+                b.write("PROG", 1)
+            if b.result != 0:
+                return -1
+            if poll(lambda: self.read_param(devNum, "NVMBUSY"), lambda busy: busy == 0, timeout, what="NVMBUSY") < 0:
+                return -1
+        finally:
+            self.write_param(devNum, "NVMUNLK", 0)
+
+        if self.read_param(devNum, "NVMCRCERR") != 0:
+            _logger.error("EEPROM CRC error after programming device " + str(devNum))
+            return -1
+        newCount = self.read_param(devNum, "NVMCNT")
+        if newCount != min(count + 1, 255):
+            _logger.error("EEPROM program count went from " + str(count) + " to " + str(newCount) + ", programming didn't happen")
+            return -1
+        crc = self.read_param(devNum, "NVMSCRC")
+        if (expectedCrc is not None) and (crc != expectedCrc):
+            _logger.error("EEPROM CRC is " + hex(crc) + ", expecting " + hex(expectedCrc))
+            return -1
+
+        _logger.info("Programmed EEPROM of device " + str(devNum) + " (CRC: " + hex(crc) + ", count: " + str(newCount) + ")")
+        return 0
+
+    def wait_for_lock(self, devNum, timeout=None, pin=None, params=None):
+        """
+        Wait until the PLL is locked and measure how long it took:
+            board.LMK61E2.set_frequency(...)
+            lockTime = board.LMK61E2.wait_for_lock(0, timeout=0.5)
+        If the device has a status pin wired to a GPIO and programmed to show the lock (LOCK_PIN, or pin), the wait
+        sleeps on the GPIO edge. Otherwise the lock fields (LOCK_PARAMS) are read with a growing interval, see
+        devices.polling.
+        :param devNum: Device number
+        :param timeout: Longest wait in seconds, LOCK_TIMEOUT if None
+        :param pin: Name of the GPIO_PINS pin showing the lock, LOCK_PIN if None
+        :param params: Dictionary of field name to value when locked, LOCK_PARAMS if None
+        :return: Lock time in seconds, -1 on failure or timeout
+        """
+        timeout = timeout if timeout is not None else self.LOCK_TIMEOUT
+        pin = pin if pin is not None else self.LOCK_PIN
+        params = params if params is not None else self.LOCK_PARAMS
+        return wait_for_lock(self, devNum, timeout, pin, params)
+
+    def aread(self, devNum, paramName):
+        """
+        Awaitable read, run on the worker of the bus of the device (see devices.busExecutor), so that one event loop
+        can drive many devices at once:
+            value = await board.LMK61E2.aread(0, "LOL")
+        :return: asyncio Future of the value, -1 on failure
+        """
+        return call_async(self, devNum, run_command, self, paramName, devNum)
+
+    def awrite(self, devNum, paramName, value):
+        """
+        Awaitable write, see aread().
+        :return: asyncio Future of the result, <0 on failure, 0 on success
+        """
+        return call_async(self, devNum, run_command, self, paramName, devNum, value)
+
+    def aselftest(self, devNum):
+        """
+        Awaitable selftest, see aread().
+        :return: asyncio Future of the result of selftest()
+        """
+        return call_async(self, devNum, self.selftest, devNum)
+
     def selftest(self, devNum):
         i2c_addr = self.ADDRESS_INFO[devNum]['addr']
         i2c_ch = self.ADDRESS_INFO[devNum]['ch']
+        ''' The ID has to come from the device, not from the register cache '''
+        idInfo = self.REGISTERS["VNDRID"]
+        shadow = self._shadows.get(devNum)
+        if shadow is not None:
+            shadow.invalidate(idInfo.addr, idInfo.regs)
         val = self.read_param(devNum, "VNDRID")
 
         if (val != 0x100B):
@@ -232,6 +614,42 @@ class LMK61E2:
 
         return 0
 
+    @instrumented("snapshot", "*")
+    def snapshot(self, devNum):
+        """
+        Read the whole register map of the device in as few I2C block reads as possible (see BURST_RANGES) and
+        decode every field from the image in memory.
+        :param devNum: Device number
+        :return: Dictionary of field name to value, -1 on failure
+        """
+        if not self.ADDRESS_INFO:
+            _logger.error("No Devices registered. Aborting...")
+            return -1
+
+        i2c_addr = self.ADDRESS_INFO[devNum]['addr']
+        i2c_ch = self.ADDRESS_INFO[devNum]['ch']
+        shadow = self._shadows.get(devNum)
+
+        image = bytearray(self.IMAGE_SIZE)
+        try:
+            with self.I2C_POOL.acquire(i2c_ch) as bus:
+                self.PACER.wait(i2c_ch)
+                for start, length in self.BURST_RANGES:
+                    data = bus.read_i2c_block_data(i2c_addr, start, length)
+                    image[start:start + length] = bytes(data)
+                    if shadow is not None:
+                        shadow.load(start, data)
+        except FileNotFoundError as e:
+            _logger.error(e)
+            _logger.error("Could not find i2c bus at channel: " + str(i2c_ch) + ", address: " + str(i2c_addr) + ". Check your connection....")
+            return -1
+        except Exception as e:
+            _logger.error("Could not set message to device. Check connection...")
+            _logger.error(e)
+            return -1
+
+        return decode_fields(self.REGISTERS, image, self.register_exceptions)
+
     def readout_all_registers(self, devNum):
         i2c_addr = self.ADDRESS_INFO[devNum]['addr']
         i2c_ch = self.ADDRESS_INFO[devNum]['ch']
@@ -239,9 +657,12 @@ class LMK61E2:
         _logger.info("==== Device report ====")
         _logger.info("Device Name: " + str(self.DEVICE_NAME))
         _logger.info("I2C channel: " + str(i2c_ch) + " I2C address: " + str(i2c_addr))
-        for key in self.REGISTERS_INFO:
-            val = self.read_param(devNum, key)
+        values = self.snapshot(devNum)
+        if values == -1:
+            return -1
+        for key, val in values.items():
             _logger.info('Param Name: {ParamName: <20}, Param Value: {Value: <16}'.format(ParamName=key, Value=val))
+        return values
 
     def gpio_set(self, devNum, name, value):
         if not self.GPIO_PINS:
@@ -250,7 +671,7 @@ class LMK61E2:
 
         if name in self.GPIO_PINS[devNum]:
             pin = self.GPIO_PINS[devNum][name]
-            g = GPIO(pin, "out")
+            g = open_gpio(pin, "out")
             g.write(value)
             g.close()
         else:
@@ -1,7 +1,13 @@
 import time
-import smbus
 import logging
-from periphery import GPIO
+from devices.transport import open_gpio
+from devices.busPool import I2C_POOL
+from devices.pacing import PACER, TimingPolicy
+from devices.busExecutor import EXECUTOR, call_async, run_command
+from devices.instrumentation import INSTRUMENTS, instrumented
+from devices.registerImage import image_size, address_ranges, decode_fields
+from devices.registerBatch import RegisterBatch, apply_config, write_batch
+from devices.registerDescriptor import compile_registers, READ_ONLY
 
 _logger = logging.getLogger(__name__)
 
@@ -11,6 +17,9 @@ class TCA9539:
         The TCA9539 is a write-read device that communicates via I2C.
 
         User Notes: - pus CONFIGURATIONPORT0/1 to 0x0
+                    - Pins can be driven by name with set_pins() and get_pins(). Names come from PINS, set by the
+                      platform from the "PINS" entry of the layout (one {name: pin} dictionary per device, pins 0-7
+                      on port 0 and 8-15 on port 1). P00-P07 and P10-P17 always work
     """
 
     DEVICE_NAME = "TCA9539"
@@ -30,10 +39,31 @@ class TCA9539:
 
     ADDRESS_INFO = []
     GPIO_PINS = []
+    PINS = []
+
+    I2C_POOL = I2C_POOL
+
+    ''' Register table compiled once, used by the read and write paths '''
+    REGISTERS = compile_registers(REGISTERS_INFO)
+
+    TIMING = TimingPolicy()
+    PACER = PACER
+    EXECUTOR = EXECUTOR
+    INSTRUMENTS = INSTRUMENTS
+
+    ''' Register ranges for burst reads of the whole map. The command byte only auto-increments within a port pair '''
+    BURST_RANGES = address_ranges(REGISTERS_INFO, maxLen=2)
+    IMAGE_SIZE = image_size(REGISTERS_INFO)
+
+    ''' First register of each port pair, for the pin API '''
+    PORT_PAIRS = {"input": 0, "output": 2, "polarity": 4, "config": 6}
+    DEFAULT_PIN_NAMES = dict([("P0" + str(i), i) for i in range(8)] + [("P1" + str(i), 8 + i) for i in range(8)])
 
     def __init__(self, i2c_ch=None, i2c_addr=None, name="TCA9539", cmdClass=None):
         self.__dict__ = {}
         self._name = name
+        self._batches = {}
+        self._ports = {}
         if i2c_ch and i2c_addr:
             self.ADDRESS_INFO.append({'ch': i2c_ch, 'addr': i2c_addr})
             _logger.debug("Instantiated TCA9539 device with ch: " + str(i2c_ch) + " and addr: " + str(i2c_addr))
@@ -63,17 +93,13 @@ class TCA9539:
 
 
     # Read temperature registers and calculate Celsius
+    @instrumented("read")
     def read_param(self, devNum, paramName):
-        if not (paramName in self.REGISTERS_INFO):
+        paramInfo = self.REGISTERS.get(paramName)
+        if paramInfo is None:
             _logger.error( str(paramName) + " is an invalid parameter name")
             return -1
 
-        if paramName in self.REGISTERS_INFO:
-            paramInfo = self.REGISTERS_INFO[paramName]
-        else:
-            _logger.error("{paramName} is an unknown parameter.".format(paramName=paramName))
-            return -1
-
         if not self.ADDRESS_INFO:
             _logger.error("No Devices registered. Aborting...")
             return -1
@@ -82,9 +108,9 @@ class TCA9539:
         i2c_ch = self.ADDRESS_INFO[devNum]['ch']
 
         try:
-            bus = smbus.SMBus(i2c_ch)
-            retVal = bus.read_i2c_block_data(i2c_addr, paramInfo["addr"], paramInfo["regs"])
-            bus.close()
+            with self.I2C_POOL.acquire(i2c_ch) as bus:
+                self.PACER.wait(i2c_ch)
+                retVal = bus.read_i2c_block_data(i2c_addr, paramInfo.addr, paramInfo.regs)
         except FileNotFoundError as e:
             _logger.error(e)
             _logger.error("Could not find i2c bus at channel: " + str(i2c_ch) + ", address: " + str(
@@ -98,27 +124,20 @@ class TCA9539:
         val = int.from_bytes(retVal, byteorder='big', signed=False)
 
         ''' Data formating from the register '''
-        val &= paramInfo['mask']
-        val >>= paramInfo['loc']
+        val &= paramInfo.mask
+        val >>= paramInfo.loc
         val = self.register_exceptions(paramInfo, val)
 
-        time.sleep(0.01)
+        self.PACER.after_read(i2c_ch, self.TIMING)
         return val
 
+    @instrumented("write")
     def write_param(self, devNum, paramName, value):
-        if not (paramName in self.REGISTERS_INFO):
+        paramInfo = self.REGISTERS.get(paramName)
+        if paramInfo is None:
             _logger.error(str(paramName) + " is an invalid parameter name")
             return -1
 
-        if paramName in self.REGISTERS_INFO:
-            paramInfo = self.REGISTERS_INFO[paramName]
-        elif paramName in self.GPIO_PINS[devNum]:
-            self.gpio_set(devNum=devNum, name=paramName, value=value)
-            return 0
-        else:
-            _logger.error("{paramName} is an unknown parameter or pin name.".format(paramName=paramName))
-            return -1
-
         if not self.ADDRESS_INFO:
             _logger.error("No Devices registered. Aborting...")
             return -1
@@ -126,41 +145,50 @@ class TCA9539:
         i2c_addr = self.ADDRESS_INFO[devNum]['addr']
         i2c_ch = self.ADDRESS_INFO[devNum]['ch']
 
-        if (0 == paramInfo["min"]) and (0 == paramInfo["max"]):
+        if paramInfo.access == READ_ONLY:
             _logger.error(str(paramName) + " is a read-only parameter")
             return -1
 
-        if (value < paramInfo["min"]) or (value > paramInfo["max"]):
+        if (value < paramInfo.min) or (value > paramInfo.max):
             _logger.error("{value} is an invalid value for {paramName}. " +
                           "Must be between {min} and {max}".format(value=value,
                                                                    paramName=paramName,
-                                                                   min=paramInfo["min"],
-                                                                   max=paramInfo["max"]))
+                                                                   min=paramInfo.min,
+                                                                   max=paramInfo.max))
             return -1
 
         ''' Data formating to put into the register '''
-        value <<= paramInfo["loc"]
-        value &= paramInfo["mask"]
+        value <<= paramInfo.loc
+        value &= paramInfo.mask
         value = self.register_exceptions(paramInfo, value)
 
+        ''' Inside a batch, the write is sent when the batch exits '''
+        batch = self._batches.get(devNum)
+        if batch is not None:
+            batch.add(paramInfo.addr, value, paramInfo.mask, paramInfo.regs)
+            return 0
+
+        self.invalidate_pins(devNum)
+
         try:
-            bus = smbus.SMBus(i2c_ch)
-
-            ''' Retrieve value in register '''
-            currVal = bus.read_i2c_block_data(i2c_addr, paramInfo["addr"], paramInfo["regs"])
-            _logger.debug("In register " + str(paramName) + " = " + str([hex(no) for no in currVal]))
-            currVal = int.from_bytes(currVal, byteorder='big')
-            ''' Clear all bits concerned with our parameter and keep the others we dont want to affect
-                Note this might cause problems if your python is not 64-bits and registers are >32bits '''
-            currVal_cleared = currVal & (~paramInfo["mask"])
-            ''' Write new value for the parameter '''
-            newVal = value + currVal_cleared
-            ''' Package as a byte-list '''
-            writeBuf = self.int_to_short_list(newVal, fixed_length=paramInfo["regs"])
-
-            _logger.debug("To register " + str(paramName) + " = " + str([hex(no) for no in writeBuf]))
-            bus.write_i2c_block_data(i2c_addr, paramInfo["addr"], writeBuf)
-            bus.close()
+            with self.I2C_POOL.acquire(i2c_ch) as bus:
+                self.PACER.wait(i2c_ch)
+                ''' Retrieve value in register '''
+                currVal = bus.read_i2c_block_data(i2c_addr, paramInfo.addr, paramInfo.regs)
+                if _logger.isEnabledFor(logging.DEBUG):
+                    _logger.debug("In register " + str(paramName) + " = " + str([hex(no) for no in currVal]))
+                currVal = int.from_bytes(currVal, byteorder='big')
+                ''' Clear all bits concerned with our parameter and keep the others we dont want to affect
+                    Note this might cause problems if your python is not 64-bits and registers are >32bits '''
+                currVal_cleared = currVal & paramInfo.invMask
+                ''' Write new value for the parameter '''
+                newVal = value + currVal_cleared
+                ''' Package as a byte-list '''
+                writeBuf = self.int_to_short_list(newVal, fixed_length=paramInfo.regs)
+
+                if _logger.isEnabledFor(logging.DEBUG):
+                    _logger.debug("To register " + str(paramName) + " = " + str([hex(no) for no in writeBuf]))
+                bus.write_i2c_block_data(i2c_addr, paramInfo.addr, writeBuf)
         except FileNotFoundError as e:
             _logger.error(e)
             _logger.error("Could not find i2c bus at channel: " + str(i2c_ch) + ", address: " + str(
@@ -171,9 +199,250 @@ class TCA9539:
             _logger.error(e)
             return -1
 
-        time.sleep(0.01)
+        self.PACER.after_write(i2c_ch, self.TIMING, paramInfo.addrs)
+        return 0
+
+    def batch(self, devNum):
+        """
+        Collect the field writes to a device and send them together when the block exits, see RegisterBatch.
+            with dev.batch(0) as b:
+                dev.OUTPUTPORT0(0, 1)
+                b.write("OUTPUTPORT1", 0)
+        :param devNum: Device number
+        :return: RegisterBatch context manager
+        """
+        return RegisterBatch(self, devNum)
+
+    def write_batch(self, batch):
+        """
+        Send the writes collected by a batch, one block write per port pair.
+        :param batch: RegisterBatch
+        :return: <0 on failure, 0 on success
+        """
+        devNum = batch.devNum
+        if not self.ADDRESS_INFO:
+            _logger.error("No Devices registered. Aborting...")
+            return -1
+
+        i2c_addr = self.ADDRESS_INFO[devNum]['addr']
+        i2c_ch = self.ADDRESS_INFO[devNum]['ch']
+        self.invalidate_pins(devNum)
+
+        ''' The command byte only auto-increments inside a port pair '''
+        return write_batch(self, batch, i2c_ch, lambda: self.I2C_POOL.acquire(i2c_ch),
+                           lambda bus, start, length: bus.read_i2c_block_data(i2c_addr, start, length),
+                           lambda bus, start, data: bus.write_i2c_block_data(i2c_addr, start, data),
+                           maxLen=2, align=2)
+
+    @instrumented("apply", "*")
+    def apply_config(self, devNum, config):
+        """
+        Bring a device to a target configuration, writing only the registers whose content has to change. Each of
+        them is written once, in contiguous block writes, after a block read of the registers concerned.
+        Self-clearing fields start an action, they are not a state and can't be part of a configuration.
+        :param devNum: Device number
+        :param config: Dictionary of field name to value
+        :return: Number of registers written, <0 on failure
+        """
+        if not self.ADDRESS_INFO:
+            _logger.error("No Devices registered. Aborting...")
+            return -1
+
+        i2c_addr = self.ADDRESS_INFO[devNum]['addr']
+        i2c_ch = self.ADDRESS_INFO[devNum]['ch']
+        self.invalidate_pins(devNum)
+
+        ''' Registers go in pairs (port 0, port 1), a block transfer doesn't cross a pair '''
+        return apply_config(self, devNum, config, i2c_ch, lambda: self.I2C_POOL.acquire(i2c_ch),
+                            lambda bus, start, length: bus.read_i2c_block_data(i2c_addr, start, length),
+                            lambda bus, start, data: bus.write_i2c_block_data(i2c_addr, start, data),
+                            maxLen=2, align=2)
+
+    def pin_number(self, devNum, name):
+        """
+        :param devNum: Device number
+        :param name: Pin name, from PINS or P00-P17
+        :return: Pin number, 0-15, None if the name is unknown
+        """
+        if self.PINS and devNum < len(self.PINS) and name in self.PINS[devNum]:
+            return self.PINS[devNum][name]
+        return self.DEFAULT_PIN_NAMES.get(name)
+
+    def pin_names(self, devNum):
+        if self.PINS and devNum < len(self.PINS):
+            return dict(self.PINS[devNum])
+        return dict(self.DEFAULT_PIN_NAMES)
+
+    def _port_images(self, devNum, bus):
+        """
+        Cached content of the output, polarity and configuration port pairs, read once (one 2-byte read each).
+        """
+        images = self._ports.get(devNum)
+        if images is None:
+            i2c_addr = self.ADDRESS_INFO[devNum]['addr']
+            images = {}
+            for kind in ("output", "polarity", "config"):
+                images[kind] = list(bus.read_i2c_block_data(i2c_addr, self.PORT_PAIRS[kind], 2))
+            self._ports[devNum] = images
+        return images
+
+    def invalidate_pins(self, devNum=None):
+        """
+        Forget the cached port images (all devices if devNum is None), they are read again on next use.
+        Writes through write_param(), batches and apply_config() do it themselves.
+        """
+        if devNum is None:
+            self._ports = {}
+        else:
+            self._ports.pop(devNum, None)
+
+    def _pin_masks(self, devNum, pins):
+        """
+        Convert {name: value} to a 16-bit mask of the pins and a 16-bit value.
+        :return: (mask, bits), None if a name is unknown
+        """
+        mask = 0
+        bits = 0
+        for name, value in pins.items():
+            pin = self.pin_number(devNum, name)
+            if pin is None:
+                _logger.error("Could not find pin named " + str(name) + ". Aborting...")
+                return None
+            mask |= 1 << pin
+            if value:
+                bits |= 1 << pin
+        return mask, bits
+
+    def _update_pairs(self, devNum, updates):
+        """
+        Apply pin changes to cached port pairs and write the pairs that change, each in one 2-byte write.
+        :param updates: List of (kind, mask, bits), in the order to write them
+        :return: <0 on failure, 0 on success
+        """
+        if not self.ADDRESS_INFO:
+            _logger.error("No Devices registered. Aborting...")
+            return -1
+
+        i2c_addr = self.ADDRESS_INFO[devNum]['addr']
+        i2c_ch = self.ADDRESS_INFO[devNum]['ch']
+        written = []
+
+        try:
+            with self.I2C_POOL.acquire(i2c_ch) as bus:
+                self.PACER.wait(i2c_ch)
+                images = self._port_images(devNum, bus)
+                for kind, mask, bits in updates:
+                    current = images[kind][0] | (images[kind][1] << 8)
+                    new = (current & ~mask) | (bits & mask)
+                    if new == current:
+                        continue
+                    writeBuf = [new & 0xFF, (new >> 8) & 0xFF]
+                    if _logger.isEnabledFor(logging.DEBUG):
+                        _logger.debug("To " + kind + " ports = " + str([hex(no) for no in writeBuf]))
+                    bus.write_i2c_block_data(i2c_addr, self.PORT_PAIRS[kind], writeBuf)
+                    images[kind] = writeBuf
+                    written += [self.PORT_PAIRS[kind], self.PORT_PAIRS[kind] + 1]
+        except FileNotFoundError as e:
+            self.invalidate_pins(devNum)
+            _logger.error(e)
+            _logger.error("Could not find i2c bus at channel: " + str(i2c_ch) + ", address: " + str(i2c_addr) + ". Check your connection....")
+            return -1
+        except Exception as e:
+            self.invalidate_pins(devNum)
+            _logger.error("Could not set message to device. Check connection...")
+            _logger.error(e)
+            return -1
+
+        if written:
+            self.PACER.after_write(i2c_ch, self.TIMING, written)
         return 0
 
+    def set_pins(self, devNum, pins, direction=True):
+        """
+        Drive output pins by name. Both output ports are written in a single transaction, from the cached output
+        state, so nothing is read back (except the first time).
+            board.TCA9539.set_pins(0, {"LED_RED": 1, "PWR_EN": 0})
+        :param devNum: Device number
+        :param pins: Dictionary of pin name to level
+        :param direction: If True, the pins are also made outputs (after their level is set, so they don't glitch)
+        :return: <0 on failure, 0 on success
+        """
+        masks = self._pin_masks(devNum, pins)
+        if masks is None:
+            return -1
+        mask, bits = masks
+        updates = [("output", mask, bits)]
+        if direction:
+            updates.append(("config", mask, 0))
+        return self._update_pairs(devNum, updates)
+
+    def set_directions(self, devNum, pins):
+        """
+        :param devNum: Device number
+        :param pins: Dictionary of pin name to "in" or "out"
+        :return: <0 on failure, 0 on success
+        """
+        for name, direction in pins.items():
+            if direction not in ("in", "out"):
+                _logger.error(str(direction) + " is an invalid direction for pin " + str(name) + ". Must be in or out")
+                return -1
+        masks = self._pin_masks(devNum, dict((name, d == "in") for name, d in pins.items()))
+        if masks is None:
+            return -1
+        return self._update_pairs(devNum, [("config", masks[0], masks[1])])
+
+    def set_polarity(self, devNum, pins):
+        """
+        :param devNum: Device number
+        :param pins: Dictionary of pin name to True to invert the input level, False otherwise
+        :return: <0 on failure, 0 on success
+        """
+        masks = self._pin_masks(devNum, pins)
+        if masks is None:
+            return -1
+        return self._update_pairs(devNum, [("polarity", masks[0], masks[1])])
+
+    def get_pins(self, devNum, names=None):
+        """
+        Read the level of pins by name. Both input ports are read in a single transaction.
+        :param devNum: Device number
+        :param names: Pin names, all the named pins of the device if None
+        :return: Dictionary of pin name to level (0 or 1), -1 on failure
+        """
+        if not self.ADDRESS_INFO:
+            _logger.error("No Devices registered. Aborting...")
+            return -1
+
+        if names is None:
+            names = self.pin_names(devNum)
+        pins = {}
+        for name in names:
+            pin = self.pin_number(devNum, name)
+            if pin is None:
+                _logger.error("Could not find pin named " + str(name) + ". Aborting...")
+                return -1
+            pins[name] = pin
+
+        i2c_addr = self.ADDRESS_INFO[devNum]['addr']
+        i2c_ch = self.ADDRESS_INFO[devNum]['ch']
+
+        try:
+            with self.I2C_POOL.acquire(i2c_ch) as bus:
+                self.PACER.wait(i2c_ch)
+                data = bus.read_i2c_block_data(i2c_addr, self.PORT_PAIRS["input"], 2)
+        except FileNotFoundError as e:
+            _logger.error(e)
+            _logger.error("Could not find i2c bus at channel: " + str(i2c_ch) + ", address: " + str(i2c_addr) + ". Check your connection....")
+            return -1
+        except Exception as e:
+            _logger.error("Could not set message to device. Check connection...")
+            _logger.error(e)
+            return -1
+
+        self.PACER.after_read(i2c_ch, self.TIMING)
+        levels = data[0] | (data[1] << 8)
+        return dict((name, (levels >> pin) & 1) for name, pin in pins.items())
+
     """
     Converts an integer to a list of byte-size shorts.
     Ex:    idx          0     1     2
@@ -200,6 +469,29 @@ class TCA9539:
     def register_exceptions(self, paramInfo, value):
         return value
 
+    def aread(self, devNum, paramName):
+        """
+        Awaitable read, run on the worker of the bus of the device (see devices.busExecutor), so that one event loop
+        can drive many devices at once:
+            value = await board.TCA9539.aread(0, "INPUTPORT0")
+        :return: asyncio Future of the value, -1 on failure
+        """
+        return call_async(self, devNum, run_command, self, paramName, devNum)
+
+    def awrite(self, devNum, paramName, value):
+        """
+        Awaitable write, see aread().
+        :return: asyncio Future of the result, <0 on failure, 0 on success
+        """
+        return call_async(self, devNum, run_command, self, paramName, devNum, value)
+
+    def aselftest(self, devNum):
+        """
+        Awaitable selftest, see aread().
+        :return: asyncio Future of the result of selftest()
+        """
+        return call_async(self, devNum, self.selftest, devNum)
+
     def selftest(self, devNum):
         i2c_addr = self.ADDRESS_INFO[devNum]['addr']
         i2c_ch = self.ADDRESS_INFO[devNum]['ch']
@@ -213,15 +505,50 @@ class TCA9539:
 
         return 0
 
+    @instrumented("snapshot", "*")
+    def snapshot(self, devNum):
+        """
+        Read the whole register map of the device in as few I2C block reads as possible (see BURST_RANGES) and
+        decode every field from the image in memory.
+        :param devNum: Device number
+        :return: Dictionary of field name to value, -1 on failure
+        """
+        if not self.ADDRESS_INFO:
+            _logger.error("No Devices registered. Aborting...")
+            return -1
+
+        i2c_addr = self.ADDRESS_INFO[devNum]['addr']
+        i2c_ch = self.ADDRESS_INFO[devNum]['ch']
+
+        image = bytearray(self.IMAGE_SIZE)
+        try:
+            with self.I2C_POOL.acquire(i2c_ch) as bus:
+                self.PACER.wait(i2c_ch)
+                for start, length in self.BURST_RANGES:
+                    image[start:start + length] = bytes(bus.read_i2c_block_data(i2c_addr, start, length))
+        except FileNotFoundError as e:
+            _logger.error(e)
+            _logger.error("Could not find i2c bus at channel: " + str(i2c_ch) + ", address: " + str(i2c_addr) + ". Check your connection....")
+            return -1
+        except Exception as e:
+            _logger.error("Could not set message to device. Check connection...")
+            _logger.error(e)
+            return -1
+
+        return decode_fields(self.REGISTERS, image, self.register_exceptions)
+
     def readout_all_registers(self, devNum):
         i2c_addr = self.ADDRESS_INFO[devNum]['addr']
         i2c_ch = self.ADDRESS_INFO[devNum]['ch']
         _logger.info("==== Device report ====")
         _logger.info("Device Name: " + str(self.DEVICE_NAME))
         _logger.info("I2C channel: " + str(i2c_ch) + " I2C address: " + str(i2c_addr))
-        for key in self.REGISTERS_INFO:
-            val = self.read_param(i2c_ch, i2c_addr, key)
+        values = self.snapshot(devNum)
+        if values == -1:
+            return -1
+        for key, val in values.items():
             _logger.info('Param Name: {ParamName: <20}, Param Value: {Value: <16}'.format(ParamName=key, Value=val))
+        return values
 
     def gpio_set(self, devNum, name, value):
         if not self.GPIO_PINS:
@@ -230,7 +557,7 @@ class TCA9539:
 
         if name in self.GPIO_PINS[devNum]:
             pin = self.GPIO_PINS[devNum][name]
-            g = GPIO(pin, "out")
+            g = open_gpio(pin, "out")
             g.write(value)
             g.close()
         else:
@@ -1,7 +1,11 @@
 import time
-import smbus
 import logging
-from periphery import GPIO
+from devices.transport import open_gpio
+from devices.busPool import I2C_POOL
+from devices.pacing import PACER, TimingPolicy
+from devices.busExecutor import EXECUTOR, call_async, run_command
+from devices.instrumentation import INSTRUMENTS, instrumented
+from devices.registerDescriptor import compile_registers, READ_ONLY
 
 _logger = logging.getLogger(__name__)
 
@@ -25,7 +29,7 @@ class TMP1075:
         "F":   { "addr":  1, "loc": 11, "mask": 0x1800, "regs": 2, "min": 0, "max":     3},
         "R":   { "addr":  1, "loc": 13, "mask": 0x6000, "regs": 2, "min": 0, "max":     3},
         "OS":  { "addr":  1, "loc": 15, "mask": 0x8000, "regs": 2, "min": 0, "max":     1},
-        "L":   { "addr":  3, "loc":  4, "mask": 0xFFF0, "regs": 2, "min": 0, "max": 0xFFF},
+        "L":   { "addr":  2, "loc":  4, "mask": 0xFFF0, "regs": 2, "min": 0, "max": 0xFFF},
         "H":   { "addr":  3, "loc":  4, "mask": 0xFFF0, "regs": 2, "min": 0, "max": 0xFFF},
         "DID": { "addr": 15, "loc":  0, "mask": 0xFFFF, "regs": 2, "min": 0, "max":     0},
 }
@@ -33,6 +37,19 @@ class TMP1075:
     ADDRESS_INFO = []
     GPIO_PINS = []
 
+    I2C_POOL = I2C_POOL
+
+    ''' Register table compiled once, used by the read and write paths '''
+    REGISTERS = compile_registers(REGISTERS_INFO)
+
+    TIMING = TimingPolicy()
+    PACER = PACER
+
+    ''' Conversion period in seconds for each value of R '''
+    CONVERSION_PERIODS = {0: 0.0275, 1: 0.055, 2: 0.11, 3: 0.22}
+    EXECUTOR = EXECUTOR
+    INSTRUMENTS = INSTRUMENTS
+
     def __init__(self, i2c_ch=None, i2c_addr=None, name="TMP1075", cmdClass=None):
         self.__dict__ = {}
         self._name = name
@@ -64,17 +81,13 @@ class TMP1075:
 
 
     # Read temperature registers and calculate Celsius
+    @instrumented("read")
     def read_param(self, devNum, paramName):
-        if not (paramName in self.REGISTERS_INFO):
+        paramInfo = self.REGISTERS.get(paramName)
+        if paramInfo is None:
             _logger.error( str(paramName) + " is an invalid parameter name")
             return -1
 
-        if paramName in self.REGISTERS_INFO:
-            paramInfo = self.REGISTERS_INFO[paramName]
-        else:
-            _logger.error("{paramName} is an unknown parameter.".format(paramName=paramName))
-            return -1
-
         if not self.ADDRESS_INFO:
             _logger.error("No Devices registered. Aborting...")
             return -1
@@ -83,9 +96,9 @@ class TMP1075:
         i2c_ch = self.ADDRESS_INFO[devNum]['ch']
 
         try:
-            bus = smbus.SMBus(i2c_ch)
-            retVal = bus.read_i2c_block_data(i2c_addr, paramInfo["addr"], paramInfo["regs"])
-            bus.close()
+            with self.I2C_POOL.acquire(i2c_ch) as bus:
+                self.PACER.wait(i2c_ch)
+                retVal = bus.read_i2c_block_data(i2c_addr, paramInfo.addr, paramInfo.regs)
         except FileNotFoundError as e:
             _logger.error(e)
             _logger.error("Could not find i2c bus at channel: " + str(i2c_ch) + ", address: " + str(
@@ -99,27 +112,20 @@ class TMP1075:
         val = int.from_bytes(retVal, byteorder='big', signed=False)
 
         ''' Data formating from the register '''
-        val &= paramInfo['mask']
-        val >>= paramInfo['loc']
+        val &= paramInfo.mask
+        val >>= paramInfo.loc
         val = self.register_exceptions(paramInfo, val)
 
-        time.sleep(0.01)
+        self.PACER.after_read(i2c_ch, self.TIMING)
         return val
 
+    @instrumented("write")
     def write_param(self, devNum, paramName, value):
-        if not (paramName in self.REGISTERS_INFO):
+        paramInfo = self.REGISTERS.get(paramName)
+        if paramInfo is None:
             _logger.error(str(paramName) + " is an invalid parameter name")
             return -1
 
-        if paramName in self.REGISTERS_INFO:
-            paramInfo = self.REGISTERS_INFO[paramName]
-        elif paramName in self.GPIO_PINS[devNum]:
-            self.gpio_set(devNum=devNum, name=paramName, value=value)
-            return 0
-        else:
-            _logger.error("{paramName} is an unknown parameter or pin name.".format(paramName=paramName))
-            return -1
-
         if not self.ADDRESS_INFO:
             _logger.error("No Devices registered. Aborting...")
             return -1
@@ -127,41 +133,42 @@ class TMP1075:
         i2c_addr = self.ADDRESS_INFO[devNum]['addr']
         i2c_ch = self.ADDRESS_INFO[devNum]['ch']
 
-        if (0 == paramInfo["min"]) and (0 == paramInfo["max"]):
+        if paramInfo.access == READ_ONLY:
             _logger.error(str(paramName) + " is a read-only parameter")
             return -1
 
-        if (value < paramInfo["min"]) or (value > paramInfo["max"]):
+        if (value < paramInfo.min) or (value > paramInfo.max):
             _logger.error("{value} is an invalid value for {paramName}. " +
                           "Must be between {min} and {max}".format(value=value,
                                                                    paramName=paramName,
-                                                                   min=paramInfo["min"],
-                                                                   max=paramInfo["max"]))
+                                                                   min=paramInfo.min,
+                                                                   max=paramInfo.max))
             return -1
 
         ''' Data formating to put into the register '''
-        value <<= paramInfo["loc"]
-        value &= paramInfo["mask"]
+        value <<= paramInfo.loc
+        value &= paramInfo.mask
         value = self.register_exceptions(paramInfo, value)
 
         try:
-            bus = smbus.SMBus(i2c_ch)
-
-            ''' Retrieve value in register '''
-            currVal = bus.read_i2c_block_data(i2c_addr, paramInfo["addr"], paramInfo["regs"])
-            _logger.debug("In register " + str(paramName) + " = " + str([hex(no) for no in currVal]))
-            currVal = int.from_bytes(currVal, byteorder='big')
-            ''' Clear all bits concerned with our parameter and keep the others we dont want to affect
-                Note this might cause problems if your python is not 64-bits and registers are >32bits '''
-            currVal_cleared = currVal & (~paramInfo["mask"])
-            ''' Write new value for the parameter '''
-            newVal = value + currVal_cleared
-            ''' Package as a byte-list '''
-            writeBuf = self.int_to_short_list(newVal, fixed_length=paramInfo["regs"])
-
-            _logger.debug("To register " + str(paramName) + " = " + str([hex(no) for no in writeBuf]))
-            bus.write_i2c_block_data(i2c_addr, paramInfo["addr"], writeBuf)
-            bus.close()
+            with self.I2C_POOL.acquire(i2c_ch) as bus:
+                self.PACER.wait(i2c_ch)
+                ''' Retrieve value in register '''
+                currVal = bus.read_i2c_block_data(i2c_addr, paramInfo.addr, paramInfo.regs)
+                if _logger.isEnabledFor(logging.DEBUG):
+                    _logger.debug("In register " + str(paramName) + " = " + str([hex(no) for no in currVal]))
+                currVal = int.from_bytes(currVal, byteorder='big')
+                ''' Clear all bits concerned with our parameter and keep the others we dont want to affect
+                    Note this might cause problems if your python is not 64-bits and registers are >32bits '''
+                currVal_cleared = currVal & paramInfo.invMask
+                ''' Write new value for the parameter '''
+                newVal = value + currVal_cleared
+                ''' Package as a byte-list '''
+                writeBuf = self.int_to_short_list(newVal, fixed_length=paramInfo.regs)
+
+                if _logger.isEnabledFor(logging.DEBUG):
+                    _logger.debug("To register " + str(paramName) + " = " + str([hex(no) for no in writeBuf]))
+                bus.write_i2c_block_data(i2c_addr, paramInfo.addr, writeBuf)
         except FileNotFoundError as e:
             _logger.error(e)
             _logger.error("Could not find i2c bus at channel: " + str(i2c_ch) + ", address: " + str(
@@ -172,7 +179,7 @@ class TMP1075:
             _logger.error(e)
             return -1
 
-        time.sleep(0.01)
+        self.PACER.after_write(i2c_ch, self.TIMING, paramInfo.addrs)
         return 0
 
     """
@@ -201,6 +208,82 @@ class TMP1075:
     def register_exceptions(self, paramInfo, value):
         return value
 
+    @staticmethod
+    def to_celsius(raw):
+        """
+        Convert a 12-bit temperature (T, L or H, two's complement, 0.0625 C per LSB) to degrees C.
+        """
+        if raw & 0x800:
+            raw -= 0x1000
+        return raw * 0.0625
+
+    @staticmethod
+    def from_celsius(temp):
+        """
+        Convert degrees C to a 12-bit value for L or H.
+        """
+        raw = int(round(temp / 0.0625))
+        raw = max(-0x800, min(0x7FF, raw))
+        return raw & 0xFFF
+
+    def read_temperature(self, devNum):
+        """
+        :param devNum: Device number
+        :return: Temperature in degrees C, None on failure
+        """
+        raw = self.read_param(devNum, "T")
+        if raw < 0:
+            return None
+        return self.to_celsius(raw)
+
+    def sampler(self, period=1.0, capacity=4096, devNums=None, rate=None, thermostat=0, low=None, high=None):
+        """
+        Create a background sampler of the sensors, see devices.temperatureSampler.TemperatureSampler.
+            with board.TMP1075.sampler(period=0.5) as s:
+                ...
+                s.latest(0)
+        :param period: Time between two readings of all the sensors, in seconds
+        :param capacity: Number of readings kept
+        :param devNums: Sensors to read, all of them by default
+        :param rate: Conversion rate (R). By default, the slowest one that still converts within the period
+        :param thermostat: TM, 0 for comparator mode, 1 for interrupt mode of the ALERT pin
+        :param low: Low threshold (L) in degrees C, not changed if None
+        :param high: High threshold (H) in degrees C, not changed if None
+        :return: TemperatureSampler, not started. None if there are no sensors
+        """
+        from devices.temperatureSampler import TemperatureSampler
+        if not self.ADDRESS_INFO:
+            _logger.error("No Devices registered. Aborting...")
+            return None
+        if devNums is None:
+            devNums = range(len(self.ADDRESS_INFO))
+        if rate is None:
+            rate = max([r for r, p in self.CONVERSION_PERIODS.items() if p <= period], default=0)
+        return TemperatureSampler(self, devNums, period, capacity, rate, thermostat, low, high)
+
+    def aread(self, devNum, paramName):
+        """
+        Awaitable read, run on the worker of the bus of the device (see devices.busExecutor), so that one event loop
+        can drive many devices at once:
+            value = await board.TMP1075.aread(0, "T")
+        :return: asyncio Future of the value, -1 on failure
+        """
+        return call_async(self, devNum, run_command, self, paramName, devNum)
+
+    def awrite(self, devNum, paramName, value):
+        """
+        Awaitable write, see aread().
+        :return: asyncio Future of the result, <0 on failure, 0 on success
+        """
+        return call_async(self, devNum, run_command, self, paramName, devNum, value)
+
+    def aselftest(self, devNum):
+        """
+        Awaitable selftest, see aread().
+        :return: asyncio Future of the result of selftest()
+        """
+        return call_async(self, devNum, self.selftest, devNum)
+
     def selftest(self, devNum):
         i2c_addr = self.ADDRESS_INFO[devNum]['addr']
         i2c_ch = self.ADDRESS_INFO[devNum]['ch']
@@ -231,7 +314,7 @@ class TMP1075:
 
         if name in self.GPIO_PINS[devNum]:
             pin = self.GPIO_PINS[devNum][name]
-            g = GPIO(pin, "out")
+            g = open_gpio(pin, "out")
             g.write(value)
             g.close()
         else:
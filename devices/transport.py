@@ -0,0 +1,88 @@
+import ctypes
+import logging
+
+_logger = logging.getLogger(__name__)
+
+
+class Transport:
+    """
+        Opens the bus handles the drivers use. This one opens the real hardware, through smbus, periphery and the
+        shared libraries of the board.
+
+        User Notes:
+        - Drivers don't import smbus or periphery themselves, they go through the functions of this module, which
+          forward to the installed transport. Another transport, like devices.simulation.Simulation, can be
+          installed with set_transport() to run the drivers without a board
+        - smbus and periphery are only imported when a bus is first opened
+        - Handles already opened stay with the transport that opened them. Close the bus pools (or create the
+          platform) after changing the transport
+    """
+
+    def open_i2c(self, ch):
+        """
+        :param ch: I2C channel number
+        :return: Handle with the smbus.SMBus methods
+        """
+        import smbus
+        return smbus.SMBus(ch)
+
+    def open_spi(self, path, mode, maxSpeed, **kwargs):
+        """
+        :param path: SPI device path (ex: /dev/spidev2.0)
+        :param mode: SPI mode
+        :param maxSpeed: Clock frequency in Hz
+        :return: Handle with the periphery.SPI methods
+        """
+        from periphery import SPI
+        return SPI(path, mode, maxSpeed, **kwargs)
+
+    def open_gpio(self, pin, direction):
+        """
+        :param pin: GPIO line number
+        :param direction: "in", "out", ...
+        :return: Handle with the periphery.GPIO methods
+        """
+        from periphery import GPIO
+        return GPIO(pin, direction)
+
+    def load_library(self, name):
+        """
+        :param name: Name or path of the shared library
+        :return: ctypes library
+        """
+        return ctypes.CDLL(name)
+
+
+_transport = Transport()
+
+
+def get_transport():
+    return _transport
+
+
+def set_transport(transport):
+    """
+    Install the transport used by all the drivers.
+    :param transport: Transport instance, None to go back to the hardware
+    :return: Transport that was installed before
+    """
+    global _transport
+    previous = _transport
+    _transport = transport if transport is not None else Transport()
+    return previous
+
+
+def open_i2c(ch):
+    return _transport.open_i2c(ch)
+
+
+def open_spi(path, mode, maxSpeed, **kwargs):
+    return _transport.open_spi(path, mode, maxSpeed, **kwargs)
+
+
+def open_gpio(pin, direction):
+    return _transport.open_gpio(pin, direction)
+
+
+def load_library(name):
+    return _transport.load_library(name)
@@ -2,9 +2,15 @@ import json
 from pkg_resources import resource_filename
 import importlib
 import logging
+from devices.busPool import I2CBusPool, SPIBusPool
+from devices.busExecutor import BusExecutor
+from devices.selftest import run_selftests
 
 _logger = logging.getLogger(__name__)
 
+''' Time one device selftest may take before it is reported as TIMEOUT, in seconds '''
+SELFTEST_TIMEOUT = 2.0
+
 
 class BLIET():
 
@@ -16,6 +22,11 @@ class BLIET():
             self.layout = json.load(f)
 
         self._name = name
+        ''' Bus handles stay open for the life of the board, see close() '''
+        self.i2cPool = I2CBusPool()
+        self.spiPool = SPIBusPool()
+        ''' One worker per bus for the selftests and the awaitable device accesses (aread, awrite, ...) '''
+        self.executor = BusExecutor()
         self.from_dict_layout(self.layout)
         _logger.info(self.layout2Report(self.layout, name))
 
@@ -26,15 +37,19 @@ class BLIET():
                 devClass = self.class_for_name(moduleName, devName)
                 if attr['independent'] == False:
                     self.__dict__[devName] = devClass()
+                    self.attach_bus_pools(self.__dict__[devName])
                     if "ADDRESS_INFO" in attr:
                         self.__dict__[devName].ADDRESS_INFO = attr["ADDRESS_INFO"]
                     if "GPIO_PINS" in attr:
                         self.__dict__[devName].GPIO_PINS = attr["GPIO_PINS"]
+                    if "PINS" in attr:
+                        self.__dict__[devName].PINS = attr["PINS"]
                 else:
                     num = 0
                     if "ADDRESS_INFO" in attr:
                         for addr_info in attr["ADDRESS_INFO"]:
                             self.__dict__[devName+"_"+str(num)] = devClass()
+                            self.attach_bus_pools(self.__dict__[devName+"_"+str(num)])
                             self.__dict__[devName+"_"+str(num)].ADDRESS_INFO = addr_info
                             self.__dict__[devName + "_" + str(num)].DEVICE_NAME = devName+"_"+str(num)
                             num += 1
@@ -45,6 +60,34 @@ class BLIET():
                             self.__dict__[devName+"_"+str(num)].GPIO_PINS = gpio_pins
                             num += 1
 
+                    num = 0
+                    if "PINS" in attr:
+                        for pins in attr["PINS"]:
+                            self.__dict__[devName+"_"+str(num)].PINS = [pins]
+                            num += 1
+
+    def attach_bus_pools(self, dev):
+        """
+        Make a device use the bus handles of the board instead of the default ones.
+        :param dev: Device instance
+        :return: None
+        """
+        if hasattr(dev, "I2C_POOL"):
+            dev.I2C_POOL = self.i2cPool
+        if hasattr(dev, "SPI_POOL"):
+            dev.SPI_POOL = self.spiPool
+        if hasattr(dev, "EXECUTOR"):
+            dev.EXECUTOR = self.executor
+
+    def close(self):
+        """
+        Stop the bus workers and close all the bus handles kept open by the board.
+        :return: None
+        """
+        self.executor.shutdown()
+        self.i2cPool.close()
+        self.spiPool.close()
+
     def __repr__(self):
         return self._name
 
@@ -54,30 +97,27 @@ class BLIET():
     def __getitem__(self, key):
         return self.__dict__[key]
 
-    def runSelftests(self):
-        report = "\n========== DEVICE SELFTEST REPORT ==========\n"
-        report += "Board Name : {BoardName: <20} \n".format(BoardName=self._name)
-        report += '-' * 30 + "\n"
-        failed = 0
-        passed = 0
+    def device_targets(self):
+        """
+        List all the devices of the board, one entry per device number.
+        :return: List of (attribute name, device, devNum, address info)
+        """
+        targets = []
         for key, item in self.__dict__.items():
-            if item.DEVICE_NAME:
-                devNum = 0
-                for addr in item.ADDRESS_INFO:
-                    ret = item.selftest(devNum)
-                    report += '{DeviceName: <10} ::'.format(DeviceName=item.DEVICE_NAME)
-                    report += self.dict2str(addr)
-                    if ret == 0:
-                        report += " ... PASSED \n"
-                        passed += 1
-                    else:
-                        report += " ... FAILED \n"
-                        failed += 1
-                    devNum += 1
-        report += "\n============ SELFTEST SUMMARY ============\n"
-        report += 'PASSED: {Passed: <10}'.format(Passed=passed)
-        report += 'FAILED: {Failed: <10}'.format(Failed=failed)
-        report += "\n========== DEVICE SELFTEST DONE ==========\n"
+            if hasattr(item, "DEVICE_NAME") and isinstance(item.ADDRESS_INFO, list):
+                for devNum, addr in enumerate(item.ADDRESS_INFO):
+                    targets.append((key, item, devNum, addr))
+        return targets
+
+    def runSelftests(self, timeout=SELFTEST_TIMEOUT):
+        """
+        Run the selftests of all the devices. Devices on different buses are tested in parallel.
+        :param timeout: Time in seconds one device selftest may take, None to wait for ever
+        :return: SelftestReport, see devices.selftest
+        """
+        report = run_selftests(self.executor, self.device_targets(), timeout, self._name)
+        _logger.info(report.text())
+        return report
 
     def class_for_name(self, module_name, class_name):
         try:
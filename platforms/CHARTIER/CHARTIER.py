@@ -2,11 +2,18 @@ import json
 from pkg_resources import resource_filename
 import importlib
 import logging
+from devices.busPool import I2CBusPool, SPIBusPool
+from devices.busExecutor import BusExecutor, bus_key
+from devices.selftest import run_selftests
 from devices.remoteCommand import *
 import sys, time, os
+import asyncio
 
 _logger = logging.getLogger(__name__)
 
+''' Time one device selftest may take before it is reported as TIMEOUT, in seconds '''
+SELFTEST_TIMEOUT = 2.0
+
 
 class CHARTIER():
 
@@ -20,6 +27,11 @@ class CHARTIER():
         self.remoteIP = remoteIP
 
         self._name = name
+        ''' Bus handles stay open for the life of the board, see close() '''
+        self.i2cPool = I2CBusPool()
+        self.spiPool = SPIBusPool()
+        ''' One worker per bus for the board-wide operations, see runSelftests(), configure() and snapshot() '''
+        self.executor = BusExecutor()
         self._remoteIP = remoteIP
         self.from_dict_layout(self.layout)
         _logger.info(self.layout2Report(self.layout, name))
@@ -40,10 +52,13 @@ class CHARTIER():
                 # so all instances should be separate
                 if attr['independent'] == False:
                     self.__dict__[devName] = devClass(cmdClass=cmdClass)
+                    self.attach_bus_pools(self.__dict__[devName])
                     if "ADDRESS_INFO" in attr:
                         self.__dict__[devName].ADDRESS_INFO = attr["ADDRESS_INFO"]
                     if "GPIO_PINS" in attr:
                         self.__dict__[devName].GPIO_PINS = attr["GPIO_PINS"]
+                    if "PINS" in attr:
+                        self.__dict__[devName].PINS = attr["PINS"]
                     if hasattr(self.__dict__[devName], 'setup'):
                         self.__dict__[devName].setup()
                     
@@ -52,6 +67,7 @@ class CHARTIER():
                     if "ADDRESS_INFO" in attr:
                         for addr_info in attr["ADDRESS_INFO"]:
                             self.__dict__[devName+"_"+str(num)] = devClass(cmdClass=cmdClass)
+                            self.attach_bus_pools(self.__dict__[devName+"_"+str(num)])
                             self.__dict__[devName+"_"+str(num)].ADDRESS_INFO = addr_info
                             self.__dict__[devName + "_" + str(num)].DEVICE_NAME = devName+"_"+str(num)
                             num += 1
@@ -62,6 +78,34 @@ class CHARTIER():
                             self.__dict__[devName+"_"+str(num)].GPIO_PINS = gpio_pins
                             num += 1
 
+                    num = 0
+                    if "PINS" in attr:
+                        for pins in attr["PINS"]:
+                            self.__dict__[devName+"_"+str(num)].PINS = [pins]
+                            num += 1
+
+
+    def attach_bus_pools(self, dev):
+        """
+        Make a device use the bus handles of the board instead of the default ones.
+        :param dev: Device instance
+        :return: None
+        """
+        if hasattr(dev, "I2C_POOL"):
+            dev.I2C_POOL = self.i2cPool
+        if hasattr(dev, "SPI_POOL"):
+            dev.SPI_POOL = self.spiPool
+        if hasattr(dev, "EXECUTOR"):
+            dev.EXECUTOR = self.executor
+
+    def close(self):
+        """
+        Stop the bus workers and close all the bus handles kept open by the board.
+        :return: None
+        """
+        self.executor.shutdown()
+        self.i2cPool.close()
+        self.spiPool.close()
 
     def __repr__(self):
         return self._name
@@ -72,38 +116,135 @@ class CHARTIER():
     def __getitem__(self, key):
         return self.__dict__[key]
 
-    def runSelftests(self):
-        report = "\n========== DEVICE SELFTEST REPORT ==========\n"
-        report += "Board Name : {BoardName: <20} \n".format(BoardName=self._name)
-        report += '-' * 30 + "\n"
-        failed = 0
-        passed = 0
+    def device_targets(self):
+        """
+        List all the devices of the board, one entry per device number.
+        :return: List of (attribute name, device, devNum, address info)
+        """
+        targets = []
         for key, item in self.__dict__.items():
-            if hasattr(item, "DEVICE_NAME"):
-                devNum = 0
-                if item.ADDRESS_INFO:
-                    for addr in item.ADDRESS_INFO:
-                        _logger.debug(addr)
-                        ret = item.selftest(devNum)
-                        report += '{DeviceName: <10} :: '.format(DeviceName=item.DEVICE_NAME)
-                        report += self.dict2str(addr)
-                        if ret == 0:
-                            report += " ... PASSED \n"
-                            passed += 1
-                        elif ret == 1:
-                            report += " ... SKIPPED \n"
-                            passed += 1
-                        else:
-                            report += " ... FAILED \n"
-                            failed += 1
-                        devNum += 1
-        report += "\n============ SELFTEST SUMMARY ============\n"
-        report += 'PASSED: {Passed: <10}'.format(Passed=passed)
-        report += 'FAILED: {Failed: <10}'.format(Failed=failed)
-        report += "\n========== DEVICE SELFTEST DONE ==========\n"
-
-        _logger.info(report)
+            if hasattr(item, "DEVICE_NAME") and isinstance(item.ADDRESS_INFO, list):
+                for devNum, addr in enumerate(item.ADDRESS_INFO):
+                    targets.append((key, item, devNum, addr))
+        return targets
+
+    def runSelftests(self, timeout=SELFTEST_TIMEOUT):
+        """
+        Run the selftests of all the devices. Devices on different buses are tested in parallel.
+        :param timeout: Time in seconds one device selftest may take, None to wait for ever
+        :return: SelftestReport, see devices.selftest
+        """
+        report = run_selftests(self.executor, self.device_targets(), timeout, self._name)
+        _logger.info(report.text())
+        return report
+
+    async def arunSelftests(self, timeout=SELFTEST_TIMEOUT):
+        """
+        Awaitable runSelftests().
+        :return: SelftestReport
+        """
+        return await asyncio.get_running_loop().run_in_executor(None, self.runSelftests, timeout)
+
+    def configure(self, config):
+        """
+        Write the fields of several devices at once. Devices on different buses are written in parallel. Drivers with
+        an apply_config() only write the registers that change, the others write each device in a single batch when
+        the driver supports it.
+        A tuple value is given as extra arguments, for devices whose writes take more than a value:
+            board.configure({"LMK03318": {0: {"PLL_P": 7, "PLL_NDIV": 40}},
+                             "TCA9539":  {0: {"OUTPUTPORT0": 0xFF}, 3: {"OUTPUTPORT0": 0x0F}},
+                             "AD5668":   {0: {"WRITE_TO_AND_UPDATE_DAC": (2, 0x8000)}}})
+        Nothing is ordered between buses, configure in two calls if a device must be set up before another one.
+        :param config: Dictionary of device name to {devNum: {field name: value}}
+        :return: <0 if any write failed, 0 on success
+        """
+        jobs = self._configure_jobs(config)
+        if jobs is None:
+            return -1
+        return self._configure_result(self.executor.run(jobs))
+
+    async def aconfigure(self, config):
+        """
+        Awaitable configure(), the event loop is free while the devices are written:
+            await board.aconfigure({"LMK03318": {0: {"PLL_P": 7}}})
+        :param config: Dictionary of device name to {devNum: {field name: value}}, see configure()
+        :return: <0 if any write failed, 0 on success
+        """
+        jobs = self._configure_jobs(config)
+        if jobs is None:
+            return -1
+        return self._configure_result(await self.executor.run_async(jobs))
+
+    def _configure_jobs(self, config):
+        jobs = []
+        for devName, devices in config.items():
+            if not hasattr(self.__dict__.get(devName), "DEVICE_NAME"):
+                _logger.error(str(devName) + " is not a device of " + str(self._name) + ". Aborting...")
+                return None
+            dev = self.__dict__[devName]
+            for devNum, fields in devices.items():
+                devNum = int(devNum)
+                jobs.append((bus_key(dev, devNum), self._configure_device, (dev, devNum, fields)))
+        return jobs
+
+    def _configure_result(self, results):
+        if any(ret != 0 for ret in results):
+            _logger.error("Board configuration failed on " + str(results.count(-1)) + " device(s)")
+            return -1
+        return 0
+
+    def _configure_device(self, dev, devNum, fields):
+        ret = 0
+        ''' Only the registers that change are written, when the driver can compare with the device '''
+        if hasattr(dev, "apply_config") and not self._remoteIP:
+            return -1 if dev.apply_config(devNum, fields) < 0 else 0
+        elif hasattr(dev, "batch"):
+            with dev.batch(devNum) as b:
+                for name, value in fields.items():
+                    if self._write_field(dev, devNum, name, value) != 0:
+                        ret = -1
+            if b.result not in (None, 0):
+                ret = -1
+        else:
+            for name, value in fields.items():
+                if self._write_field(dev, devNum, name, value) != 0:
+                    ret = -1
+        return ret
+
+    def _write_field(self, dev, devNum, name, value):
+        if name not in dev.REGISTERS_INFO:
+            _logger.error(str(name) + " is an invalid parameter name for " + str(dev.DEVICE_NAME))
+            return -1
+        if isinstance(value, (tuple, list)):
+            return dev[name](devNum, *value)
+        return dev[name](devNum, value)
+
+    def snapshot(self):
+        """
+        Read all the registers of every device that supports it (see the snapshot() of the drivers). Devices on
+        different buses are read in parallel.
+        :return: Dictionary of device name to a list of {field name: value}, one per device number (-1 on failure)
+        """
+        targets, jobs = self._snapshot_jobs()
+        return self._snapshot_result(targets, self.executor.run(jobs))
+
+    async def asnapshot(self):
+        """
+        Awaitable snapshot().
+        :return: Dictionary of device name to a list of {field name: value}, see snapshot()
+        """
+        targets, jobs = self._snapshot_jobs()
+        return self._snapshot_result(targets, await self.executor.run_async(jobs))
+
+    def _snapshot_jobs(self):
+        targets = [t for t in self.device_targets() if hasattr(t[1], "snapshot")]
+        return targets, [(bus_key(item, devNum), item.snapshot, (devNum,)) for key, item, devNum, addr in targets]
 
+    def _snapshot_result(self, targets, results):
+        snap = {}
+        for (key, item, devNum, addr), values in zip(targets, results):
+            snap.setdefault(key, []).append(values)
+        return snap
 
     def class_for_name(self, module_name, class_name):
         try:
@@ -11,6 +11,7 @@ setup(  name='grams-device-utility',
         author_email='simon.g.carrier@usherbrooke.ca',
         packages=find_packages(),
         install_requires=[
+            'numpy',
             'pip',
             'python-periphery',
             'setuptools',
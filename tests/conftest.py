@@ -0,0 +1,29 @@
+import pytest
+from pkg_resources import resource_filename
+from devices.simulation import use_simulation
+from platforms.CHARTIER.CHARTIER import CHARTIER
+
+'''
+The tests run the drivers on the in-memory buses of devices.simulation, no board needed:
+    python -m pytest tests
+The setup of some drivers waits on their reset pins, so one board is built per test module.
+'''
+
+
+@pytest.fixture(scope="module")
+def layout():
+    return resource_filename("platforms.CHARTIER", "device_layout.json")
+
+
+@pytest.fixture(scope="module")
+def sim(layout):
+    simulation = use_simulation()
+    simulation.populate(layout)
+    return simulation
+
+
+@pytest.fixture(scope="module")
+def board(sim, layout):
+    chartier = CHARTIER(layoutFile=layout)
+    yield chartier
+    chartier.close()
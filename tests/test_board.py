@@ -0,0 +1,30 @@
+def test_build(board):
+    for name in ("AD5668", "LMK61E2", "LMK03318", "LMK04610", "TCA9539", "LMK01020", "TMP1075", "ICYSHSR1"):
+        assert board[name].ADDRESS_INFO
+    assert len(board.device_targets()) == 21
+
+
+def test_selftests(board):
+    report = board.runSelftests()
+    assert report.ok
+    assert report.passed > 0
+
+
+def test_snapshot(board):
+    assert board.configure({"LMK03318": {0: {"PLL_NDIV": 40}},
+                            "TCA9539": {3: {"OUTPUTPORT0": 0x0F}},
+                            "LMK04610": {0: {"PLL2_NDIV": 0x123}}}) == 0
+    snap = board.snapshot()
+    assert len(snap["LMK61E2"]) == 6
+    assert len(snap["TCA9539"]) == 5
+    assert snap["LMK03318"][0]["PLL_NDIV"] == 40
+    assert snap["TCA9539"][3]["OUTPUTPORT0"] == 0x0F
+    assert snap["LMK04610"][0]["PLL2_NDIV"] == 0x123
+
+
+def test_snapshot_matches_reads(board):
+    snap = board.snapshot()
+    dev = board.LMK04610
+    for name in ("PLL2_NDIV", "PLL1_NDIV", "PLL2_RDIV"):
+        if name in dev.REGISTERS:
+            assert snap["LMK04610"][0][name] == dev.read_param(0, name)
@@ -0,0 +1,159 @@
+import threading
+import numpy as np
+import pytest
+
+
+@pytest.mark.parametrize("device, devNum, fields", [
+    ("LMK03318", 0, {"PLL_NDIV": 40, "PLL_P": 7}),
+    ("LMK61E2", 3, {"NDIV": 50, "PLL_PDN": 1}),
+    ("TCA9539", 2, {"OUTPUTPORT0": 0x5A, "OUTPUTPORT1": 0xA5}),
+    ("LMK04610", 0, {"PLL2_NDIV": 0x123, "PLL1_NDIV": 0x34}),
+    ("TMP1075", 1, {"L": 0x123, "H": 0x456}),
+])
+def test_read_write(board, device, devNum, fields):
+    dev = board[device]
+    for name, value in fields.items():
+        assert dev.write_param(devNum, name, value) == 0
+    for name, value in fields.items():
+        assert dev.read_param(devNum, name) == value
+
+
+@pytest.mark.parametrize("device, devNum, fields", [
+    ("LMK03318", 0, {"PLL_NDIV": 41, "PLL_P": 6}),
+    ("LMK61E2", 3, {"NDIV": 51, "PLL_PDN": 0}),
+    ("TCA9539", 2, {"OUTPUTPORT0": 0x3C, "OUTPUTPORT1": 0xC3}),
+    ("LMK04610", 0, {"PLL2_NDIV": 0x124, "PLL1_NDIV": 0x35}),
+])
+def test_batch(board, sim, device, devNum, fields):
+    dev = board[device]
+    sim.reset_counts()
+    with dev.batch(devNum) as b:
+        for name, value in fields.items():
+            assert b.write(name, value) == 0
+        ''' Nothing is sent before the block exits '''
+        assert sim.counts.get("spi", 0) + sim.counts.get("i2c", 0) == 0
+    assert b.result == 0
+    for name, value in fields.items():
+        assert dev.read_param(devNum, name) == value
+
+
+@pytest.mark.parametrize("device, devNum, fields", [
+    ("LMK03318", 0, {"PLL_NDIV": 42, "PLL_P": 5}),
+    ("LMK61E2", 3, {"NDIV": 52, "PLL_PDN": 1}),
+    ("TCA9539", 2, {"OUTPUTPORT0": 0x0F, "OUTPUTPORT1": 0xF0}),
+])
+def test_apply_config(board, device, devNum, fields):
+    dev = board[device]
+    assert dev.apply_config(devNum, fields) > 0
+    for name, value in fields.items():
+        assert dev.read_param(devNum, name) == value
+    ''' Nothing changes the second time '''
+    assert dev.apply_config(devNum, fields) == 0
+
+
+def test_lmk04610_batch_wide_field(board, sim):
+    ''' Fields with a mask wider than their register keep the bits the register holds, like write_param() '''
+    dev = board.LMK04610
+    assert board.configure({"LMK04610": {0: {"PLL1_HOLDOVER_MAX_CNT": 0xFFFFFFFF}}}) == 0
+    info = dev.REGISTERS["PLL1_HOLDOVER_MAX_CNT"]
+    assert sim.spi[dev.ADDRESS_INFO[0]["path"]].registers[info.addr] == 0xFF
+
+
+def test_lmk01020_write(board, sim):
+    dev = board.LMK01020
+    info = dev.REGISTERS["CLKOUT0_DIV"]
+    assert dev.write_param(0, "CLKOUT0_DIV", 5) == 0
+    assert sim.spi[dev.ADDRESS_INFO[0]["path"]].words[info.addr] & info.mask == 5 << info.loc
+
+    with dev.batch(1) as b:
+        b.write("CLKOUT0_DIV", 7)
+        b.write("CLKOUT0_EN", 1)
+    assert b.result == 0
+    word = sim.spi[dev.ADDRESS_INFO[1]["path"]].words[info.addr]
+    assert word & info.mask == 7 << info.loc
+    enInfo = dev.REGISTERS["CLKOUT0_EN"]
+    assert word & enInfo.mask == 1 << enInfo.loc
+
+
+def test_ad5668_set_voltages(board, sim):
+    dev = board.AD5668
+    assert dev.set_voltages(0, [0x8000, 0xFFFF], codes=True, dacs=[2, 5]) == 0
+    ''' Last code sent to each DAC '''
+    codes = dict(((word >> 20) & 0xF, (word >> 4) & 0xFFFF) for word in sim.spi[dev.ADDRESS_INFO[0]["path"]].words.values())
+    assert codes[2] == 0x8000
+    assert codes[5] == 0xFFFF
+
+
+def test_ad5668_to_codes(board):
+    dev = board.AD5668
+    assert list(dev.to_codes([0.0, dev.FULL_SCALE / 2, dev.FULL_SCALE])) == [0, 0x8000, 0xFFFF]
+    assert dev.to_codes(dev.FULL_SCALE * 1.01) is None
+    assert dev.to_codes(-0.1) is None
+
+
+def test_ad5668_sweep_stop(board):
+    dev = board.AD5668
+    sweep = dev.sweep(0, np.linspace(0.0, 2.0, 10), period=0.0005, dacs=[3], repeat=0)
+    sweep.start()
+    ''' A stop() right after start() ends the sweep '''
+    result = [None]
+    stopper = threading.Thread(target=lambda: result.__setitem__(0, sweep.stop()))
+    stopper.start()
+    stopper.join(5.0)
+    assert not stopper.is_alive()
+    assert result[0].ok
+
+
+def test_tmp1075_sampler_without_devices():
+    from devices.texasInstruments.TMP1075 import TMP1075
+    assert TMP1075().sampler() is None
+
+
+def test_lmk04610_selftest_reads_device(board, sim):
+    ''' A chip that stopped answering fails its selftest, even with the ID in the register cache '''
+    dev = board.LMK04610
+    info = dev.REGISTERS["VENDORID"]
+    registers = sim.spi[dev.ADDRESS_INFO[0]["path"]].registers
+    assert dev.selftest(0) == 0
+    saved = registers[info.addr:info.addr + info.regs]
+    registers[info.addr:info.addr + info.regs] = bytes(info.regs)
+    try:
+        assert dev.selftest(0) == -1
+    finally:
+        registers[info.addr:info.addr + info.regs] = saved
+    assert dev.selftest(0) == 0
+
+
+@pytest.mark.parametrize("device, devNum", [("LMK03318", 0), ("LMK61E2", 4)])
+def test_i2c_selftest_reads_device(board, sim, device, devNum):
+    dev = board[device]
+    dev.cache_enable(devNum)
+    info = dev.REGISTERS["VNDRID"]
+    chip = sim.i2c_device(dev.ADDRESS_INFO[devNum]["ch"], dev.ADDRESS_INFO[devNum]["addr"])
+    assert dev.selftest(devNum) == 0
+    saved = chip.read(info.addr, info.regs)
+    chip.write(info.addr, [0] * info.regs)
+    try:
+        assert dev.selftest(devNum) == -1
+    finally:
+        chip.write(info.addr, saved)
+        dev.cache_enable(devNum, False)
+    assert dev.selftest(devNum) == 0
+
+
+@pytest.mark.parametrize("device, devNum", [("LMK03318", 0), ("LMK61E2", 5)])
+def test_i2c_register_cache(board, sim, device, devNum):
+    dev = board[device]
+    dev.cache_enable(devNum)
+    try:
+        with dev.batch(devNum) as b:
+            b.write("PLL_PDN", 1)
+        assert b.result == 0
+        assert dev.apply_config(devNum, {"PLL_PDN": 0}) == 1
+        sim.reset_counts()
+        assert dev.read_param(devNum, "PLL_PDN") == 0
+        assert sim.counts.get("i2c", 0) == 0
+        assert dev.refresh(devNum) == 0
+        assert dev.read_param(devNum, "PLL_PDN") == 0
+    finally:
+        dev.cache_enable(devNum, False)